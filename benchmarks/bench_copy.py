@@ -0,0 +1,99 @@
+'''
+Compare the throughput of the file copy backends of `directsync.copying`.
+
+Usage:
+    python benchmarks/bench_copy.py [--dir DIR] [--sizes-mb 1 64 512]
+    sudo python benchmarks/bench_copy.py --loopback btrfs
+
+By default the files are copied inside a temporary directory. With
+`--loopback FSTYPE`, a filesystem image of that type is created with
+`mkfs.FSTYPE`, loop-mounted and used instead (needs root); use `btrfs` or
+`xfs` to see reflinks in action.
+'''
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from directsync.copying import BACKENDS, copy_file  # noqa: E402
+
+
+def make_file(path, size):
+    chunk = os.urandom(min(size, 1048576))
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
+
+
+def run_benchmark(dir_path, sizes_mb, repeat):
+    for size_mb in sizes_mb:
+        size = size_mb * 1048576
+        src = os.path.join(dir_path, 'src')
+        dst = os.path.join(dir_path, 'dst')
+        make_file(src, size)
+        print('{} MB file:'.format(size_mb))
+        for backend in list(BACKENDS) + ['shutil.copyfile']:
+            best = None
+            for _ in range(repeat):
+                if os.path.exists(dst):
+                    os.unlink(dst)
+                start = time.perf_counter()
+                try:
+                    if backend == 'shutil.copyfile':
+                        shutil.copyfile(src, dst)
+                    else:
+                        copy_file(src, dst, backends=[backend])
+                except OSError as err:
+                    best = err
+                    break
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            if isinstance(best, OSError):
+                print('  {:<16} unsupported ({})'.format(backend, best))
+            else:
+                print('  {:<16} {:>8.3f} s {:>10.1f} MB/s'.format(
+                    backend, best, size_mb / best))
+        os.unlink(src)
+        if os.path.exists(dst):
+            os.unlink(dst)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dir', help='The directory to copy the files in.')
+    parser.add_argument('--loopback', metavar='FSTYPE',
+                        help='Benchmark on a loop-mounted FSTYPE image.')
+    parser.add_argument('--image-size-mb', type=int, default=4096)
+    parser.add_argument('--sizes-mb', type=int, nargs='+',
+                        default=[1, 64, 512])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dir_path = args.dir or tmp_dir
+        mount_point = None
+        if args.loopback:
+            image = os.path.join(tmp_dir, 'image')
+            mount_point = os.path.join(tmp_dir, 'mnt')
+            os.mkdir(mount_point)
+            with open(image, 'wb') as f:
+                f.truncate(args.image_size_mb * 1048576)
+            subprocess.check_call(['mkfs.' + args.loopback, '-q', image])
+            subprocess.check_call(['mount', '-o', 'loop', image, mount_point])
+            dir_path = mount_point
+        try:
+            run_benchmark(dir_path, args.sizes_mb, args.repeat)
+        finally:
+            if mount_point:
+                subprocess.check_call(['umount', mount_point])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+'''
+Benchmark the phases of a DirectSync run on synthetic trees.
+
+Usage:
+    python benchmarks/bench_directsync.py [--depth 3] [--fan-out 4]
+        [--files 10] [--size-distribution small] [--missing 0.05]
+        [--extra 0.05] [--modified 0.05] [--jobs 1] [--output out.json]
+
+A reproducible pair of src/dst trees is generated (see `synthetic_tree.py`)
+and `check_differences()`, `get_report()` and `sync_dirs()` (mirroring the
+trees) are timed separately. For every phase, the wall and CPU times, the
+syscalls and bytes of I/O (from `/proc/self/io`, on Linux) and the peak RSS
+so far are recorded.
+
+The results are printed, and written as JSON with `--output`, so that runs
+of different versions can be compared. The trees are generated from
+scratch for every repetition, so the page cache is warm; drop it in between
+for cold numbers.
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from directsync.__version__ import __version__  # noqa: E402
+from directsync.core import DirectSync  # noqa: E402
+from synthetic_tree import SIZE_DISTRIBUTIONS, make_tree_pair  # noqa: E402
+
+
+def read_io_counters():
+    '''
+    The I/O counters of this process, or an empty dict where
+    `/proc/self/io` is not available.
+    '''
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in
+                    (line.split(':') for line in f)}
+    except OSError:
+        return {}
+
+
+def get_peak_rss():
+    '''
+    The peak resident set size of this process so far, in bytes.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # It is in bytes on macOS, and in KB elsewhere.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(function):
+    '''
+    Call `function`, returning its result and its metrics.
+    '''
+    io_before = read_io_counters()
+    times_before = os.times()
+    start = time.perf_counter()
+    result = function()
+    wall_time = time.perf_counter() - start
+    times_after = os.times()
+    io_after = read_io_counters()
+    metrics = {
+        'wall_seconds': wall_time,
+        'user_seconds': times_after.user - times_before.user,
+        'system_seconds': times_after.system - times_before.system,
+        'peak_rss_bytes': get_peak_rss(),
+    }
+    for key in io_after:
+        metrics['io_' + key] = io_after[key] - io_before.get(key, 0)
+    return result, metrics
+
+
+def run_once(args, seed):
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        src, dst, tree_stats = make_tree_pair(
+            root, depth=args.depth, fan_out=args.fan_out,
+            files_per_dir=args.files,
+            size_distribution=args.size_distribution, missing=args.missing,
+            extra=args.extra, modified=args.modified, seed=seed)
+        direct_sync = DirectSync(src, dst, jobs=args.jobs,
+                                 compare_mode=args.compare_mode)
+        phases = {}
+        _, phases['check_differences'] = measure(
+            direct_sync.check_differences)
+        _, phases['get_report'] = measure(direct_sync.get_report)
+        _, phases['sync_dirs'] = measure(
+            lambda: direct_sync.sync_dirs(True, True, True, args.dry_run,
+                                          False, False))
+        differences = {
+            'content': len(direct_sync.dirs_data.content_diff),
+            'extra_src': len(direct_sync.dirs_data.data_src.diff),
+            'extra_dst': len(direct_sync.dirs_data.data_dst.diff),
+        }
+        return {'tree': tree_stats, 'differences': differences,
+                'phases': phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fan-out', type=int, default=4)
+    parser.add_argument('--files', type=int, default=10,
+                        help='The number of files per directory.')
+    parser.add_argument('--size-distribution', default='small',
+                        choices=sorted(SIZE_DISTRIBUTIONS))
+    parser.add_argument('--missing', type=float, default=0.05,
+                        help='The fraction of the files only in src.')
+    parser.add_argument('--extra', type=float, default=0.05,
+                        help='The fraction of the files only in dst.')
+    parser.add_argument('--modified', type=float, default=0.05,
+                        help='The fraction of the files which differ.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--compare-mode', default='sampled')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only simulate the sync.')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--dir', help='Where to generate the trees.')
+    parser.add_argument('--output', help='The JSON file to write.')
+    args = parser.parse_args()
+
+    results = {
+        'directsync_version': __version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'runs': [run_once(args, args.seed) for _ in range(args.repeat)],
+    }
+    tree_stats = results['runs'][0]['tree']
+    print('{} dirs, {} files, {} bytes'.format(
+        tree_stats['dirs'], tree_stats['files'], tree_stats['bytes']))
+    print('{:<18} {:>10} {:>10} {:>10} {:>12}'.format(
+        'phase', 'wall (s)', 'cpu (s)', 'syscalls', 'read (bytes)'))
+    for phase in ('check_differences', 'get_report', 'sync_dirs'):
+        metrics = min((run['phases'][phase] for run in results['runs']),
+                      key=lambda x: x['wall_seconds'])
+        print('{:<18} {:>10.3f} {:>10.3f} {:>10} {:>12}'.format(
+            phase, metrics['wall_seconds'],
+            metrics['user_seconds'] + metrics['system_seconds'],
+            metrics.get('io_syscr', 0) + metrics.get('io_syscw', 0),
+            metrics.get('io_rchar', '-')))
+    print('Peak RSS: {} bytes'.format(max(
+        run['phases']['sync_dirs']['peak_rss_bytes']
+        for run in results['runs'])))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
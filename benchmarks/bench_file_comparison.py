@@ -0,0 +1,71 @@
+'''
+Compare the throughput of the byte-to-byte file comparison backends.
+
+Usage:
+    python benchmarks/bench_file_comparison.py [--sizes-mb 1 64 512]
+
+Every backend compares 2 identical files of each size, so that the files
+are read till the end. Run it twice to see the numbers with a warm page
+cache.
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from directsync.file_comparison import compare_file_contents,\
+    compare_file_contents_buffered, compare_file_contents_mmap,\
+    compare_file_contents_readinto, get_buffer_size  # noqa: E402
+
+
+def make_file_pair(dir_path, size):
+    paths = [os.path.join(dir_path, name) for name in ('a', 'b')]
+    chunk = os.urandom(min(size, 1048576))
+    for path in paths:
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                f.write(chunk[:remaining])
+                remaining -= len(chunk)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes-mb', type=int, nargs='+',
+                        default=[1, 64, 512])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for size_mb in args.sizes_mb:
+        size = size_mb * 1048576
+        buffer_size = get_buffer_size(size)
+        backends = [
+            ('buffered (100 KB)', lambda a, b: compare_file_contents_buffered(
+                a, b)),
+            ('readinto', lambda a, b: compare_file_contents_readinto(
+                a, b, buffer_size)),
+            ('mmap', lambda a, b: compare_file_contents_mmap(
+                a, b, buffer_size)),
+            ('auto', compare_file_contents),
+        ]
+        with tempfile.TemporaryDirectory() as dir_path:
+            path1, path2 = make_file_pair(dir_path, size)
+            print('{} MB files (buffer size {} KB):'.format(
+                size_mb, buffer_size // 1024))
+            for name, backend in backends:
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    assert backend(path1, path2)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                print('  {:<20} {:>8.3f} s {:>10.1f} MB/s'.format(
+                    name, best, 2 * size_mb / best))
+
+
+if __name__ == '__main__':
+    main()
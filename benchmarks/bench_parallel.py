@@ -0,0 +1,82 @@
+'''
+Measure how `DirectSync.check_differences()` scales with `jobs`.
+
+Usage:
+    python benchmarks/bench_parallel.py [--latency MS] [--file-latency MS]
+        [--jobs 1 2 4 8] [--async]
+
+A synthetic pair of almost identical trees is generated in a temporary
+directory. `--latency` adds an artificial delay to every directory read,
+and `--file-latency` to every comparison of 2 files; which emulates a
+network share on a local disk. With `--async`, `AsyncDirectSync` is
+measured instead of `DirectSync`.
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from directsync import async_engine, core  # noqa: E402
+from directsync.async_engine import AsyncDirectSync  # noqa: E402
+from directsync.core import DirectSync  # noqa: E402
+from synthetic_tree import make_tree_pair  # noqa: E402
+
+
+def with_latency(function, latency):
+    def delayed_function(*args):
+        time.sleep(latency)
+        return function(*args)
+    return delayed_function
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fan-out', type=int, default=5)
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Delay in milliseconds per directory read.')
+    parser.add_argument('--file-latency', type=float, default=0,
+                        help='Delay in milliseconds per file comparison.')
+    parser.add_argument('--jobs', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16])
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Measure `AsyncDirectSync`.')
+    args = parser.parse_args()
+
+    if args.latency:
+        core.scan_dir = with_latency(core.scan_dir, args.latency / 1000)
+        async_engine.scan_dir = core.scan_dir
+    if args.file_latency:
+        DirectSync._are_files_equal = with_latency(
+            DirectSync._are_files_equal, args.file_latency / 1000)
+    engine = AsyncDirectSync if args.use_async else DirectSync
+
+    with tempfile.TemporaryDirectory() as root:
+        # A few differences, so that the results are not empty.
+        src, dst, _ = make_tree_pair(
+            root, args.depth, args.fan_out, args.files, missing=0.01,
+            extra=0.01, modified=0.01)
+        reference_report = None
+        print('{:>6} {:>10} {:>8}'.format('jobs', 'seconds', 'speedup'))
+        baseline = None
+        for jobs in args.jobs:
+            direct_sync = engine(src, dst, jobs=jobs)
+            start = time.perf_counter()
+            direct_sync.check_differences()
+            elapsed = time.perf_counter() - start
+            report = direct_sync.get_report()
+            if reference_report is None:
+                reference_report = report
+            elif report != reference_report:
+                raise Exception('Report for {} jobs differs!'.format(jobs))
+            baseline = baseline or elapsed
+            print('{:>6} {:>10.3f} {:>7.2f}x'.format(
+                jobs, elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+'''
+Generate reproducible pairs of synthetic src/dst trees for the benchmarks.
+
+The same arguments (including `seed`) always generate the same trees, so
+that the numbers of different versions of directsync can be compared.
+'''
+import os
+import random
+
+# Functions returning a random file size, given a `random.Random`.
+SIZE_DISTRIBUTIONS = {
+    'empty': lambda rng: 0,
+    # Mostly a few KB, like source code.
+    'small': lambda rng: min(int(rng.lognormvariate(8, 1.5)), 1048576),
+    # Mostly small files, with a tail of up to 64 MB.
+    'mixed': lambda rng: min(int(rng.lognormvariate(10, 3)), 67108864),
+    # Between 1 and 64 MB, like media files.
+    'large': lambda rng: rng.randint(1048576, 67108864),
+}
+
+# The size of the random pattern repeated to fill the files.
+_PATTERN_SIZE = 65536
+
+
+def _write_file(file_path, size, rng):
+    pattern = rng.getrandbits(_PATTERN_SIZE * 8).to_bytes(_PATTERN_SIZE,
+                                                          'little')
+    with open(file_path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(pattern[:remaining])
+            remaining -= len(pattern)
+
+
+def _modify_file(file_path, size, rng):
+    '''
+    Modify a copy of a file; either by changing a single byte, which keeps
+    the size the same, or by appending to it.
+    '''
+    if size and rng.random() < 0.5:
+        with open(file_path, 'r+b') as f:
+            f.seek(rng.randrange(size))
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xff]))
+    else:
+        with open(file_path, 'ab') as f:
+            f.write(b'modified')
+
+
+def make_tree_pair(root, depth=3, fan_out=4, files_per_dir=10,
+                   size_distribution='small', missing=0.05, extra=0.05,
+                   modified=0.05, seed=0):
+    '''
+    Create the directory trees `root/src` and `root/dst`, with `fan_out`
+    subdirectories per directory down to `depth` levels, and
+    `files_per_dir` files per directory.
+    Of the files, a fraction `missing` is only created in src, `extra` only
+    in dst, `modified` differs between src and dst; and the rest is
+    identical. A whole directory is missing or extra with the same
+    probabilities, and is then counted as a single missing or extra item.
+    Returns the paths of the 2 trees, and statistics about them.
+    '''
+    rng = random.Random(seed)
+    get_size = SIZE_DISTRIBUTIONS[size_distribution]
+    stats = {'dirs': 0, 'files': 0, 'bytes': 0, 'missing': 0, 'extra': 0,
+             'modified': 0}
+
+    def make_file(rel_path):
+        size = get_size(rng)
+        draw = rng.random()
+        if draw < missing:
+            sides = ('src',)
+            stats['missing'] += 1
+        elif draw < missing + extra:
+            sides = ('dst',)
+            stats['extra'] += 1
+        else:
+            sides = ('src', 'dst')
+        # Use the same generator state for both sides, so that they are
+        # identical until modified.
+        state = rng.getstate()
+        for side in sides:
+            rng.setstate(state)
+            _write_file(os.path.join(root, side, rel_path), size, rng)
+        if len(sides) == 2 and draw < missing + extra + modified:
+            _modify_file(os.path.join(root, 'dst', rel_path), size, rng)
+            stats['modified'] += 1
+        stats['files'] += len(sides)
+        stats['bytes'] += size * len(sides)
+
+    def make_dir(rel_path, level, sides):
+        for side in sides:
+            os.makedirs(os.path.join(root, side, rel_path), exist_ok=True)
+            stats['dirs'] += 1
+        for i in range(files_per_dir):
+            file_rel_path = os.path.join(rel_path, 'file{}.bin'.format(i))
+            if len(sides) == 2:
+                make_file(file_rel_path)
+            else:
+                size = get_size(rng)
+                _write_file(os.path.join(root, sides[0], file_rel_path),
+                            size, rng)
+                stats['files'] += 1
+                stats['bytes'] += size
+        if level < depth:
+            for i in range(fan_out):
+                sub_sides = sides
+                draw = rng.random()
+                if len(sides) == 2 and draw < missing:
+                    sub_sides = ('src',)
+                    stats['missing'] += 1
+                elif len(sides) == 2 and draw < missing + extra:
+                    sub_sides = ('dst',)
+                    stats['extra'] += 1
+                make_dir(os.path.join(rel_path, 'dir{}'.format(i)),
+                         level + 1, sub_sides)
+
+    make_dir('', 0, ('src', 'dst'))
+    return os.path.join(root, 'src'), os.path.join(root, 'dst'), stats
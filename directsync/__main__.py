@@ -1,20 +1,49 @@
 from pathlib import Path
+import json
+import sys
 
+from .async_engine import AsyncDirectSync
 from .core import DirectSync
+from .fanout import FanOutSync
 from .args_parsing import prepare_args_parser
-from .serialization import serialize_directsync, deserialize_directsync,\
+from .serialization import serialize_directsync, load_cached_differences,\
                            get_serialization_filepath
+from .stats import run_profiled
+from .watch import DirWatch
 
 
 def main():
     args = prepare_args_parser()
+    if args['profile']:
+        run_profiled(lambda: run(args), args['profile'])
+    else:
+        run(args)
+
+
+def print_stats(direct_sync, stats_path):
+    '''
+    Print the stats of `direct_sync`, or write them to `stats_path` as JSON
+    unless it is `-`.
+    '''
+    if stats_path == '-':
+        print(direct_sync.get_stats_report(), end='')
+    else:
+        with open(stats_path, 'w') as stats_file:
+            json.dump(direct_sync.get_stats(), stats_file, indent=2,
+                      sort_keys=True)
+
+
+def run(args):
     src_dir_path = args['src-path']
-    dst_dir_path = args['dst-path']
+    dst_dir_paths = args['dst-path']
     print('src directory = "{}"'.format(Path(src_dir_path).resolve()))
-    print('dst directory = "{}"\n'.format(Path(dst_dir_path).resolve()))
+    for dst_dir_path in dst_dir_paths:
+        print('dst directory = "{}"'.format(Path(dst_dir_path).resolve()))
+    print('')
 
     hide_progress_bar = args['hide_progress_bar']
     use_cache = args['use_cache']
+    resume = args['resume']
     add_missing = args['add_missing']
     remove_extra = args['remove_extra']
     overwrite_content = args['overwrite_content']
@@ -22,33 +51,178 @@ def main():
     use_trash = args['use_trash']
     dry_run = args['dry_run']
     preserve_latest = args['preserve_latest']
+    jobs = args['jobs']
+    async_engine = args['async_engine']
+    use_index = args['use_index'] or args['skip_unchanged_dirs']
+    skip_unchanged_dirs = args['skip_unchanged_dirs']
+    compare_mode = args['compare_mode']
+    hash_algorithm = args['hash_algorithm']
+    delta_mode = args['delta_mode']
+    delta_threshold = args['delta_threshold']
+    stream = args['stream']
+    stats_path = args['stats']
+    watch = args['watch']
+    ignore_rules = args['ignore_rules']
+    ignore_file_name = args['ignore_file']
+    symlinks = args['symlinks']
+    preserve_hardlinks = args['preserve_hardlinks']
+    detect_moves = args['detect_moves']
+    use_digests = args['use_digests']
+    export_manifest = args['export_manifest']
+    comparison_options = {}
+    if compare_mode == 'sampled':
+        comparison_options = {
+            'threshold': args['sample_threshold'],
+            'sample_count': args['sample_count'],
+            'block_size': args['sample_block_size'],
+            'seed': args['sample_seed'],
+            'check_text': not args['no_text_check'],
+        }
+    elif compare_mode in ('mtime', 'mtime-content'):
+        comparison_options = {'modify_window': args['modify_window']}
+
+    if mirror:
+        add_missing = True
+        remove_extra = True
+        overwrite_content = True
 
-    direct_sync = DirectSync(
-        src_dir_path, dst_dir_path, show_progress_bar=not hide_progress_bar)
-    if use_cache and get_serialization_filepath(direct_sync).exists():
+    options = dict(
+        jobs=jobs, use_index=use_index,
+        skip_unchanged_dirs=skip_unchanged_dirs, compare_mode=compare_mode,
+        comparison_options=comparison_options, hash_algorithm=hash_algorithm,
+        delta_mode=delta_mode, delta_threshold=delta_threshold,
+        collect_stats=stats_path is not None, ignore_rules=ignore_rules,
+        ignore_file_name=ignore_file_name, symlinks=symlinks,
+        preserve_hardlinks=preserve_hardlinks, detect_moves=detect_moves,
+        use_digests=use_digests)
+    if use_digests and not skip_unchanged_dirs:
+        raise Exception('`-digests` needs `-skip-dirs`!')
+    if export_manifest:
+        if len(dst_dir_paths) > 1:
+            raise Exception('`-export` writes a single manifest!')
+        # Only the src tree is read.
+        direct_sync = DirectSync(src_dir_path, src_dir_path, **options)
+        count = direct_sync.export_manifest(
+            dst_dir_paths[0], with_hashes=compare_mode == 'checksum')
+        print('Listed {} items in the manifest "{}".'.format(
+            count, dst_dir_paths[0]))
+        if stats_path:
+            print_stats(direct_sync, stats_path)
+        print('')
+        return
+    if len(dst_dir_paths) > 1:
+        if watch or stream or async_engine or resume:
+            raise Exception('`-watch`, `-stream`, `-async` and `-resume` only'
+                            ' support a single destination!')
+        fan_out = FanOutSync(src_dir_path, dst_dir_paths, **options)
+        run_fan_out(fan_out, use_cache, overwrite_content, add_missing,
+                    remove_extra, dry_run, use_trash, preserve_latest)
+        if stats_path:
+            print_stats(fan_out.syncs[0], stats_path)
+        print('')
+        return
+    engine = AsyncDirectSync if async_engine else DirectSync
+    direct_sync = engine(
+        src_dir_path, dst_dir_paths[0],
+        show_progress_bar=not (hide_progress_bar or stream or watch),
+        use_journal=True, **options)
+    if resume:
+        # The cache is invalidated by the sync.
+        if get_serialization_filepath(direct_sync).exists():
+            get_serialization_filepath(direct_sync).unlink()
+        if direct_sync.resume_sync():
+            print(direct_sync.copy_stats.get_report(), end='')
+            print(direct_sync.get_failures_report(), end='')
+        else:
+            print('No interrupted sync to resume!')
+        if stats_path:
+            print_stats(direct_sync, stats_path)
+        print('')
+        return
+    if watch:
+        dir_watch = DirWatch(direct_sync, overwrite_content, add_missing,
+                             remove_extra, dry_run, use_trash,
+                             preserve_latest)
+        print('Watching for changes; press Ctrl+C to stop.\n')
+        try:
+            dir_watch.run(args['debounce'], args['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        if stats_path:
+            print_stats(direct_sync, stats_path)
+        print('')
+        return
+    if stream:
+        # Report and sync the differences as they are found; nothing is
+        # cached as nothing is stored.
+        events = direct_sync.report_events(direct_sync.iter_differences(),
+                                           sys.stdout)
+        if add_missing or remove_extra or overwrite_content:
+            direct_sync.sync_events(
+                events, overwrite_content, add_missing, remove_extra,
+                dry_run, use_trash, preserve_latest, stream=sys.stdout)
+            print(direct_sync.copy_stats.get_report(), end='')
+            print(direct_sync.get_failures_report(), end='')
+        else:
+            for _ in events:
+                pass
+        if stats_path:
+            print_stats(direct_sync, stats_path)
+        print('')
+        return
+    if use_cache and load_cached_differences([direct_sync]):
         print('Loading from cache!\n')
-        direct_sync = deserialize_directsync(direct_sync)
-        direct_sync.show_progress_bar = not hide_progress_bar
     else:
         direct_sync.check_differences()
         print('Creating cache!\n')
         serialize_directsync(direct_sync)
     print(direct_sync.get_report())
-    if mirror:
-        add_missing = True
-        remove_extra = True
-        overwrite_content = True
     if add_missing or remove_extra or overwrite_content:
+        # Delete cache as it is about to be possibly invalidated; even if
+        # the sync is interrupted.
+        if not dry_run and get_serialization_filepath(direct_sync).exists():
+            get_serialization_filepath(direct_sync).unlink()
         dry_run_report = direct_sync.sync_dirs(
             overwrite_content, add_missing, remove_extra,
             dry_run, use_trash, preserve_latest)
         if dry_run:
             print(dry_run_report)
-        # Delete cache as it has been possibly invalidated.
-        if not dry_run and get_serialization_filepath(direct_sync).exists():
-            get_serialization_filepath(direct_sync).unlink()
+        print(direct_sync.copy_stats.get_report(), end='')
+        print(direct_sync.get_failures_report(), end='')
+    if stats_path:
+        print_stats(direct_sync, stats_path)
     print('')
 
 
+def run_fan_out(fan_out, use_cache, overwrite_content, add_missing,
+                remove_extra, dry_run, use_trash, preserve_latest):
+    '''
+    The part of `run()` for several destinations, with a `FanOutSync`.
+    '''
+    if use_cache and load_cached_differences(fan_out.syncs):
+        print('Loading from cache!\n')
+    else:
+        fan_out.check_differences()
+        print('Creating cache!\n')
+        for direct_sync in fan_out.syncs:
+            serialize_directsync(direct_sync)
+    for direct_sync in fan_out.syncs:
+        print('For "{}":'.format(direct_sync.dirs_data.data_dst.path))
+        print(direct_sync.get_report())
+    if add_missing or remove_extra or overwrite_content:
+        # Delete the caches as they are about to be possibly invalidated.
+        for direct_sync in fan_out.syncs:
+            if not dry_run and \
+                    get_serialization_filepath(direct_sync).exists():
+                get_serialization_filepath(direct_sync).unlink()
+        dry_run_report = fan_out.sync_dirs(
+            overwrite_content, add_missing, remove_extra,
+            dry_run, use_trash, preserve_latest)
+        if dry_run:
+            print(dry_run_report)
+        print(fan_out.copy_stats.get_report(), end='')
+        print(fan_out.get_failures_report(), end='')
+
+
 if __name__ == "__main__":
     main()
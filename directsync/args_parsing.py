@@ -1,6 +1,11 @@
 import argparse
 import os
 
+from .comparison import COMPARISONS, COMPARISON_ALIASES
+from .hashing import get_hash_algorithms
+from .ignore import IGNORE_FILE_NAME
+from .traversal import SYMLINK_POLICIES
+
 
 def _get_version():
     '''
@@ -30,9 +35,15 @@ def prepare_args_parser():
         epilog=epilog,
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument(
-        'src-path', help='The path of the source directory.')
+        'src-path',
+        help='The path of the source directory; or of a manifest of it (see\
+            `-export`), to only compare against it.')
     parser.add_argument(
-        'dst-path', help='The path of the destination directory.')
+        'dst-path',
+        nargs='+',
+        help='The path of the destination directory, or of a manifest of it;\
+            or of several directories, which are then compared with (and\
+            synced from) a single read of the source directory.')
     parser.add_argument(
         '-add',
         '--add-missing',
@@ -65,6 +76,13 @@ def prepare_args_parser():
         action='store_true',
         help='Whether to use previously cached comparison-check result from\
             disk.')
+    parser.add_argument(
+        '-resume',
+        '--resume',
+        action='store_true',
+        help='Finish the last sync of these directories, if it was\
+            interrupted or some items failed; only doing what was left,\
+            without comparing the directories again.')
     parser.add_argument(
         '-latest',
         '--preserve-latest',
@@ -82,8 +100,222 @@ def prepare_args_parser():
         '--hide-progress-bar',
         action='store_true',
         help='Whether to hide the progress bar or not. \
-            Will result in a huge speedup iff the 2 directories \
-            are structured very differently.')
+            Its total is an estimate, based on the previous run if any.')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='The number of directory pairs to compare in parallel.\
+            Helps a lot on network shares and spinning disks.')
+    parser.add_argument(
+        '-async',
+        '--async-engine',
+        action='store_true',
+        help='Compare the directories on an asyncio event loop, with up to\
+            `-j` directory reads and file comparisons in flight; including\
+            the files of a same directory. For high-latency filesystems.')
+    parser.add_argument(
+        '-index',
+        '--use-index',
+        action='store_true',
+        help='Keep a persistent index of the file metadata and content\
+            hashes of both directories on disk, so that later runs only\
+            read the files modified in between.')
+    parser.add_argument(
+        '-skip-dirs',
+        '--skip-unchanged-dirs',
+        action='store_true',
+        help='Along with `-index`, do not compare the files of directories\
+            which were identical on the last run and whose modification\
+            time and entry count have not changed since. Files modified\
+            in place inside such directories will go unnoticed.')
+    parser.add_argument(
+        '-digests',
+        '--use-digests',
+        action='store_true',
+        help='Along with `-skip-dirs`, keep a Merkle digest of every\
+            directory of both trees in the index, from the size and\
+            modification time of its files (their content hashes with\
+            `-cmp checksum`) and the digests of its subdirectories; and\
+            skip the directory pairs whose digests match. Only the\
+            directories modified since the last run are listed again.')
+    parser.add_argument(
+        '-cmp',
+        '--compare-mode',
+        choices=list(COMPARISONS),
+        type=lambda x: COMPARISON_ALIASES.get(x, x),
+        default='sampled',
+        help='How to compare files of the same size.\
+            `size`: Never read the file contents.\
+            `mtime`: Files are identical iff their modification times are\
+            too; never read the file contents.\
+            `mtime-content`: Fully compare the files whose modification\
+            times differ.\
+            `sampled`: Fully compare text files and small files, but only a\
+            few blocks of huge binary files.\
+            `full`: Fully compare all the files.\
+            `checksum`: Compare the content hashes of all the files.\
+            With `mtime` and `mtime-content`, copied files keep the\
+            modification time of the source. (default: %(default)s)')
+    parser.add_argument(
+        '--modify-window',
+        type=float,
+        default=0,
+        help='In `mtime` and `mtime-content` modes, the number of seconds by\
+            which modification times may differ and still be equal; e.g. 2\
+            for FAT filesystems. (default: %(default)s)')
+    parser.add_argument(
+        '--sample-threshold',
+        type=int,
+        default=1000000,
+        help='In `sampled` mode, the size in bytes above which binary files\
+            are only compared in blocks. (default: %(default)s)')
+    parser.add_argument(
+        '--sample-count',
+        type=int,
+        default=16,
+        help='In `sampled` mode, the number of blocks to compare besides\
+            the first and the last one. (default: %(default)s)')
+    parser.add_argument(
+        '--sample-block-size',
+        type=int,
+        default=65536,
+        help='In `sampled` mode, the size in bytes of each compared block.\
+            (default: %(default)s)')
+    parser.add_argument(
+        '--sample-seed',
+        type=int,
+        help='In `sampled` mode, place the blocks pseudo-randomly using this\
+            seed instead of evenly.')
+    parser.add_argument(
+        '--no-text-check',
+        action='store_true',
+        help='In `sampled` mode, do not fully compare text files above the\
+            threshold; saves reading the start of every such file to\
+            tell text from binary.')
+    parser.add_argument(
+        '-ignore',
+        '--ignore',
+        action='append',
+        dest='ignore_rules',
+        metavar='PATTERN',
+        help='Leave out the items matching this gitignore-style pattern, on\
+            both sides; e.g. `*.tmp`, `build/` or `/docs/**/*.pdf`. Can be\
+            given multiple times; the last matching pattern decides.')
+    parser.add_argument(
+        '--include',
+        action='append',
+        dest='ignore_rules',
+        type=lambda x: '!' + x,
+        metavar='PATTERN',
+        help='Do not leave out the items matching this pattern, even if\
+            matched by an earlier `-ignore` pattern. Same as `-ignore\
+            !PATTERN`.')
+    parser.add_argument(
+        '--ignore-file',
+        default=IGNORE_FILE_NAME,
+        metavar='NAME',
+        help='The name of the files in the source directory holding more\
+            gitignore-style patterns, for their directory and its\
+            subdirectories; they take precedence over `-ignore`. An empty\
+            name disables them. (default: %(default)s)')
+    parser.add_argument(
+        '-links',
+        '--symlinks',
+        choices=SYMLINK_POLICIES,
+        default='follow',
+        help='How to handle symlinks. `follow`: Compare and copy what they\
+            point to; except symlinks to a directory containing them, which\
+            would loop. `copy`: Compare and copy the links themselves.\
+            `skip`: Leave them out. (default: %(default)s)')
+    parser.add_argument(
+        '-hard-links',
+        '--preserve-hardlinks',
+        action='store_true',
+        help='Hardlink together the copies of files hardlinked together in\
+            the source, instead of copying each of them.')
+    parser.add_argument(
+        '-moves',
+        '--detect-moves',
+        action='store_true',
+        help='While both adding and removing, find the items moved or\
+            renamed in the source (extra items identical in content on both\
+            sides), and rename them in the destination instead of copying\
+            them again.')
+    parser.add_argument(
+        '-hash',
+        '--hash-algorithm',
+        choices=get_hash_algorithms(),
+        help='The algorithm of the content hashes stored in the index.\
+            Defaults to the fastest one available.')
+    parser.add_argument(
+        '-delta',
+        '--delta-mode',
+        choices=['off', 'inplace', 'atomic'],
+        default='off',
+        help='While overwriting big files, only write the blocks which\
+            differ. `inplace`: Patch the destination file directly.\
+            `atomic`: Patch a temporary copy and rename it over the\
+            destination file; cheap only where the copy can be a reflink.\
+            (default: %(default)s)')
+    parser.add_argument(
+        '--delta-threshold',
+        type=int,
+        default=16777216,
+        help='The size in bytes from which files are overwritten by a\
+            delta transfer. (default: %(default)s)')
+    parser.add_argument(
+        '-stream',
+        '--stream',
+        action='store_true',
+        help='Report (and sync) each difference as soon as it is found,\
+            without storing all of them first. Keeps the memory usage\
+            bounded for huge numbers of differences. Implies `-no-bar`\
+            and ignores `-cache`.')
+    parser.add_argument(
+        '-watch',
+        '--watch',
+        action='store_true',
+        help='After syncing, keep running and apply the changes made to the\
+            source directory as they happen; only comparing again the\
+            directories where something changed. Changes made to the\
+            destination directory are not noticed. Implies `-no-bar` and\
+            ignores `-cache`.')
+    parser.add_argument(
+        '--debounce',
+        type=float,
+        default=2.0,
+        help='In `-watch` mode, the number of seconds without changes to\
+            wait for before applying them. (default: %(default)s)')
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        help='In `-watch` mode, look for changes by walking the source\
+            directory every POLL_INTERVAL seconds, instead of through\
+            inotify. Done every 5 seconds where inotify is not available.')
+    parser.add_argument(
+        '-export',
+        '--export-manifest',
+        action='store_true',
+        help='Instead of comparing, write a manifest of the source directory\
+            to the file dst-path: the relative path, type, size and\
+            modification time of every item (and content hash with `-cmp\
+            checksum`), compressed. It can then be compared against, from\
+            anywhere, in place of the directory.')
+    parser.add_argument(
+        '-stats',
+        '--stats',
+        nargs='?',
+        const='-',
+        metavar='JSON_FILE',
+        help='Print counters and timers of the operations performed at the\
+            end; or write them to JSON_FILE, if given.')
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help='Profile the run with cProfile and write the profile to FILE;\
+            with pyinstrument instead if installed and FILE ends in .html.')
     args = parser.parse_args()
     args = vars(args)
     return args
@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+from .core import DirectSync
+from .executor import PENDING_PER_JOB, iter_tree_parallel
+from .traversal import scan_dir, sort_key
+
+
+class AsyncDirectSync(DirectSync):
+    '''
+    A `DirectSync` which walks the directories on an asyncio event loop, for
+    high-latency filesystems (NFS, SMB, FUSE, ...).
+    Every blocking operation (directory read, file comparison) runs on a pool
+    of `jobs` threads, which bounds the number of operations in flight.
+    Unlike the parallel mode of `DirectSync`, which only compares separate
+    directory pairs at the same time, the 2 sides of a directory pair and
+    all the common files of a directory are also handled concurrently; so
+    that the pool is kept busy even in narrow trees.
+    The differences found, and their order, are the same as with
+    `DirectSync`.
+    '''
+
+    def _iter_tree_contents(self, src_dir_path, dst_dir_path):
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=max(self.jobs, 1))
+        loop.set_default_executor(executor)
+        # The unfinished tasks, so that they can be cancelled if the
+        # consumer stops early.
+        tasks = set()
+
+        def submit(dir_args):
+            task = loop.create_task(self._compare_dir_pair_async(
+                loop, *dir_args))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            return task
+
+        try:
+            # The loop only runs while waiting for the next directory pair in
+            # depth-first order; the other tasks progress meanwhile.
+            for events in iter_tree_parallel(
+                    submit, loop.run_until_complete,
+                    (src_dir_path, dst_dir_path),
+                    PENDING_PER_JOB * max(self.jobs, 1)):
+                for event in events:
+                    yield event
+        finally:
+            unfinished = [x for x in tasks if not x.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                loop.run_until_complete(
+                    asyncio.gather(*unfinished, return_exceptions=True))
+            executor.shutdown()
+            loop.close()
+
+    async def _compare_dir_pair_async(self, loop, src_dir_path,
+                                      dst_dir_path):
+        '''
+        Same as `_compare_dir_pair()`, but both directories are read at the
+        same time, and all the common files are compared at the same time.
+        '''
+        events = []
+        try:
+            start = time.perf_counter()
+            follow_symlinks = self.symlinks == 'follow'
+            src_scan, dst_scan = await asyncio.gather(
+                loop.run_in_executor(None, scan_dir, src_dir_path,
+                                     follow_symlinks),
+                loop.run_in_executor(None, scan_dir, dst_dir_path,
+                                     follow_symlinks))
+            if self.stats is not None:
+                self._record_dir_pair_scan(time.perf_counter() - start,
+                                           src_scan, dst_scan)
+            src_scan, dst_scan = self._filter_scans(
+                src_dir_path, dst_dir_path, src_scan, dst_scan)
+            file_verdicts = None
+            if self.index_src is None or not self.skip_unchanged_dirs:
+                # Unless the comparison of the files might be skipped
+                # altogether.
+                file_verdicts = await self._compare_common_files(
+                    loop, src_scan[0], dst_scan[0])
+            next_subdirs = await loop.run_in_executor(
+                None, self._compare_scanned_dir_pair, src_dir_path,
+                dst_dir_path, src_scan, dst_scan, events, file_verdicts)
+            return events, next_subdirs
+        except Exception as err:
+            self._handle_dir_pair_error(src_dir_path, err)
+            return events, []
+
+    async def _compare_common_files(self, loop, src_files, dst_files):
+        '''
+        Compare the files present in both `src_files` and `dst_files`.
+        Returns a dict from the name of each such file to whether it is
+        identical on both sides.
+        '''
+        dst_files_by_key = {sort_key(x.name): x for x in dst_files}
+        pairs = [(x, dst_files_by_key[sort_key(x.name)]) for x in src_files
+                 if sort_key(x.name) in dst_files_by_key]
+        verdicts = await asyncio.gather(*[
+            loop.run_in_executor(None, self._are_files_equal, src_entry,
+                                 dst_entry)
+            for src_entry, dst_entry in pairs])
+        return {pair[0].name: verdict
+                for pair, verdict in zip(pairs, verdicts)}
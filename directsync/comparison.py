@@ -0,0 +1,151 @@
+import time
+
+from .file_comparison import is_file_text, compare_file_samples,\
+                             get_sample_offsets
+
+
+class SizeComparison:
+    '''
+    Trust that files of the same size have the same content.
+    Never reads any file.
+    '''
+    name = 'size'
+    # Whether the strategy relies on the modification times; if so, the
+    # copies made by `DirectSync` keep the modification time of the source.
+    uses_mtime = False
+
+    def are_files_equal(self, src_entry, dst_entry, compare_contents):
+        return True
+
+
+class MtimeComparison:
+    '''
+    Trust that files of the same size have the same content if and only if
+    they also have the same modification time, like rsync does by default.
+    Never reads any file.
+    `modify_window`: The number of seconds by which the modification times
+                     may differ, for filesystems storing them coarsely (e.g.
+                     2 seconds on FAT).
+    '''
+    name = 'mtime'
+    uses_mtime = True
+
+    def __init__(self, modify_window=0):
+        self.modify_window_ns = int(modify_window * 1000000000)
+
+    def are_mtimes_equal(self, src_entry, dst_entry):
+        return abs(src_entry.stat().st_mtime_ns -
+                   dst_entry.stat().st_mtime_ns) <= self.modify_window_ns
+
+    def are_files_equal(self, src_entry, dst_entry, compare_contents):
+        return self.are_mtimes_equal(src_entry, dst_entry)
+
+
+class MtimeContentComparison(MtimeComparison):
+    '''
+    Trust that files of the same size and modification time have the same
+    content, but fully compare the others.
+    '''
+    name = 'mtime-content'
+
+    def are_files_equal(self, src_entry, dst_entry, compare_contents):
+        if self.are_mtimes_equal(src_entry, dst_entry):
+            return True
+        return compare_contents(src_entry, dst_entry)
+
+
+class SampledComparison:
+    '''
+    Fully compare text files and files up to `threshold` bytes, but only
+    compare the head, the tail and `sample_count` blocks in between of the
+    bigger binary files.
+    See `get_sample_offsets()` for the placement of the blocks.
+    `check_text`: If false, skip the text/binary classification and sample
+                  all the files above `threshold`.
+    '''
+    name = 'sampled'
+    uses_mtime = False
+    # A `RunStats` to time the text checks and the sample comparisons in.
+    stats = None
+
+    def __init__(self, threshold=1000000, sample_count=16, block_size=65536,
+                 seed=None, check_text=True):
+        self.threshold = threshold
+        self.sample_count = sample_count
+        self.block_size = block_size
+        self.seed = seed
+        self.check_text = check_text
+
+    def are_files_equal(self, src_entry, dst_entry, compare_contents):
+        file_size = src_entry.stat().st_size
+        if file_size <= self.threshold:
+            return compare_contents(src_entry, dst_entry)
+        stats = self.stats
+        if self.check_text:
+            if stats is not None:
+                start = time.perf_counter()
+            is_src_text = is_file_text(src_entry.path, src_entry.stat())
+            is_dst_text = not is_src_text and\
+                is_file_text(dst_entry.path, dst_entry.stat())
+            if stats is not None:
+                stats.add_time('is_file_text', time.perf_counter() - start)
+            if is_src_text:
+                return compare_contents(src_entry, dst_entry)
+            if is_dst_text:
+                return False
+        offsets = get_sample_offsets(file_size, self.sample_count,
+                                     self.block_size, self.seed)
+        if stats is None:
+            return compare_file_samples(src_entry.path, dst_entry.path,
+                                        offsets, self.block_size)
+        start = time.perf_counter()
+        are_equal = compare_file_samples(src_entry.path, dst_entry.path,
+                                         offsets, self.block_size)
+        stats.add_time('compare_samples', time.perf_counter() - start)
+        stats.count('bytes_sampled', 2 * len(offsets) * self.block_size)
+        return are_equal
+
+
+class FullComparison:
+    '''
+    Fully compare the contents of every pair of files of the same size.
+    '''
+    name = 'full'
+    uses_mtime = False
+
+    def are_files_equal(self, src_entry, dst_entry, compare_contents):
+        return compare_contents(src_entry, dst_entry)
+
+
+class ChecksumComparison:
+    '''
+    Compare the content hashes of every pair of files of the same size,
+    like rsync's `--checksum`. Reads every file, but with an index only
+    those modified since the last run.
+    '''
+    name = 'checksum'
+    uses_mtime = False
+
+    def are_files_equal(self, src_entry, dst_entry, compare_contents):
+        return compare_contents(src_entry, dst_entry, by_hash=True)
+
+
+COMPARISONS = {
+    x.name: x
+    for x in (SizeComparison, MtimeComparison, MtimeContentComparison,
+              SampledComparison, FullComparison, ChecksumComparison)
+}
+# Former names of the strategies.
+COMPARISON_ALIASES = {'metadata': SizeComparison.name}
+
+
+def get_comparison(name, **kwargs):
+    '''
+    Construct the file comparison strategy with the given name.
+    `kwargs` are passed on to the strategies which take them.
+    '''
+    comparison_class = COMPARISONS[COMPARISON_ALIASES.get(name, name)]
+    if comparison_class in (SizeComparison, FullComparison,
+                            ChecksumComparison):
+        return comparison_class()
+    return comparison_class(**kwargs)
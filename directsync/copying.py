@@ -0,0 +1,237 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# `ioctl` request to share the data blocks of a file (btrfs, XFS, ...).
+FICLONE = 0x40049409
+# The size of each request to the kernel, for the backends taking one.
+COPY_CHUNK_SIZE = 8388608
+# The suffix of the temporary files written by the atomic copies.
+TEMP_SUFFIX = '.directsync-tmp'
+# Errors meaning that a backend does not support a pair of files.
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EBADF,
+    errno.EOPNOTSUPP, getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP)
+}
+
+
+def _copy_reflink(fd_src, fd_dst, file_size):
+    fcntl.ioctl(fd_dst, FICLONE, fd_src)
+
+
+def _check_copied_size(num_bytes, file_size):
+    '''
+    Raise an unsupported error if fewer than `file_size` bytes were copied,
+    so that the next backend is tried: on some filesystems (e.g. some FUSE
+    and network ones), the kernel backends stop early without any error.
+    '''
+    if num_bytes < file_size:
+        raise OSError(errno.EINVAL, 'Copied {} of {} bytes'.format(
+            num_bytes, file_size))
+
+
+def _copy_file_range(fd_src, fd_dst, file_size):
+    total_bytes = 0
+    while True:
+        num_bytes = os.copy_file_range(fd_src, fd_dst, COPY_CHUNK_SIZE)
+        if not num_bytes:
+            break
+        total_bytes += num_bytes
+    _check_copied_size(total_bytes, file_size)
+
+
+def _copy_sendfile(fd_src, fd_dst, file_size):
+    offset = 0
+    while True:
+        num_bytes = os.sendfile(fd_dst, fd_src, offset, COPY_CHUNK_SIZE)
+        if not num_bytes:
+            break
+        offset += num_bytes
+    _check_copied_size(offset, file_size)
+
+
+def _copy_userspace(fd_src, fd_dst, file_size):
+    with open(fd_src, 'rb', closefd=False) as fsrc,\
+            open(fd_dst, 'wb', closefd=False) as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1048576)
+
+
+# The copy backends, fastest first.
+BACKENDS = {}
+if fcntl is not None and sys.platform.startswith('linux'):
+    BACKENDS['reflink'] = _copy_reflink
+if hasattr(os, 'copy_file_range'):
+    BACKENDS['copy_file_range'] = _copy_file_range
+if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+    # Elsewhere, the destination of `sendfile` has to be a socket.
+    BACKENDS['sendfile'] = _copy_sendfile
+BACKENDS['userspace'] = _copy_userspace
+
+
+class CopyStats:
+    '''
+    Thread-safe counters of the files and bytes copied, and the time spent,
+    per copy backend.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Backend name -> [files, bytes, seconds]
+        self.backends = {}
+
+    def record(self, backend, num_bytes, seconds):
+        with self.lock:
+            counters = self.backends.setdefault(backend, [0, 0, 0.0])
+            counters[0] += 1
+            counters[1] += num_bytes
+            counters[2] += seconds
+
+    def get_report(self):
+        if not self.backends:
+            return ''
+        report_string = '\nCopy backends used:\n'
+        for backend, (files, num_bytes, seconds) in self.backends.items():
+            throughput = num_bytes / seconds / 1048576 if seconds else 0
+            report_string += \
+                ' - {}: {} files, {} bytes, {:.1f} MB/s\n'.format(
+                    backend, files, num_bytes, throughput)
+        return report_string
+
+
+def copy_file(path_src, path_dst, stats=None, backends=None):
+    '''
+    Copy the contents of a file like `shutil.copyfile()`, trying the
+    backends in `backends` (default: all of `BACKENDS`) in order until one
+    supports the pair of files.
+    Returns the name of the backend used.
+    '''
+    if backends is None:
+        backends = list(BACKENDS)
+    start = time.perf_counter()
+    fd_src = os.open(str(path_src), os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        file_size = os.fstat(fd_src).st_size
+        fd_dst = os.open(
+            str(path_dst),
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0),
+            0o666)
+        try:
+            for backend in backends:
+                try:
+                    BACKENDS[backend](fd_src, fd_dst, file_size)
+                    break
+                except OSError as err:
+                    if err.errno not in _UNSUPPORTED_ERRNOS or\
+                            backend == backends[-1]:
+                        raise
+                    # Start over with the next backend.
+                    os.ftruncate(fd_dst, 0)
+                    os.lseek(fd_src, 0, os.SEEK_SET)
+                    os.lseek(fd_dst, 0, os.SEEK_SET)
+        finally:
+            os.close(fd_dst)
+    finally:
+        os.close(fd_src)
+    if stats is not None:
+        stats.record(backend, file_size, time.perf_counter() - start)
+    return backend
+
+
+def get_temp_path(path_dst):
+    '''
+    The path of the temporary file to write before renaming it over
+    `path_dst`: hidden, and in the same directory so that the rename is
+    atomic.
+    '''
+    dir_name, file_name = os.path.split(str(path_dst))
+    return os.path.join(dir_name, '.' + file_name + TEMP_SUFFIX)
+
+
+def is_temp_name(file_name):
+    '''
+    Whether `file_name` is that of a temporary file of `get_temp_path()`,
+    e.g. left over by an interrupted copy.
+    '''
+    return file_name.startswith('.') and file_name.endswith(TEMP_SUFFIX)
+
+
+def _replace_atomically(paths_tmp, paths_dst):
+    '''
+    Rename each of `paths_tmp` over the matching path of `paths_dst`,
+    keeping the permissions of the existing ones.
+    '''
+    for path_tmp, path_dst in zip(paths_tmp, paths_dst):
+        # Replace the file a symlink points to, rather than the link.
+        path_dst = os.path.realpath(str(path_dst))
+        if os.path.exists(path_dst):
+            shutil.copymode(path_dst, path_tmp)
+        os.replace(path_tmp, path_dst)
+
+
+def _remove_temp_files(paths_tmp):
+    for path_tmp in paths_tmp:
+        if os.path.exists(path_tmp):
+            os.unlink(path_tmp)
+
+
+def copy_file_atomic(path_src, path_dst, stats=None):
+    '''
+    Same as `copy_file()`, but through a temporary file renamed over
+    `path_dst`; so that an interrupted copy never leaves `path_dst`
+    half-written.
+    '''
+    path_tmp = get_temp_path(path_dst)
+    try:
+        backend = copy_file(path_src, path_tmp, stats)
+        _replace_atomically([path_tmp], [path_dst])
+    except BaseException:
+        _remove_temp_files([path_tmp])
+        raise
+    return backend
+
+
+def copy_file_fanout(path_src, paths_dst, stats=None, buffer_size=1048576):
+    '''
+    Copy the contents of a file to each of `paths_dst`, reading it only
+    once: every block read is written to all the destinations; atomically,
+    like `copy_file_atomic()`.
+    Recorded in `stats` as the `fanout` backend, with the time split evenly
+    between the destinations.
+    '''
+    start = time.perf_counter()
+    paths_tmp = [get_temp_path(x) for x in paths_dst]
+    files_tmp = []
+    try:
+        with open(str(path_src), 'rb') as file_src:
+            try:
+                for path_tmp in paths_tmp:
+                    files_tmp.append(open(path_tmp, 'wb'))
+                buffer = bytearray(buffer_size)
+                view = memoryview(buffer)
+                file_size = 0
+                while True:
+                    num_bytes = file_src.readinto(buffer)
+                    if not num_bytes:
+                        break
+                    for file_tmp in files_tmp:
+                        file_tmp.write(view[:num_bytes])
+                    file_size += num_bytes
+            finally:
+                for file_tmp in files_tmp:
+                    file_tmp.close()
+        _replace_atomically(paths_tmp, paths_dst)
+    except BaseException:
+        _remove_temp_files(paths_tmp)
+        raise
+    if stats is not None:
+        seconds = (time.perf_counter() - start) / len(paths_dst)
+        for _ in paths_dst:
+            stats.record('fanout', file_size, seconds)
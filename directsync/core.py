@@ -1,11 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import io
+import json
+import os
 import shutil
 import logging
+import threading
+import time
 
 from tqdm import tqdm
 from send2trash import send2trash
 
-from .file_comparison import is_file_text, compare_file_contents_buffered, is_src_file_bigger
+from .file_comparison import compare_file_contents, is_src_file_bigger
+from .comparison import get_comparison
+from .hashing import hash_file, get_default_hash_algorithm,\
+                     get_hash_algorithms
+from .ignore import IGNORE_FILE_NAME, IgnoreRules, PathMatcher,\
+                    read_ignore_file
+from .copying import BACKENDS, CopyStats, copy_file_atomic, get_temp_path,\
+                     is_temp_name
+from .delta import delta_copy_file
+from .digests import TreeDigests
+from .events import DiffEvent, CONTENT, EXTRA_SRC, EXTRA_DST
+from .executor import PENDING_PER_JOB, SyncExecutor, iter_tree_parallel
+from .index import TreeIndex
+from .manifest import LINK, Manifest, diff_records, iter_tree_records,\
+                      write_manifest
+from .moves import MoveDetector
+from .progress import ScanProgress, read_item_count, write_item_count
+from .journal import SyncJournal, read_unfinished_operations
+from .serialization import get_journal_filepath, get_progress_filepath
+from .stats import RunStats
+from .traversal import SYMLINK_POLICIES, is_dir_loop, scan_dir, sort_key
 
 logger = logging.getLogger(__file__)
 
@@ -13,7 +39,12 @@ logger = logging.getLogger(__file__)
 class DirData:
     def __init__(self, path):
         self.path = Path(path).resolve()
+        # Whether `path` is a manifest of the tree rather than the tree.
+        self.is_manifest = self.path.is_file()
         self.diff = []
+        # The number of items left out by the ignore rules or the symlink
+        # policy.
+        self.excluded_count = 0
 
 
 class DirsData:
@@ -25,60 +56,227 @@ class DirsData:
         # The items present on either side but with different contents.
         self.content_diff = []
 
+    def add_event(self, event):
+        '''
+        Store a `DiffEvent` in the list corresponding to its kind.
+        '''
+        if event.kind == CONTENT:
+            self.content_diff.append((event.src, event.dst))
+        elif event.kind == EXTRA_SRC:
+            self.data_src.diff.append(event.src)
+        else:
+            self.data_dst.diff.append(event.dst)
+
 
 class DirectSync:
-    def __init__(self, dir_path_src, dir_path_dst, show_progress_bar=False):
+    def __init__(self, dir_path_src, dir_path_dst, show_progress_bar=False,
+                 jobs=1, use_index=False, skip_unchanged_dirs=False,
+                 compare_mode='sampled', comparison_options=None,
+                 hash_algorithm=None, delta_mode='off',
+                 delta_threshold=16777216, collect_stats=False,
+                 ignore_rules=None, ignore_file_name=IGNORE_FILE_NAME,
+                 symlinks='follow', preserve_hardlinks=False,
+                 use_journal=False, detect_moves=False, use_digests=False):
         self.dirs_data = DirsData(dir_path_src, dir_path_dst)
         self.show_progress_bar = show_progress_bar
         self.progress_bar = None
-        if not self.dirs_data.data_src.path.is_dir():
+        self.progress_lock = threading.Lock()
+        # The progress bar of `iter_differences()`.
+        self.scan_progress = None
+        # The number of directory pairs to compare in parallel.
+        self.jobs = jobs
+        # Whether to keep a persistent `TreeIndex` of each directory.
+        self.use_index = use_index
+        # Whether to trust the index to skip directories unchanged since the
+        # last run.
+        self.skip_unchanged_dirs = skip_unchanged_dirs
+        # The strategy used to compare files of the same size.
+        self.comparison = get_comparison(compare_mode,
+                                         **(comparison_options or {}))
+        # The algorithm of the content hashes stored in the index.
+        self.hash_algorithm = hash_algorithm or get_default_hash_algorithm()
+        # How to overwrite files of at least `delta_threshold` bytes:
+        # `off`, or with a delta transfer `inplace` or `atomic`ally.
+        self.delta_mode = delta_mode
+        self.delta_threshold = delta_threshold
+        # The indexes; only live during `check_differences()`.
+        self.index_src = None
+        self.index_dst = None
+        # The `(item, exception)` tuples of the last `sync_dirs()` call.
+        self.sync_failures = []
+        # The copy backends used by the last `sync_dirs()` call.
+        self.copy_stats = CopyStats()
+        # The counters and timers of the operations, if enabled; see
+        # `get_stats()`.
+        self.stats = RunStats() if collect_stats else None
+        self.comparison.stats = self.stats
+        # The gitignore-style rules given directly, applying to the whole
+        # trees; the rules of the `ignore_file_name` files found in src
+        # take precedence over them. Excluded items are never compared,
+        # synced or even stat'd.
+        self.root_matcher = PathMatcher(IgnoreRules(ignore_rules or []))
+        self.ignore_file_name = ignore_file_name
+        # The posix path relative to the root -> `PathMatcher`, of the
+        # directories of src whose rules were resolved; see
+        # `_get_dir_matcher()`. Reset by `iter_differences()`, so that the
+        # changes of the ignore files are taken into account.
+        self.dir_matchers = {}
+        self.exclusion_lock = threading.Lock()
+        # How symlinks are handled; one of `SYMLINK_POLICIES`. Followed
+        # symlinks to directories containing them are left out.
+        if symlinks not in SYMLINK_POLICIES:
+            raise Exception('Invalid symlink policy "{}"!'.format(symlinks))
+        self.symlinks = symlinks
+        # Whether the files hardlinked together in src are hardlinked in
+        # dst too, instead of copied separately.
+        self.preserve_hardlinks = preserve_hardlinks
+        # The (device, inode) of a file of src -> the path of its copy in
+        # dst, for the files with several hardlinks.
+        self.hardlink_copies = {}
+        # The (device, inode) of a file of src and one of dst -> whether
+        # they are identical, for the files with several hardlinks; so that
+        # they are only compared once.
+        self.hardlink_verdicts = {}
+        self.hardlink_lock = threading.Lock()
+        # Whether `sync_dirs()` keeps a journal of its operations, so that
+        # it can be finished by `resume_sync()` if interrupted.
+        self.use_journal = use_journal
+        # Whether the items extra in dst which are identical to items extra
+        # in src are moved to their place, rather than removed and copied
+        # again; when both adding and removing.
+        self.detect_moves = detect_moves
+        # Whether the directory pairs with the same Merkle digest on both
+        # sides are skipped; see `TreeDigests`. Only along with
+        # `skip_unchanged_dirs`, as the trees would otherwise be listed in
+        # full for the digests, and then again for the comparison.
+        if use_digests and not (use_index and skip_unchanged_dirs):
+            raise Exception('The digests need `use_index` and'
+                            ' `skip_unchanged_dirs`!')
+        self.use_digests = use_digests
+        # The digests of the directories of each tree; only during
+        # `iter_differences()`.
+        self.digests_src = None
+        self.digests_dst = None
+        # The `(src size, dst size)` of the files found different through a
+        # manifest, which cannot be stat'd; see `_iter_manifest_differences()`.
+        self.manifest_sizes = {}
+        if not (self.dirs_data.data_src.path.is_dir() or
+                self.dirs_data.data_src.is_manifest):
             error_msg = 'src path "{}" is not a valid directory!'
             error_msg = error_msg.format(self.dirs_data.data_src.path)
             raise Exception(error_msg)
-        if not self.dirs_data.data_dst.path.is_dir():
+        if not (self.dirs_data.data_dst.path.is_dir() or
+                self.dirs_data.data_dst.is_manifest):
             error_msg = 'dst path "{}" is not a valid directory!'
             error_msg = error_msg.format(self.dirs_data.data_dst.path)
             raise Exception(error_msg)
 
-    def _are_files_equal(self, path_src, path_dst):
-        # First check the file sizes.
-        src_size = path_src.stat().st_size
-        dst_size = path_dst.stat().st_size
-        if src_size != dst_size:
+    def _are_files_equal(self, src_entry, dst_entry):
+        if not (src_entry.is_file and dst_entry.is_file):
+            # Symlinks which are not followed are identical if they point to
+            # the same path.
+            return src_entry.is_link and dst_entry.is_link and\
+                os.readlink(str(src_entry.path)) ==\
+                os.readlink(str(dst_entry.path))
+        # First check the file sizes, reusing the stat from the directory scan.
+        src_stat = src_entry.stat()
+        dst_stat = dst_entry.stat()
+        if self.stats is not None:
+            self.stats.count('file_pairs_compared')
+        if src_stat.st_size != dst_stat.st_size:
             # If file sizes are different, then return straightaway!
             return False
-        if not is_file_text(path_src):
-            if is_file_text(path_dst):
-                return False
-            if src_size > 1000000:
-                # Assume huge binary files with the same size
-                # have the same content for performance.
-                return True
-        # If file size is same, and the files are text/small binaries,
-        # then compare their contents.
-        return compare_file_contents_buffered(path_src, path_dst)
+        hardlink_key = None
+        if src_stat.st_nlink > 1:
+            hardlink_key = (src_stat.st_dev, src_stat.st_ino,
+                            dst_stat.st_dev, dst_stat.st_ino)
+            are_equal = self.hardlink_verdicts.get(hardlink_key)
+            if are_equal is not None:
+                return are_equal
+        if self.stats is None:
+            are_equal = self.comparison.are_files_equal(
+                src_entry, dst_entry, self._compare_file_contents)
+        else:
+            start = time.perf_counter()
+            are_equal = self.comparison.are_files_equal(
+                src_entry, dst_entry, self._compare_file_contents)
+            self.stats.add_time('compare_files', time.perf_counter() - start)
+        if hardlink_key is not None:
+            with self.hardlink_lock:
+                self.hardlink_verdicts[hardlink_key] = are_equal
+                if are_equal and self.preserve_hardlinks:
+                    # The other hardlinks of the file, if missing in dst,
+                    # can be linked to this copy.
+                    self.hardlink_copies.setdefault(
+                        hardlink_key[:2], str(dst_entry.path))
+        return are_equal
 
-    def __getstate__(self):
+    def _compare_file_contents(self, src_entry, dst_entry, by_hash=False):
         '''
-        Specify what attributes to serialize.
-        Needed to tell pickle to ignore `self.progress_bar`
-        as `tqdm()` objects cannot be serialized.
+        Fully compare the contents of 2 files of the same size.
+        `by_hash`: Whether to compare the content hashes of the files even
+                   without an index.
         '''
+        if by_hash or self.index_src is not None:
+            # Compare the content hashes; with an index, these are only
+            # recomputed for the files modified since the last run.
+            src_hash = self._get_file_hash(
+                self.index_src, self.dirs_data.data_src.path, src_entry)
+            dst_hash = self._get_file_hash(
+                self.index_dst, self.dirs_data.data_dst.path, dst_entry)
+            return src_hash == dst_hash
+        if self.stats is None:
+            return compare_file_contents(src_entry.path, dst_entry.path,
+                                         src_entry.stat())
+        start = time.perf_counter()
+        are_equal = compare_file_contents(src_entry.path, dst_entry.path,
+                                          src_entry.stat())
+        self.stats.add_time('compare_contents', time.perf_counter() - start)
+        self.stats.count('bytes_compared', 2 * src_entry.stat().st_size)
+        return are_equal
 
-        def should_pickle(attr_key):
-            return 'progress' not in attr_key
-
-        return {k: v for k, v in self.__dict__.items() if should_pickle(k)}
-
-    def _compare_subfiles(self, src_dir_contents, dst_dir_contents):
+    def _get_file_hash(self, index, base_path, entry):
         '''
-        Compare the file items.
+        Get the content hash of a file from the index, hashing the file only
+        if its metadata has changed since it was last indexed.
+        With no `index`, the file is always hashed; but only once per
+        `ScanEntry`.
         '''
-        src_files = [x for x in src_dir_contents if x.is_file()]
-        dst_files = [x for x in dst_dir_contents if x.is_file()]
+        if entry.content_hash is not None:
+            return entry.content_hash
+        stat_result = entry.stat()
+        if index is not None:
+            rel_path = entry.path.relative_to(base_path).as_posix()
+            file_hash = index.get_file_hash(rel_path, stat_result,
+                                            self.hash_algorithm)
+            if file_hash is not None:
+                if self.stats is not None:
+                    self.stats.count('index_hash_hits')
+                entry.content_hash = file_hash
+                return file_hash
+        if self.stats is not None:
+            start = time.perf_counter()
+        file_hash = hash_file(entry.path, self.hash_algorithm)
+        if self.stats is not None:
+            self.stats.add_time('hash_file', time.perf_counter() - start)
+            self.stats.count('bytes_hashed', stat_result.st_size)
+        if index is not None:
+            index.set_file_hash(rel_path, stat_result, self.hash_algorithm,
+                                file_hash)
+        entry.content_hash = file_hash
+        return file_hash
 
+    def _compare_subfiles(self, src_files, dst_files, events,
+                          file_verdicts=None):
+        '''
+        Compare the file items, appending the differences to `events`.
+        `file_verdicts`: If given, a dict from the name of every common file
+                         to whether it is identical on both sides; so that
+                         the files are not compared here.
+        Returns the number of bytes of the common files compared.
+        '''
         # Use a merging sort of algorithm.
-        # 1. Sort the 2 lists according to Path's inbuilt comparison predicate
+        # 1. Sort the 2 lists according to the entry names (done in `scan_dir`)
         # 2. Have 2 pointers, one on either list.
         # 3. If the 2 pointed items have the same name, then compare contents.
         #    Else add the lower name entry to `extras` and advance its pointer.
@@ -86,47 +284,52 @@ class DirectSync:
         # 5. Exhaust the 2 pointers and add all the pointed items to `extras`.
         src_iterator = 0
         dst_iterator = 0
+        bytes_compared = 0
 
         while src_iterator < len(src_files) and dst_iterator < len(
                 dst_files):
-            self._mark_file_visit()
             src_entry = src_files[src_iterator]
             dst_entry = dst_files[dst_iterator]
-            src_entry_name = src_entry.name
-            dst_entry_name = dst_entry.name
-            if src_entry_name == dst_entry_name:
-                are_files_same = self._are_files_equal(src_entry, dst_entry)
+            src_entry_key = sort_key(src_entry.name)
+            dst_entry_key = sort_key(dst_entry.name)
+            if src_entry_key == dst_entry_key:
+                if file_verdicts is not None:
+                    are_files_same = file_verdicts[src_entry.name]
+                else:
+                    are_files_same = self._are_files_equal(src_entry,
+                                                           dst_entry)
                 if not are_files_same:
-                    self.dirs_data.content_diff.append((src_entry,
-                                                        dst_entry))
+                    events.append(DiffEvent(CONTENT, src_entry.path,
+                                            dst_entry.path))
+                # The sizes are already cached by `_are_files_equal()`.
+                bytes_compared += src_entry.stat().st_size + \
+                    dst_entry.stat().st_size
                 src_iterator += 1
                 dst_iterator += 1
-                self._mark_file_visit()
-            elif Path(src_entry_name) < Path(dst_entry_name):
-                self.dirs_data.data_src.diff.append(src_entry)
+            elif src_entry_key < dst_entry_key:
+                events.append(DiffEvent(EXTRA_SRC, src_entry.path, None))
                 src_iterator += 1
             else:
-                self.dirs_data.data_dst.diff.append(dst_entry)
+                events.append(DiffEvent(EXTRA_DST, None, dst_entry.path))
                 dst_iterator += 1
 
         while src_iterator < len(src_files):
             src_entry = src_files[src_iterator]
-            self.dirs_data.data_src.diff.append(src_entry)
+            events.append(DiffEvent(EXTRA_SRC, src_entry.path, None))
             src_iterator += 1
-            self._mark_file_visit()
 
         while dst_iterator < len(dst_files):
             dst_entry = dst_files[dst_iterator]
-            self.dirs_data.data_dst.diff.append(dst_entry)
+            events.append(DiffEvent(EXTRA_DST, None, dst_entry.path))
             dst_iterator += 1
-            self._mark_file_visit()
 
-    def _compare_subdirs(self, src_dir_contents, dst_dir_contents):
+        return bytes_compared
+
+    def _compare_subdirs(self, src_subdirs, dst_subdirs, events):
         '''
         Similar to `_compare_subfile()` but for directories.
+        Returns the pairs of common subdirectories to explore next.
         '''
-        src_subdirs = [x for x in src_dir_contents if x.is_dir()]
-        dst_subdirs = [x for x in dst_dir_contents if x.is_dir()]
         # Directories (subdirectories) to explore next.
         next_subdirs = []
 
@@ -135,91 +338,568 @@ class DirectSync:
 
         while src_iterator < len(src_subdirs) and dst_iterator < len(
                 dst_subdirs):
-            self._mark_file_visit()
             src_entry = src_subdirs[src_iterator]
             dst_entry = dst_subdirs[dst_iterator]
-            src_entry_name = src_entry.name
-            dst_entry_name = dst_entry.name
-            if src_entry_name == dst_entry_name:
-                next_subdirs.append((src_entry, dst_entry))
+            src_entry_key = sort_key(src_entry.name)
+            dst_entry_key = sort_key(dst_entry.name)
+            if src_entry_key == dst_entry_key:
+                next_subdirs.append((src_entry.path, dst_entry.path))
                 src_iterator += 1
                 dst_iterator += 1
-                self._mark_file_visit()
-            elif Path(src_entry_name) < Path(dst_entry_name):
-                self.dirs_data.data_src.diff.append(src_entry)
+            elif src_entry_key < dst_entry_key:
+                events.append(DiffEvent(EXTRA_SRC, src_entry.path, None))
                 src_iterator += 1
             else:
-                self.dirs_data.data_dst.diff.append(dst_entry)
+                events.append(DiffEvent(EXTRA_DST, None, dst_entry.path))
                 dst_iterator += 1
 
         while src_iterator < len(src_subdirs):
             src_entry = src_subdirs[src_iterator]
-            self.dirs_data.data_src.diff.append(src_entry)
+            events.append(DiffEvent(EXTRA_SRC, src_entry.path, None))
             src_iterator += 1
-            self._mark_file_visit()
 
         while dst_iterator < len(dst_subdirs):
             dst_entry = dst_subdirs[dst_iterator]
-            self.dirs_data.data_dst.diff.append(dst_entry)
+            events.append(DiffEvent(EXTRA_DST, None, dst_entry.path))
             dst_iterator += 1
-            self._mark_file_visit()
 
-        for dir_entry in next_subdirs:
-            # Recursive call
-            self._compare_dir_contents(dir_entry[0], dir_entry[1])
+        return next_subdirs
 
-    def _compare_dir_contents(self, src_dir_path, dst_dir_path):
-        # Need to sort for the merging-type algorithm later on.
+    def _compare_dir_pair(self, src_dir_path, dst_dir_path):
+        '''
+        Compare the immediate contents of 2 directories.
+        Returns the list of `DiffEvent`s found, and the pairs of common
+        subdirectories to explore next.
+        '''
+        events = []
+        # A single directory read per side; the entries come back already
+        # classified and sorted for the merging-type algorithm later on.
         try:
-            src_dir_contents = sorted([x for x in src_dir_path.iterdir()])
-            dst_dir_contents = sorted([x for x in dst_dir_path.iterdir()])
-            self._compare_subfiles(src_dir_contents, dst_dir_contents)
-            self._compare_subdirs(src_dir_contents, dst_dir_contents)
+            if self.stats is not None:
+                start = time.perf_counter()
+            src_scan = scan_dir(src_dir_path, self.symlinks == 'follow')
+            dst_scan = scan_dir(dst_dir_path, self.symlinks == 'follow')
+            if self.stats is not None:
+                self._record_dir_pair_scan(time.perf_counter() - start,
+                                           src_scan, dst_scan)
+            src_scan, dst_scan = self._filter_scans(
+                src_dir_path, dst_dir_path, src_scan, dst_scan)
+            next_subdirs = self._compare_scanned_dir_pair(
+                src_dir_path, dst_dir_path, src_scan, dst_scan, events)
+            return events, next_subdirs
         except Exception as err:
-            log_msg = '\nError while comparing directories: {}'.format(err)
-            logger.exception(log_msg)
+            self._handle_dir_pair_error(src_dir_path, err)
+            return events, []
 
-    def check_differences(self):
+    def _record_dir_pair_scan(self, seconds, src_scan, dst_scan):
+        self.stats.add_time('scan_dir_pair', seconds)
+        self.stats.count('dirs_scanned', 2)
+        self.stats.count('entries_scanned', sum(
+            len(x) for x in src_scan + dst_scan))
+
+    def _get_dir_matcher(self, rel_dir, ignore_file_path):
         '''
-        Checks and stores the differences between the 2 directories.
+        Return the `PathMatcher` of a directory of src, given its posix path
+        relative to the root, and the path of its ignore file if any.
+        The rules of its ancestors are resolved on demand, reading their
+        ignore files from the root down; so that they apply whether or not
+        the comparison went through them first (e.g. with a cached result).
+        '''
+        matcher = self.dir_matchers.get(rel_dir)
+        if matcher is not None:
+            return matcher
+        if rel_dir:
+            parent_dir = rel_dir.rpartition('/')[0]
+            parent = self.dir_matchers.get(parent_dir)
+            if parent is None:
+                # Recursive call
+                parent = self._get_dir_matcher(
+                    parent_dir, self._find_ignore_file(parent_dir))
+        else:
+            parent = self.root_matcher
+        if ignore_file_path is None:
+            matcher = parent
+        else:
+            matcher = PathMatcher(read_ignore_file(ignore_file_path), rel_dir,
+                                  parent)
+        self.dir_matchers[rel_dir] = matcher
+        return matcher
+
+    def _find_ignore_file(self, rel_dir):
+        '''
+        Return the path of the ignore file of a directory of src, if any.
+        '''
+        if not self.ignore_file_name:
+            return None
+        ignore_file_path = self.dirs_data.data_src.path / rel_dir /\
+            self.ignore_file_name
+        return ignore_file_path if ignore_file_path.is_file() else None
+
+    def _filter_scans(self, src_dir_path, dst_dir_path, src_scan,
+                      dst_scan):
+        '''
+        Leave the entries excluded by the ignore rules or by the symlink
+        policy out of the results of `scan_dir()` of a directory pair, before
+        anything else is done with them; so that excluded subdirectories are
+        never read.
+        The ignore rules are those of the src directory, for both sides.
+        '''
+        ignore_file_path = None
+        if self.ignore_file_name:
+            for entry in src_scan[0]:
+                if entry.name == self.ignore_file_name:
+                    ignore_file_path = entry.path
+                    break
+        scans = self._exclude_entries(
+            src_dir_path, ignore_file_path, [src_scan, dst_scan],
+            (self.dirs_data.data_src.path, self.dirs_data.data_dst.path))
+        excluded_counts = [sum(len(x) for x in scan) -
+                           sum(len(x) for x in filtered_scan)
+                           for scan, filtered_scan in zip((src_scan, dst_scan),
+                                                          scans)]
+        if any(excluded_counts):
+            with self.exclusion_lock:
+                self.dirs_data.data_src.excluded_count += excluded_counts[0]
+                self.dirs_data.data_dst.excluded_count += excluded_counts[1]
+        return scans
+
+    def _exclude_entries(self, src_dir_path, ignore_file_path, scans,
+                         base_paths):
+        '''
+        The filtering of `_filter_scans()`, for the `scans` of the same
+        directory in the trees rooted at `base_paths`; `ignore_file_path`
+        being the ignore file of the src directory, if any.
+        The temporary files of the copies are left out too.
+        '''
+        if any(is_temp_name(x.name) for scan in scans for x in scan[0]):
+            scans = [self._filter_scan(
+                scan, lambda x, is_dir: is_dir or not is_temp_name(x.name))
+                for scan in scans]
+        if self.ignore_file_name or not self.root_matcher.is_empty:
+            rel_dir = src_dir_path.relative_to(
+                self.dirs_data.data_src.path).as_posix()
+            if rel_dir == '.':
+                rel_dir = ''
+            matcher = self._get_dir_matcher(rel_dir, ignore_file_path)
+            if not matcher.is_empty:
+                prefix = rel_dir + '/' if rel_dir else ''
+                scans = [self._filter_scan(
+                    scan, lambda x, is_dir: not matcher.is_excluded(
+                        prefix + x.name, is_dir)) for scan in scans]
+        if self.symlinks == 'skip':
+            scans = [self._filter_scan(scan, lambda x, _: not x.is_symlink)
+                     for scan in scans]
+        elif self.symlinks == 'follow':
+            scans = list(scans)
+            for i, base_path in enumerate(base_paths):
+                files, subdirs = scans[i]
+                if any(x.is_symlink for x in subdirs):
+                    scans[i] = files, [
+                        x for x in subdirs if not (
+                            x.is_symlink and
+                            self._is_followed_loop(x.path, base_path))]
+        return scans
+
+    def _get_tree_filter(self, base_path, data=None):
+        '''
+        Return a function `filter_scan(rel_dir, scan)` leaving the entries
+        excluded by the comparison out of the result of `scan_dir()` of a
+        directory of the tree rooted at `base_path`; for the code reading a
+        single tree.
+        `data`: If given, the `DirData` whose `excluded_count` counts the
+                entries left out.
+        '''
+        src_base_path = self.dirs_data.data_src.path
+
+        def filter_scan(rel_dir, scan):
+            filtered_scan = self._exclude_entries(
+                src_base_path / rel_dir, self._find_ignore_file(rel_dir),
+                [scan], [base_path])[0]
+            if data is not None:
+                data.excluded_count += sum(len(x) for x in scan) -\
+                    sum(len(x) for x in filtered_scan)
+            return filtered_scan
+
+        return filter_scan
+
+    def _get_tree_digests(self, base_path, index):
+        '''
+        Compute the `TreeDigests` of the tree rooted at `base_path`, leaving
+        out the same entries as the comparison.
+        '''
+        filter_scan = self._get_tree_filter(base_path)
+        if self.comparison.name == 'checksum':
+            def get_file_hash(entry):
+                return self._get_file_hash(index, base_path, entry)
+        else:
+            get_file_hash = None
+
+        # The settings changing the digests.
+        config = json.dumps([
+            self.hash_algorithm if get_file_hash else 'mtime',
+            [x[:3] for x in self.root_matcher.rules.rules],
+            self.ignore_file_name, self.symlinks])
+        tree_digests = TreeDigests(
+            base_path, filter_scan, get_file_hash, index, config,
+            trust_dir_mtime=self.skip_unchanged_dirs,
+            follow_symlinks=self.symlinks == 'follow', stats=self.stats)
+        return tree_digests.update()
+
+    def _are_digests_equal(self, src_dir_path):
+        '''
+        Whether the digests of a directory pair show that their contents
+        are identical; see `use_digests`.
+        '''
+        if self.digests_src is None:
+            return False
+        rel_path = src_dir_path.relative_to(
+            self.dirs_data.data_src.path).as_posix()
+        if rel_path == '.':
+            rel_path = ''
+        digest = self.digests_src.get(rel_path)
+        if digest is None or digest != self.digests_dst.get(rel_path):
+            return False
+        if self.stats is not None:
+            self.stats.count('dirs_pruned')
+        return True
+
+    @staticmethod
+    def _filter_scan(scan, should_keep):
+        '''
+        Return a copy of the result of `scan_dir()` with only the entries
+        for which `should_keep(entry, is_dir)` is true.
+        '''
+        files, subdirs = scan
+        return [x for x in files if should_keep(x, False)],\
+            [x for x in subdirs if should_keep(x, True)]
+
+    @staticmethod
+    def _is_followed_loop(dir_path, base_path):
+        if is_dir_loop(dir_path, base_path):
+            logger.warning('Not following the symlink "%s", which leads to '
+                           'a directory containing it', dir_path)
+            return True
+        return False
+
+    def _compare_scanned_dir_pair(self, src_dir_path, dst_dir_path,
+                                  src_scan, dst_scan, events,
+                                  file_verdicts=None):
+        '''
+        The part of `_compare_dir_pair()` after both directories are read;
+        `src_scan` and `dst_scan` are the results of `scan_dir()`, filtered
+        by `_filter_scans()`.
+        See `_compare_subfiles()` for `file_verdicts`.
+        Returns the pairs of common subdirectories to explore next.
+        '''
+        src_files, src_subdirs = src_scan
+        dst_files, dst_subdirs = dst_scan
+        dir_state = None
+        if self.index_src is not None:
+            dir_state = self._get_indexed_dir_state(
+                src_dir_path, dst_dir_path,
+                len(src_files) + len(src_subdirs),
+                len(dst_files) + len(dst_subdirs))
+        bytes_compared = 0
+        if dir_state is None or not (dir_state[-1] and
+                                     self.skip_unchanged_dirs):
+            bytes_compared = self._compare_subfiles(src_files, dst_files,
+                                                    events, file_verdicts)
+        next_subdirs = self._compare_subdirs(src_subdirs, dst_subdirs,
+                                             events)
+        if self.digests_src is not None:
+            next_subdirs = [x for x in next_subdirs
+                            if not self._are_digests_equal(x[0])]
+        if dir_state is not None:
+            self._set_indexed_dir_state(dir_state, not events)
+        if self.scan_progress is not None:
+            self.scan_progress.update(
+                len(src_files) + len(src_subdirs) + len(dst_files) +
+                len(dst_subdirs), bytes_compared, len(next_subdirs))
+        return next_subdirs
+
+    def _handle_dir_pair_error(self, src_dir_path, err):
+        '''
+        Log an error raised while comparing a directory pair, whose
+        subdirectories will then not be explored.
+        '''
+        log_msg = '\nError while comparing directories: {}'.format(err)
+        logger.exception(log_msg)
+        if self.index_src is not None:
+            # Make sure that the directory is not trusted on the next run.
+            rel_path = src_dir_path.relative_to(
+                self.dirs_data.data_src.path).as_posix()
+            self.index_src.forget_dir(rel_path)
+            self.index_dst.forget_dir(rel_path)
+        if self.scan_progress is not None:
+            self.scan_progress.update(0, 0, 0)
+
+    def _get_indexed_dir_state(self, src_dir_path, dst_dir_path, src_count,
+                               dst_count):
+        '''
+        Return the current metadata of a directory pair, along with whether
+        it is unchanged since the last run, where its files were found
+        identical on both sides.
+        '''
+        src_base_path = self.dirs_data.data_src.path
+        dst_base_path = self.dirs_data.data_dst.path
+        rel_path = src_dir_path.relative_to(src_base_path).as_posix()
+        src_stat = src_dir_path.stat()
+        dst_stat = dst_dir_path.stat()
+        is_clean = self.index_src.is_dir_clean(
+            rel_path, src_stat, src_count, str(dst_base_path))\
+            and self.index_dst.is_dir_clean(
+                rel_path, dst_stat, dst_count, str(src_base_path))
+        return rel_path, src_stat, src_count, dst_stat, dst_count, is_clean
+
+    def _set_indexed_dir_state(self, dir_state, is_clean):
+        '''
+        Record the metadata of a directory pair in the indexes, along with
+        whether its immediate contents were found identical on both sides.
+        '''
+        rel_path, src_stat, src_count, dst_stat, dst_count, _ = dir_state
+        src_base_path = self.dirs_data.data_src.path
+        dst_base_path = self.dirs_data.data_dst.path
+        self.index_src.set_dir(rel_path, src_stat, src_count,
+                               str(dst_base_path) if is_clean else None)
+        self.index_dst.set_dir(rel_path, dst_stat, dst_count,
+                               str(src_base_path) if is_clean else None)
+
+    def _iter_dir_contents(self, src_dir_path, dst_dir_path):
+        events, next_subdirs = self._compare_dir_pair(src_dir_path,
+                                                      dst_dir_path)
+        for event in events:
+            yield event
+        for dir_entry in next_subdirs:
+            # Recursive call
+            for event in self._iter_dir_contents(dir_entry[0], dir_entry[1]):
+                yield event
+
+    def _iter_dir_contents_parallel(self, src_dir_path, dst_dir_path):
+        '''
+        Same as `_iter_dir_contents()`, but the directory pairs are compared
+        on a pool of `self.jobs` threads, at most `PENDING_PER_JOB` per
+        thread ahead of the consumer; see `iter_tree_parallel()`.
+        The results of the tasks are yielded in the same depth-first order
+        as the serial recursion, so the results are identical to a serial
+        run.
+        '''
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for events in iter_tree_parallel(
+                    lambda x: executor.submit(self._compare_dir_pair, *x),
+                    lambda x: x.result(), (src_dir_path, dst_dir_path),
+                    PENDING_PER_JOB * self.jobs):
+                for event in events:
+                    yield event
+
+    def _iter_tree_contents(self, src_dir_path, dst_dir_path):
+        '''
+        Yield the `DiffEvent`s of the 2 whole trees, in depth-first order.
+        '''
+        if self.jobs > 1:
+            return self._iter_dir_contents_parallel(src_dir_path,
+                                                    dst_dir_path)
+        return self._iter_dir_contents(src_dir_path, dst_dir_path)
+
+    def iter_differences(self):
+        '''
+        Checks the differences between the 2 directories, yielding a
+        `DiffEvent` for each one as soon as it is found.
+        Nothing is stored in `self.dirs_data`, so that the memory used does
+        not grow with the number of differences.
         '''
         src_dir_path = self.dirs_data.data_src.path
         dst_dir_path = self.dirs_data.data_dst.path
+        if self.dirs_data.data_src.is_manifest or\
+                self.dirs_data.data_dst.is_manifest:
+            for event in self._iter_manifest_differences():
+                yield event
+            return
+        progress_filepath = None
         if self.show_progress_bar:
-            # Count the total number of files to visit for progress bar.
-            # Although this is not a totally accurate measure of the actual
-            # work to be done, but is a close approximate in the case of the
-            # 2 directories being almost identical to each other (which is
-            # hopefully the most prominent use case). In case the 2 directories
-            # are huge and are totally differently structured, this step will
-            # be totally unnecessary, and its better to hide progress bar
-            # in that case.
-            desc = 'Precomputing directory sizes for progress bar...'
-            self.progress_bar = tqdm(desc=desc, unit=' items')
-            src_dir_generator = src_dir_path.rglob('*')
-            src_file_count_recursive = 0
-            for i in src_dir_generator:
-                self._mark_file_visit()
-                src_file_count_recursive += 1
-            dst_dir_generator = dst_dir_path.rglob('*')
-            dst_file_count_recursive = 0
-            for i in dst_dir_generator:
-                self._mark_file_visit()
-                dst_file_count_recursive += 1
-            total_files_count = src_file_count_recursive \
-                + dst_file_count_recursive
-            self.progress_bar.close()
-            self.progress_bar = tqdm(
-                total=total_files_count,
-                desc='Checking differences',
-                unit=' items')
-        self._compare_dir_contents(src_dir_path, dst_dir_path)
-        if self.progress_bar:
-            # In cases where the directories are very different, not all files
-            # and sub-dirs are visited. So, we'll need to manually update the
-            # progress bar to the finish.
-            self.progress_bar.update(total_files_count-self.progress_bar.n)
-            self.progress_bar.close()
+            # The number of items of the previous run, if any, is the best
+            # guess for the total of the progress bar.
+            progress_filepath = get_progress_filepath(self)
+            self.scan_progress = ScanProgress(
+                read_item_count(progress_filepath))
+        finished = False
+        self.dir_matchers = {}
+        self.dirs_data.data_src.excluded_count = 0
+        self.dirs_data.data_dst.excluded_count = 0
+        if self.use_index:
+            self.index_src = TreeIndex(src_dir_path)
+            self.index_dst = TreeIndex(dst_dir_path)
+        try:
+            if self.use_digests:
+                if self.stats is not None:
+                    start = time.perf_counter()
+                self.digests_src = self._get_tree_digests(src_dir_path,
+                                                          self.index_src)
+                self.digests_dst = self._get_tree_digests(dst_dir_path,
+                                                          self.index_dst)
+                if self.stats is not None:
+                    self.stats.add_time('update_digests',
+                                        time.perf_counter() - start)
+            if not self._are_digests_equal(src_dir_path):
+                for event in self._iter_tree_contents(src_dir_path,
+                                                      dst_dir_path):
+                    yield event
+            finished = True
+        finally:
+            self.digests_src = None
+            self.digests_dst = None
+            if self.use_index:
+                self.index_src.close()
+                self.index_dst.close()
+                self.index_src = None
+                self.index_dst = None
+            if self.scan_progress is not None:
+                item_count = self.scan_progress.close(finished)
+                self.scan_progress = None
+                if finished:
+                    write_item_count(progress_filepath, item_count)
+
+    def _iter_manifest_differences(self):
+        '''
+        `iter_differences()`, when either side is a manifest: the records
+        of both sides (a tree being read in manifest order) are compared
+        with a linear merge; see `diff_records()`. The events come in the
+        same order as for 2 trees.
+        '''
+        self.manifest_sizes = {}
+        self.dirs_data.data_src.excluded_count = 0
+        self.dirs_data.data_dst.excluded_count = 0
+        manifests = []
+        indexes = []
+        sides = []
+        try:
+            for data in (self.dirs_data.data_src, self.dirs_data.data_dst):
+                if data.is_manifest:
+                    manifest = Manifest(data.path)
+                    manifests.append(manifest)
+                    sides.append((manifest, None))
+                    continue
+                index = TreeIndex(data.path) if self.use_index else None
+                if index is not None:
+                    indexes.append(index)
+                records = iter_tree_records(
+                    data.path, self._get_tree_filter(data.path, data),
+                    self.symlinks == 'follow')
+                sides.append((records, index))
+            hash_algorithms = set(x.hash_algorithm for x in manifests)
+            # The content hashes are compared if every manifest lists them,
+            # with the same algorithm; the files of a tree are hashed with
+            # it.
+            hash_algorithm = None
+            if len(hash_algorithms) == 1 and\
+                    None not in hash_algorithms and\
+                    hash_algorithms <= set(get_hash_algorithms()):
+                hash_algorithm = hash_algorithms.pop()
+                self.hash_algorithm = hash_algorithm
+            elif self.comparison.name not in ('size', 'mtime'):
+                logger.warning(
+                    'The manifests do not list content hashes of a common '
+                    'algorithm; comparing the files by their sizes and '
+                    'modification times instead of with "%s".',
+                    self.comparison.name)
+
+            def are_files_equal(src_record, dst_record):
+                return self._are_records_equal(
+                    src_record, dst_record, hash_algorithm is not None,
+                    sides[0][1], sides[1][1])
+
+            for kind, src_record, dst_record in diff_records(
+                    sides[0][0], sides[1][0], are_files_equal):
+                src_path = dst_path = None
+                if src_record is not None:
+                    src_path = self.dirs_data.data_src.path /\
+                        src_record.rel_path
+                if dst_record is not None:
+                    dst_path = self.dirs_data.data_dst.path /\
+                        dst_record.rel_path
+                if kind == CONTENT:
+                    self.manifest_sizes[src_path] = (src_record.size,
+                                                     dst_record.size)
+                yield DiffEvent(kind, src_path, dst_path)
+            # Known once the manifests are read to the end.
+            for data, (records, _) in zip((self.dirs_data.data_src,
+                                           self.dirs_data.data_dst), sides):
+                if data.is_manifest:
+                    data.excluded_count = records.excluded_count
+        finally:
+            for manifest in manifests:
+                manifest.close()
+            for index in indexes:
+                index.close()
+
+    def _are_records_equal(self, src_record, dst_record, use_hashes,
+                           index_src, index_dst):
+        '''
+        `_are_files_equal()` for `ManifestRecord`s: the files are compared
+        by their content hashes if `use_hashes`, or otherwise by their
+        modification times; unless the comparison only uses their sizes.
+        '''
+        if src_record.kind == LINK or dst_record.kind == LINK:
+            return src_record.kind == dst_record.kind and\
+                src_record.target == dst_record.target
+        if src_record.size != dst_record.size:
+            return False
+        if self.comparison.name == 'size':
+            return True
+        are_mtimes_equal = abs(src_record.mtime_ns - dst_record.mtime_ns) <=\
+            getattr(self.comparison, 'modify_window_ns', 0)
+        if self.comparison.name == 'mtime' or (
+                self.comparison.uses_mtime and are_mtimes_equal) or\
+                not use_hashes:
+            return are_mtimes_equal
+        hashes = []
+        for record, index, base_path in (
+                (src_record, index_src, self.dirs_data.data_src.path),
+                (dst_record, index_dst, self.dirs_data.data_dst.path)):
+            if record.content_hash is None:
+                record.content_hash = self._get_file_hash(index, base_path,
+                                                          record.entry)
+            hashes.append(record.content_hash)
+        return hashes[0] == hashes[1]
+
+    def export_manifest(self, file_path, with_hashes=False):
+        '''
+        Write a manifest of the src tree to `file_path`, leaving out the same
+        items as the comparison; to compare against it later, in place of
+        the tree. See `write_manifest()`.
+        `with_hashes`: Whether to list the content hashes of the files too.
+        Returns the number of items listed.
+        '''
+        data = self.dirs_data.data_src
+        data.excluded_count = 0
+        base_path = data.path
+        index = TreeIndex(base_path) if self.use_index else None
+        if with_hashes:
+            def get_file_hash(entry):
+                return self._get_file_hash(index, base_path, entry)
+        else:
+            get_file_hash = None
+
+        try:
+            return write_manifest(
+                file_path, iter_tree_records(
+                    base_path, self._get_tree_filter(base_path, data),
+                    self.symlinks == 'follow', get_file_hash),
+                self.hash_algorithm if with_hashes else None,
+                lambda: data.excluded_count)
+        finally:
+            if index is not None:
+                index.close()
+
+    def check_differences(self):
+        '''
+        Checks and stores the differences between the 2 directories.
+        '''
+        start = time.perf_counter()
+        for event in self.iter_differences():
+            self.dirs_data.add_event(event)
+        if self.stats is not None:
+            self.stats.add_time('check_differences',
+                                time.perf_counter() - start)
 
     def _sync_items(self,
                     item1,
@@ -231,35 +911,174 @@ class DirectSync:
         Synchronize two files/directories.
         `overwrite`: Whether to overwrite item1 on item2 if present.
         '''
+        if self.symlinks == 'copy' and item1.is_symlink():
+            if overwrite or not os.path.lexists(str(item2)):
+                item2.parent.mkdir(parents=True, exist_ok=True)
+                self._remove_item(item2, use_trash)
+                os.symlink(os.readlink(str(item1)), str(item2),
+                           target_is_directory=item1.is_dir())
+            return
         if item1.exists():
+            # Normally already present, unless an earlier phase removed it.
+            item2.parent.mkdir(parents=True, exist_ok=True)
             if not overwrite and not item2.exists():
                 if item1.is_dir():
-                    shutil.copytree(item1, item2)
+                    self._copy_tree(item1, item2)
                 else:
-                    shutil.copyfile(item1, item2)
+                    self._copy_file(item1, item2)
             elif overwrite:
                 if item1.is_dir():
                     if item2.exists():
                         shutil.rmtree(item2) if not use_trash\
                             else send2trash(str(item2.resolve()))
-                    shutil.copytree(item1, item2)
+                    self._copy_tree(item1, item2)
                 else:
                     should_reverse = self._compare_file_mtime(item1,
                                                               item2,
                                                               preserve_latest)
                     if should_reverse:
                         item1, item2 = item2, item1
-                    if item2.exists() and use_trash:
+                    if self.symlinks == 'copy' and item2.is_symlink():
+                        # Replace the link, rather than the file it points
+                        # to.
+                        self._remove_item(item2, use_trash)
+                    elif item2.exists() and use_trash:
                         send2trash(str(item2.resolve()))
-                    shutil.copyfile(item1, item2)
+                    self._overwrite_file(item1, item2)
                     if should_reverse:
                         item1, item2 = item2, item1
 
+    def _overwrite_file(self, path_src, path_dst):
+        '''
+        Copy `path_src` over `path_dst`; with delta transfers enabled, only
+        the changed blocks of big files are rewritten.
+        '''
+        if self.delta_mode != 'off' and path_dst.exists() and\
+                path_src.stat().st_size >= self.delta_threshold:
+            start = time.perf_counter()
+            bytes_written = delta_copy_file(
+                path_src, path_dst, atomic=self.delta_mode == 'atomic')
+            self.copy_stats.record('delta', bytes_written,
+                                   time.perf_counter() - start)
+            self._copy_mtime(path_src, path_dst)
+        else:
+            self._copy_file(path_src, path_dst)
+
+    def _copy_file(self, path_src, path_dst):
+        '''
+        Copy the contents of a file with `copy_file_atomic()`.
+        '''
+        def copy_function(path_src, path_dst):
+            copy_file_atomic(path_src, path_dst, self.copy_stats)
+            self._copy_mtime(path_src, path_dst)
+
+        self._copy_or_link(path_src, path_dst, copy_function)
+
+    def _copy_or_link(self, path_src, path_dst, copy_function):
+        '''
+        Call `copy_function(path_src, path_dst)`; unless hardlinks are
+        preserved and another hardlink of `path_src` was already copied, in
+        which case `path_dst` is hardlinked to that copy instead.
+        '''
+        if not self.preserve_hardlinks:
+            copy_function(path_src, path_dst)
+            return
+        stat_result = os.stat(str(path_src))
+        if stat_result.st_nlink < 2:
+            copy_function(path_src, path_dst)
+            return
+        hardlink_key = (stat_result.st_dev, stat_result.st_ino)
+        linked_path = self.hardlink_copies.get(hardlink_key)
+        if linked_path is not None:
+            start = time.perf_counter()
+            try:
+                if os.path.lexists(str(path_dst)):
+                    os.unlink(str(path_dst))
+                os.link(linked_path, str(path_dst))
+                self.copy_stats.record('hardlink', 0,
+                                       time.perf_counter() - start)
+                return
+            except OSError:
+                # E.g. the copy is on another filesystem, or is gone.
+                pass
+        copy_function(path_src, path_dst)
+        with self.hardlink_lock:
+            self.hardlink_copies.setdefault(hardlink_key, str(path_dst))
+
+    def _copy_mtime(self, path_src, path_dst):
+        '''
+        Give `path_dst` the access and modification times of `path_src`, if
+        the comparison strategy relies on them; otherwise the copy would not
+        be found identical on the next run.
+        '''
+        if self.comparison.uses_mtime:
+            stat_result = path_src.stat()
+            os.utime(str(path_dst), ns=(stat_result.st_atime_ns,
+                                        stat_result.st_mtime_ns))
+
+    def _copy_tree(self, dir_src, dir_dst):
+        '''
+        `shutil.copytree()`, but with the file contents copied by
+        `copy_file_atomic()`, and leaving out the same items as the
+        comparison.
+        '''
+        def copy_contents(path_src, path_dst):
+            copy_file_atomic(path_src, path_dst, self.copy_stats)
+            shutil.copystat(path_src, path_dst)
+
+        def copy_function(path_src, path_dst):
+            self._copy_or_link(path_src, path_dst, copy_contents)
+
+        shutil.copytree(dir_src, dir_dst,
+                        symlinks=self.symlinks == 'copy',
+                        ignore=self._get_ignored_names,
+                        copy_function=copy_function)
+
+    def _get_ignored_names(self, dir_path, names):
+        '''
+        The `ignore` function of `shutil.copytree()` for the directories of
+        src; returns the names of the entries of `dir_path` left out by the
+        ignore rules or by the symlink policy.
+        '''
+        ignored_names = set()
+        src_base_path = self.dirs_data.data_src.path
+        ignore_file_path = None
+        if self.ignore_file_name and self.ignore_file_name in names:
+            ignore_file_path = os.path.join(dir_path, self.ignore_file_name)
+        if self.ignore_file_name or not self.root_matcher.is_empty:
+            rel_dir = Path(dir_path).relative_to(src_base_path).as_posix()
+            if rel_dir == '.':
+                rel_dir = ''
+            matcher = self._get_dir_matcher(rel_dir, ignore_file_path)
+            if not matcher.is_empty:
+                prefix = rel_dir + '/' if rel_dir else ''
+                for name in names:
+                    if matcher.is_excluded(prefix + name, os.path.isdir(
+                            os.path.join(dir_path, name))):
+                        ignored_names.add(name)
+        if self.symlinks != 'copy':
+            for name in names:
+                path = os.path.join(dir_path, name)
+                if name in ignored_names or not os.path.islink(path):
+                    continue
+                # Broken symlinks are left out, like in the comparison.
+                if self.symlinks == 'skip' or not os.path.exists(path) or (
+                        os.path.isdir(path) and
+                        self._is_followed_loop(path, src_base_path)):
+                    ignored_names.add(name)
+        return ignored_names
+
     def _remove_item(self, item, use_trash=False):
         '''
         Helper function to remove a file/directory.
         '''
-        if item.exists():
+        if item.is_symlink():
+            # Remove the link itself, whatever it points to.
+            if use_trash:
+                send2trash(str(item))
+            else:
+                item.unlink()
+        elif item.exists():
             if item.is_dir():
                 if use_trash:
                     send2trash(str(item.resolve()))
@@ -271,6 +1090,60 @@ class DirectSync:
                 else:
                     item.unlink()
 
+    def _find_moves(self, add_missing, remove_extra):
+        '''
+        Returns the `(item of dst, its new path, item of src)` of the items
+        extra in dst to move to where an identical item extra in src goes,
+        if moves are detected; see `MoveDetector`.
+        '''
+        if not (self.detect_moves and add_missing and remove_extra):
+            return []
+        if self.stats is not None:
+            start = time.perf_counter()
+        move_detector = MoveDetector(self.hash_algorithm,
+                                     self._get_ignored_names, self.stats)
+        moves = move_detector.find_moves(self.dirs_data.data_src.diff,
+                                         self.dirs_data.data_dst.diff)
+        if self.stats is not None:
+            self.stats.add_time('find_moves', time.perf_counter() - start)
+        src_base_path = self.dirs_data.data_src.path
+        dst_base_path = self.dirs_data.data_dst.path
+        return [(item_dst, dst_base_path / item_src.relative_to(src_base_path),
+                 item_src) for item_dst, item_src in moves]
+
+    def _move_item(self, item, item_new, item_src):
+        '''
+        Rename `item` of dst to `item_new`; `item_src` being its identical
+        counterpart in src.
+        '''
+        if not os.path.lexists(str(item)) and\
+                os.path.lexists(str(item_new)):
+            # Already moved, before an interruption.
+            return
+        start = time.perf_counter()
+        try:
+            os.rename(str(item), str(item_new))
+        except OSError:
+            # E.g. `item_new` is on another filesystem (a mount point), or
+            # is still occupied; copy the item instead, as without moves.
+            if os.path.lexists(str(item_new)):
+                self._remove_item(item_new)
+            self._sync_items(item_src, item_new)
+            self._remove_item(item)
+            return
+        self.copy_stats.record('rename', 0, time.perf_counter() - start)
+        if not self.comparison.uses_mtime:
+            return
+        if not item_src.is_dir():
+            self._copy_mtime(item_src, item_new)
+            return
+        for dir_path, _, file_names in os.walk(str(item_new)):
+            for name in file_names:
+                path_dst = Path(dir_path, name)
+                path_src = item_src / path_dst.relative_to(item_new)
+                if path_src.exists():
+                    self._copy_mtime(path_src, path_dst)
+
     def _compare_file_mtime(self, item1, item2, preserve_latest):
         return preserve_latest and (item1.stat().st_mtime <
                                     item2.stat().st_mtime)
@@ -292,13 +1165,27 @@ class DirectSync:
                         absent from the source.
         `dry_run`: If true, then just print the operations to be performed.
         '''
+        self._check_can_sync()
+        self.sync_failures = []
+        self.copy_stats = CopyStats()
+        start = time.perf_counter()
+        moves = self._find_moves(add_missing, remove_extra)
+        items_extra_src = self.dirs_data.data_src.diff
+        items_extra_dst = self.dirs_data.data_dst.diff
+        if moves:
+            # Neither copied nor removed.
+            moved_items = set(x[0] for x in moves) | set(x[2] for x in moves)
+            items_extra_src = [x for x in items_extra_src
+                               if x not in moved_items]
+            items_extra_dst = [x for x in items_extra_dst
+                               if x not in moved_items]
         if self.show_progress_bar:
-            total_files_count = 0
+            total_files_count = len(moves)
             # Compute how many files do we need to visit; for the progress bar.
             if add_missing:
-                total_files_count += len(self.dirs_data.data_src.diff)
+                total_files_count += len(items_extra_src)
             if remove_extra:
-                total_files_count += len(self.dirs_data.data_dst.diff)
+                total_files_count += len(items_extra_dst)
             if overwrite:
                 total_files_count += len(self.dirs_data.content_diff)
             if total_files_count == 0:
@@ -309,32 +1196,57 @@ class DirectSync:
             self.progress_bar = tqdm(
                 total=total_files_count, desc=desc, unit=' items')
 
+        executor = SyncExecutor(self.jobs, on_done=self._mark_file_visit,
+                                stats=self.stats)
         dry_run_report = '\n**Dry run** report:'
         dry_run_header = '\n\n' + '>' * 25
         dry_run_footer = '<' * 25
-        if remove_extra and len(self.dirs_data.data_dst.diff):
+        # The phases below run one after the other, so that the removals are
+        # done before the copies which might replace the removed items.
+        # They are all planned before any is run, so that they can be
+        # journaled.
+        phases = []
+        if remove_extra and len(items_extra_dst):
             dry_run_report += dry_run_header
             dry_run_report += '\nWill be removed: ({})\n'.format(
-                len(self.dirs_data.data_dst.diff))
-            items_extra = self.dirs_data.data_dst.diff
-            for item in items_extra:
+                len(items_extra_dst))
+            operations = []
+            for item in items_extra_dst:
                 if dry_run:
                     dry_run_report += ' - "{}"\n'.format(item)
+                    self._mark_file_visit()
                 else:
-                    self._remove_item(item, use_trash)
-                self._mark_file_visit()
+                    operations.append(
+                        (item, self._remove_item, (item, use_trash)))
+            phases.append(operations)
             dry_run_report += dry_run_footer
-        if add_missing and len(self.dirs_data.data_src.diff):
+        # After the removals, which might free the new paths of the moved
+        # items (e.g. a file replaced by a directory of the same name).
+        if moves:
+            dry_run_report += dry_run_header
+            dry_run_report += '\nWill be moved within dst: ({})\n'.format(
+                len(moves))
+            operations = []
+            for item, item_new, item_src in moves:
+                if dry_run:
+                    dry_run_report += ' - "{}" -> "{}"\n'.format(item,
+                                                                 item_new)
+                    self._mark_file_visit()
+                else:
+                    operations.append(
+                        (item, self._move_item, (item, item_new, item_src)))
+            phases.append(operations)
+            dry_run_report += dry_run_footer
+        if add_missing and len(items_extra_src):
             dry_run_report += dry_run_header
             dry_run_report += '\nWill be copied'
             if overwrite:
                 dry_run_report += ' (overwritten if present)'
             else:
                 dry_run_report += ' (unchanged if already existing)'
-            dry_run_report += ': ({})\n'.format(
-                len(self.dirs_data.data_src.diff))
-            items_extra = self.dirs_data.data_src.diff
-            for item_src in items_extra:
+            dry_run_report += ': ({})\n'.format(len(items_extra_src))
+            operations = []
+            for item_src in items_extra_src:
                 src_base_path = self.dirs_data.data_src.path
                 dst_base_path = self.dirs_data.data_dst.path
                 item_relative = item_src.relative_to(src_base_path)
@@ -342,16 +1254,20 @@ class DirectSync:
                 if dry_run:
                     dry_run_report += ' - "{}" -> "{}"\n'.format(
                         item_src, item_dst)
+                    self._mark_file_visit()
                 else:
-                    self._sync_items(item_src, item_dst, overwrite, use_trash,
-                                     preserve_latest)
-                self._mark_file_visit()
+                    operations.append(
+                        (item_src, self._sync_items,
+                         (item_src, item_dst, overwrite, use_trash,
+                          preserve_latest)))
+            phases.append(operations)
             dry_run_report += dry_run_footer
         if overwrite and len(self.dirs_data.content_diff):
             dry_run_report += dry_run_header
             dry_run_report += '\nWill be overwritten: ({})\n'.format(
                 len(self.dirs_data.content_diff))
             items_common = self.dirs_data.content_diff
+            operations = []
             for item in items_common:
                 item_src = item[0]
                 item_dst = item[1]
@@ -365,51 +1281,369 @@ class DirectSync:
                         item_src, item_dst)
                     if should_reverse:
                         item_src, item_dst = item_dst, item_src
+                    self._mark_file_visit()
                 else:
-                    self._sync_items(item_src, item_dst, True, use_trash,
-                                     preserve_latest)
-                self._mark_file_visit()
+                    operations.append(
+                        (item_src, self._sync_items,
+                         (item_src, item_dst, True, use_trash,
+                          preserve_latest)))
+            phases.append(operations)
             dry_run_report += dry_run_footer
+        if dry_run and (add_missing or overwrite):
+            dry_run_report += '\n\nCopy backends to try, in order: {}'.format(
+                ', '.join(BACKENDS))
+            if overwrite and self.delta_mode != 'off':
+                dry_run_report += '\nFiles of at least {} bytes will be'\
+                    ' overwritten by a delta transfer ({}).'.format(
+                        self.delta_threshold, self.delta_mode)
+        journal = None
+        if self.use_journal and not dry_run and phases:
+            journal = SyncJournal(get_journal_filepath(self),
+                                  self.dirs_data.data_src.path,
+                                  self.dirs_data.data_dst.path)
+            phases = journal.plan(phases)
+        try:
+            for operations in phases:
+                executor.run(operations)
+        except BaseException:
+            # E.g. interrupted; the journal is kept to resume from.
+            if journal is not None:
+                journal.close()
+            raise
+        if journal is not None:
+            # Kept if anything failed, so that it can be resumed.
+            journal.close(remove=not executor.failures)
+        self.sync_failures = executor.failures
+        if self.stats is not None:
+            self.stats.add_time('sync_dirs', time.perf_counter() - start)
         if self.progress_bar:
             self.progress_bar.close()
         return dry_run_report
 
+    def resume_sync(self):
+        '''
+        Finish the sync journaled by an interrupted `sync_dirs()` call:
+        only its operations not done yet are run, in the same phases, and
+        without checking the differences again.
+        Returns whether there was a journal to resume.
+        '''
+        journal_path = get_journal_filepath(self)
+        if not journal_path.exists():
+            return False
+        self.sync_failures = []
+        self.copy_stats = CopyStats()
+        operations = read_unfinished_operations(
+            journal_path, self.dirs_data.data_src.path,
+            self.dirs_data.data_dst.path)
+        functions = {'_move_item': self._move_item,
+                     '_remove_item': self._remove_item,
+                     '_sync_items': self._resume_sync_items}
+        phases = {}
+        for phase, function_name, args in operations:
+            phases.setdefault(phase, []).append(
+                (args[0], functions[function_name], tuple(args)))
+        start = time.perf_counter()
+        executor = SyncExecutor(self.jobs, stats=self.stats)
+        for phase in sorted(phases):
+            executor.run(phases[phase])
+        self.sync_failures = executor.failures
+        if self.stats is not None:
+            self.stats.add_time('resume_sync', time.perf_counter() - start)
+        if not executor.failures:
+            journal_path.unlink()
+        return True
+
+    def _resume_sync_items(self,
+                           item1,
+                           item2,
+                           overwrite=False,
+                           use_trash=False,
+                           preserve_latest=False):
+        '''
+        `_sync_items()`, for an operation which might have been interrupted
+        halfway. Files are copied atomically, so only the leftover temporary
+        file needs to be cleaned up; but a directory (always missing from
+        dst when the sync was planned) might be partially copied, and is
+        completed instead of being left alone or copied again.
+        '''
+        self._remove_temp_file(item2)
+        if item1.is_dir() and item2.is_dir() and\
+                not (self.symlinks == 'copy' and item1.is_symlink()) and\
+                not item2.is_symlink():
+            self._resume_copy_tree(item1, item2)
+        else:
+            self._sync_items(item1, item2, overwrite, use_trash,
+                             preserve_latest)
+
+    def _resume_copy_tree(self, dir_src, dir_dst):
+        '''
+        Copy the entries of `dir_src` missing from `dir_dst`, the partial
+        result of an interrupted `_copy_tree()`.
+        '''
+        names = os.listdir(str(dir_src))
+        ignored_names = self._get_ignored_names(str(dir_src), names)
+        for name in names:
+            if name in ignored_names:
+                continue
+            path_src = dir_src / name
+            path_dst = dir_dst / name
+            self._remove_temp_file(path_dst)
+            if not os.path.lexists(str(path_dst)):
+                self._sync_items(path_src, path_dst)
+            elif path_src.is_dir() and path_dst.is_dir() and\
+                    not path_dst.is_symlink() and\
+                    not (self.symlinks == 'copy' and path_src.is_symlink()):
+                self._resume_copy_tree(path_src, path_dst)
+        shutil.copystat(str(dir_src), str(dir_dst))
+
+    @staticmethod
+    def _remove_temp_file(path_dst):
+        '''
+        Remove the temporary file of an interrupted copy to `path_dst`.
+        '''
+        path_tmp = get_temp_path(path_dst)
+        if os.path.lexists(path_tmp):
+            os.unlink(path_tmp)
+
+    def _check_can_sync(self):
+        if self.dirs_data.data_src.is_manifest or\
+                self.dirs_data.data_dst.is_manifest:
+            raise Exception('Cannot sync with a manifest, only compare!')
+
+    def _get_sync_operation(self, event, overwrite, add_missing,
+                            remove_extra, use_trash, preserve_latest):
+        '''
+        Return the operation to apply for a `DiffEvent` as a tuple
+        `(phase, (item, function, args))`, where the operations of phase 0
+        (removals) must be done before the ones of phase 1 (copies); or
+        `None` if the event is to be left alone.
+        '''
+        if event.kind == EXTRA_DST:
+            if remove_extra:
+                return 0, (event.dst, self._remove_item,
+                           (event.dst, use_trash))
+        elif event.kind == EXTRA_SRC:
+            if add_missing:
+                item_relative = event.src.relative_to(
+                    self.dirs_data.data_src.path)
+                item_dst = self.dirs_data.data_dst.path / item_relative
+                return 1, (event.src, self._sync_items,
+                           (event.src, item_dst, overwrite, use_trash,
+                            preserve_latest))
+        elif overwrite:
+            return 1, (event.src, self._sync_items,
+                       (event.src, event.dst, True, use_trash,
+                        preserve_latest))
+        return None
+
+    def sync_events(self,
+                    events,
+                    overwrite=False,
+                    add_missing=False,
+                    remove_extra=False,
+                    dry_run=False,
+                    use_trash=False,
+                    preserve_latest=False,
+                    stream=None,
+                    batch_size=1000):
+        '''
+        Same as `sync_dirs()`, but apply the `DiffEvent`s of `events` (e.g.
+        from `iter_differences()`) as they come instead of the stored
+        differences; so that the sync starts before the comparison is over.
+        The events are applied in batches of about `batch_size`, with the
+        removals of a batch done before its copies. A batch only ends
+        between 2 directories, as conflicting items (e.g. a file in src and
+        a directory of the same name in dst) always share their parent.
+        `stream`: Where to write the operations in dry-run mode.
+        '''
+        self._check_can_sync()
+        self.sync_failures = []
+        self.copy_stats = CopyStats()
+        executor = SyncExecutor(self.jobs, stats=self.stats)
+        src_base_path = self.dirs_data.data_src.path
+        dst_base_path = self.dirs_data.data_dst.path
+        # The operations of the current batch, per phase.
+        batch = ([], [])
+        last_parent = None
+
+        def run_batch():
+            for operations in batch:
+                executor.run(operations)
+                del operations[:]
+
+        for event in events:
+            if event.src is not None:
+                parent = event.src.parent.relative_to(src_base_path)
+            else:
+                parent = event.dst.parent.relative_to(dst_base_path)
+            if len(batch[0]) + len(batch[1]) >= batch_size and\
+                    parent != last_parent:
+                run_batch()
+            last_parent = parent
+            sync_operation = self._get_sync_operation(
+                event, overwrite, add_missing, remove_extra, use_trash,
+                preserve_latest)
+            if sync_operation is None:
+                continue
+            phase, operation = sync_operation
+            if dry_run:
+                args = operation[2]
+                if phase == 0:
+                    stream.write('Will remove: "{}"\n'.format(args[0]))
+                else:
+                    item_src, item_dst = args[0], args[1]
+                    if event.kind == CONTENT and self._compare_file_mtime(
+                            item_src, item_dst, preserve_latest):
+                        item_src, item_dst = item_dst, item_src
+                    stream.write('Will copy: "{}" -> "{}"\n'.format(
+                        item_src, item_dst))
+            else:
+                batch[phase].append(operation)
+        run_batch()
+        self.sync_failures = executor.failures
+
+    def get_stats(self):
+        '''
+        Return the stats collected so far as a JSON-serializable dict, or
+        `None` if they are not enabled. Includes the bytes copied per copy
+        backend by the last sync.
+        '''
+        if self.stats is None:
+            return None
+        stats = self.stats.to_dict()
+        stats['copy_backends'] = {
+            backend: {'files': files, 'bytes': num_bytes, 'seconds': seconds}
+            for backend, (files, num_bytes, seconds) in
+            self.copy_stats.backends.items()
+        }
+        return stats
+
+    def get_stats_report(self):
+        '''
+        Return the stats collected so far in a human readable format.
+        '''
+        if self.stats is None:
+            return ''
+        return self.stats.get_report()
+
+    def get_failures_report(self):
+        '''
+        Report the items which could not be synchronized by the last call to
+        `sync_dirs()`, if any.
+        '''
+        if not self.sync_failures:
+            return ''
+        report_string = '\nFailed to sync: ({})\n'.format(
+            len(self.sync_failures))
+        for item, err in self.sync_failures:
+            report_string += ' - "{}": {}\n'.format(item, err)
+        return report_string
+
     def _mark_file_visit(self):
         '''
         Update the progress bar with 1 more iteraion.
         '''
         if self.show_progress_bar:
-            self.progress_bar.update()
+            with self.progress_lock:
+                self.progress_bar.update()
 
     def get_report(self):
         '''
         Print the difference check report in a human as well as
         machine readable format.
         '''
+        report_stream = io.StringIO()
+        self.write_report(report_stream)
+        return report_stream.getvalue()
+
+    def write_report(self, stream):
+        '''
+        Same as `get_report()`, but write the report to `stream` piece by
+        piece instead of building it in memory.
+        '''
         num_content_diff = len(self.dirs_data.content_diff)
         num_src_extra = len(self.dirs_data.data_src.diff)
         num_dst_extra = len(self.dirs_data.data_dst.diff)
         if not (num_content_diff or num_src_extra or num_dst_extra):
-            report_string = '\nNo differences found!\n'
-            return report_string
-        report_string = 'Comparison report:\n'
-        report_string += '\n' + 'x' * 25 + '\n'
-        report_string += 'Contents different: (' + str(num_content_diff)\
-                                                 + ')\n'
+            stream.write('\nNo differences found!\n')
+            stream.write(self._get_excluded_summary())
+            return
+        stream.write('Comparison report:\n')
+        stream.write('\n' + 'x' * 25 + '\n')
+        stream.write('Contents different: (' + str(num_content_diff) + ')\n')
         for entry in self.dirs_data.content_diff:
-            report_string += '- ' + str(entry[0].relative_to(
-                self.dirs_data.data_src.path)) + ' --- bigger size in ' + ('src' if is_src_file_bigger(entry[0], entry[1]) else 'dst') + '\n'
-        report_string += '-' * 25
-        report_string += '\n\n' + '[' * 25 + '\n'
-        report_string += 'Extra in src: (' + str(num_src_extra) + ')\n'
+            stream.write(self._get_event_description(
+                DiffEvent(CONTENT, entry[0], entry[1])) + '\n')
+        stream.write('-' * 25)
+        stream.write('\n\n' + '[' * 25 + '\n')
+        stream.write('Extra in src: (' + str(num_src_extra) + ')\n')
         for entry in self.dirs_data.data_src.diff:
-            report_string += '- ' + str(
-                entry.relative_to(self.dirs_data.data_src.path)) + '\n'
-        report_string += '-' * 25
-        report_string += '\n\n' + ']' * 25 + '\n'
-        report_string += 'Extra in dst: (' + str(num_dst_extra) + ')\n'
+            stream.write(self._get_event_description(
+                DiffEvent(EXTRA_SRC, entry, None)) + '\n')
+        stream.write('-' * 25)
+        stream.write('\n\n' + ']' * 25 + '\n')
+        stream.write('Extra in dst: (' + str(num_dst_extra) + ')\n')
         for entry in self.dirs_data.data_dst.diff:
-            report_string += '- ' + str(
-                entry.relative_to(self.dirs_data.data_dst.path)) + '\n'
-        report_string += '-' * 25 + '\n\n'
-        return report_string
+            stream.write(self._get_event_description(
+                DiffEvent(EXTRA_DST, None, entry)) + '\n')
+        stream.write('-' * 25 + '\n\n')
+        stream.write(self._get_excluded_summary())
+
+    def _get_excluded_summary(self):
+        src_count = self.dirs_data.data_src.excluded_count
+        dst_count = self.dirs_data.data_dst.excluded_count
+        if not (src_count or dst_count):
+            return ''
+        return 'Excluded: ({} in src, {} in dst)\n'.format(src_count,
+                                                           dst_count)
+
+    def _get_event_description(self, event):
+        if event.kind == CONTENT and (self.dirs_data.data_src.is_manifest or
+                                      self.dirs_data.data_dst.is_manifest):
+            sizes = self.manifest_sizes.get(event.src)
+            description = '- ' + str(event.src.relative_to(
+                self.dirs_data.data_src.path))
+            if sizes is None or sizes[0] == sizes[1]:
+                return description + ' --- different contents'
+            return description + ' --- bigger size in ' + (
+                'src' if sizes[0] > sizes[1] else 'dst')
+        if event.kind == CONTENT:
+            if self.symlinks == 'copy' and (event.src.is_symlink() or
+                                            event.dst.is_symlink()):
+                return '- ' + str(event.src.relative_to(
+                    self.dirs_data.data_src.path)) + ' --- different symlinks'
+            return '- ' + str(event.src.relative_to(
+                self.dirs_data.data_src.path)) + ' --- bigger size in ' + (
+                    'src' if is_src_file_bigger(event.src, event.dst)
+                    else 'dst')
+        if event.kind == EXTRA_SRC:
+            return '- ' + str(event.src.relative_to(
+                self.dirs_data.data_src.path))
+        return '- ' + str(event.dst.relative_to(self.dirs_data.data_dst.path))
+
+    def report_events(self, events, stream):
+        '''
+        Write a report line to `stream` for each `DiffEvent` of `events` as
+        it comes, and pass it on; so that it can be chained with
+        `sync_events()`.
+        A summary is written once `events` is exhausted.
+        '''
+        titles = {
+            CONTENT: 'Contents different',
+            EXTRA_SRC: 'Extra in src',
+            EXTRA_DST: 'Extra in dst'
+        }
+        counts = dict.fromkeys(titles, 0)
+        for event in events:
+            counts[event.kind] += 1
+            description = self._get_event_description(event)
+            stream.write('{}: {}\n'.format(titles[event.kind],
+                                           description[2:]))
+            stream.flush()
+            yield event
+        if not any(counts.values()):
+            stream.write('\nNo differences found!\n')
+        else:
+            stream.write('\n' + ', '.join('{}: ({})'.format(
+                titles[x], counts[x]) for x in titles) + '\n')
+        stream.write(self._get_excluded_summary())
@@ -0,0 +1,68 @@
+import os
+import shutil
+
+from .copying import copy_file, get_temp_path
+
+# The size of the blocks compared and rewritten by `delta_copy_file()`.
+DELTA_BLOCK_SIZE = 131072
+
+
+def _patch_file(fsrc, fdst, block_size):
+    '''
+    Rewrite only the blocks of `fdst` which differ from `fsrc`, and
+    truncate it to the size of `fsrc`.
+    Returns the number of bytes written.
+    '''
+    bytes_written = 0
+    offset = 0
+    while True:
+        src_block = fsrc.read(block_size)
+        if not src_block:
+            break
+        dst_block = fdst.read(len(src_block))
+        if src_block != dst_block:
+            fdst.seek(offset)
+            fdst.write(src_block)
+            bytes_written += len(src_block)
+        offset += len(src_block)
+        # Reads and writes of a file object must be separated by a seek.
+        fdst.seek(offset)
+    fdst.truncate(offset)
+    return bytes_written
+
+
+def delta_copy_file(path_src, path_dst, atomic=True,
+                    block_size=DELTA_BLOCK_SIZE):
+    '''
+    Make `path_dst` a copy of `path_src` by only writing the blocks which
+    differ between the 2 files, instead of rewriting all of `path_dst`.
+    Both files are local, so their blocks are compared directly at the same
+    offsets, both files being read in full; rather than through the block
+    checksums of rsync, which only save reads when one side is remote. So
+    appends and edits in place are cheap, but an insertion rewrites the
+    rest of the file.
+    `atomic`: If true, the blocks are written to a temporary copy of
+              `path_dst`, which is then renamed over it; so that readers
+              never see a half-updated file. The temporary copy is only
+              cheap where `copy_file()` can reflink it.
+              Else, `path_dst` is patched in place.
+    Returns the number of bytes written.
+    '''
+    path_dst = str(path_dst)
+    if not atomic:
+        with open(str(path_src), 'rb') as fsrc, open(path_dst, 'r+b') as fdst:
+            return _patch_file(fsrc, fdst, block_size)
+    path_tmp = get_temp_path(path_dst)
+    try:
+        copy_file(path_dst, path_tmp)
+        shutil.copymode(path_dst, path_tmp)
+        with open(str(path_src), 'rb') as fsrc, open(path_tmp, 'r+b') as fdst:
+            bytes_written = _patch_file(fsrc, fdst, block_size)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        os.replace(path_tmp, path_dst)
+    except BaseException:
+        if os.path.exists(path_tmp):
+            os.unlink(path_tmp)
+        raise
+    return bytes_written
@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import os
+
+from .traversal import scan_dir
+
+logger = logging.getLogger(__file__)
+
+
+class TreeDigests:
+    '''
+    The Merkle digests of the directories of a tree. The digest of a
+    directory hashes the name and the size and modification time (or the
+    content hash) of each of its files, and the name and the digest of each
+    of its subdirectories; so that 2 directories with the same digest have
+    the same contents all the way down.
+    The digests are stored in the `TreeIndex` of the tree, if any. With
+    `trust_dir_mtime`, a directory whose modification time has not changed
+    since its digest was stored is not even listed, and only its
+    subdirectories are visited; like with `skip_unchanged_dirs`, files
+    modified in place inside such directories then go unnoticed.
+    '''
+
+    def __init__(self, root_path, filter_scan, get_file_hash=None,
+                 index=None, config='', trust_dir_mtime=False,
+                 follow_symlinks=True, stats=None):
+        '''
+        `filter_scan(rel_dir, scan)`: Return the result of `scan_dir()` of a
+                                      directory without its excluded
+                                      entries.
+        `get_file_hash(entry)`: Return the content hash of the file of a
+                                `ScanEntry`; if `None`, files are described
+                                by their size and modification time instead.
+        `config`: Identifies the settings the digests depend on; the digests
+                  stored with other settings are not reused.
+        '''
+        self.root_path = root_path
+        self.filter_scan = filter_scan
+        self.get_file_hash = get_file_hash
+        self.index = index
+        self.config = config
+        self.trust_dir_mtime = trust_dir_mtime
+        self.follow_symlinks = follow_symlinks
+        self.stats = stats
+        # The posix path of each directory relative to the root -> its
+        # digest, or `None` if it could not be computed.
+        self.digests = {}
+
+    def update(self):
+        '''
+        Compute the digests of all the directories; returns `self.digests`.
+        '''
+        self._update_dir(self.root_path, '')
+        return self.digests
+
+    def _update_dir(self, dir_path, rel_dir):
+        try:
+            stat_result = dir_path.stat()
+            stored = None
+            if self.index is not None and self.trust_dir_mtime:
+                stored = self.index.get_dir_digest(rel_dir, stat_result,
+                                                   self.config)
+            if stored is not None:
+                files_digest, subdir_names = stored
+                if self.stats is not None:
+                    self.stats.count('digest_dirs_trusted')
+            else:
+                files, subdirs = self.filter_scan(
+                    rel_dir, scan_dir(dir_path, self.follow_symlinks))
+                files_digest = self._get_files_digest(files)
+                subdir_names = [x.name for x in subdirs]
+        except OSError as err:
+            logger.warning('Cannot compute the digest of "%s": %s',
+                           dir_path, err)
+            self.digests[rel_dir] = None
+            return None
+        dir_hash = hashlib.sha1(files_digest)
+        prefix = rel_dir + '/' if rel_dir else ''
+        for name in subdir_names:
+            # Recursive call
+            subdir_digest = self._update_dir(dir_path / name, prefix + name)
+            if subdir_digest is None:
+                dir_hash = None
+            elif dir_hash is not None:
+                dir_hash.update(os.fsencode(name) + b'\0' + subdir_digest)
+        digest = dir_hash.digest() if dir_hash is not None else None
+        self.digests[rel_dir] = digest
+        if self.index is not None:
+            self.index.set_dir_digest(rel_dir, stat_result, self.config,
+                                      files_digest, subdir_names, digest)
+        return digest
+
+    def _get_files_digest(self, files):
+        files_hash = hashlib.sha1()
+        for entry in files:
+            if entry.is_link:
+                record = b'link ' + os.fsencode(os.readlink(str(entry.path)))
+            elif self.get_file_hash is not None:
+                record = b'hash ' + self.get_file_hash(entry)
+            else:
+                stat_result = entry.stat()
+                record = '{} {}'.format(stat_result.st_size,
+                                        stat_result.st_mtime_ns).encode()
+            files_hash.update(os.fsencode(entry.name) + b'\0' + record +
+                              b'\0')
+        return files_hash.digest()
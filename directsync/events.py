@@ -0,0 +1,14 @@
+from collections import namedtuple
+
+# The kinds of `DiffEvent`s.
+# An item present in src but absent in dst.
+EXTRA_SRC = 'extra-src'
+# An item present in dst but absent in src.
+EXTRA_DST = 'extra-dst'
+# A file present on either side but with different contents.
+CONTENT = 'content'
+
+# A single difference found between the 2 directories.
+# `src` and `dst` are the paths of the item on either side, or `None` for
+# the side where it is absent.
+DiffEvent = namedtuple('DiffEvent', ['kind', 'src', 'dst'])
@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+logger = logging.getLogger(__file__)
+
+# The number of directory comparisons started ahead of the consumer, per
+# worker thread; see `iter_tree_parallel()`.
+PENDING_PER_JOB = 4
+
+
+class SyncExecutor:
+    '''
+    Runs batches of file operations on a bounded pool of worker threads.
+    Each call to `run()` is a barrier: it only returns once every operation
+    of the batch is done, so that the batches can be used as ordered phases
+    (e.g. all the deletions before any of the copies).
+    A failing operation does not abort the others; the failures are
+    collected in `self.failures` as `(item, exception)` tuples instead.
+    '''
+
+    def __init__(self, jobs=1, on_done=None, stats=None):
+        self.jobs = jobs
+        # Called after every operation, whether it succeeded or not.
+        self.on_done = on_done
+        # If a `RunStats`, every operation is timed under the name of its
+        # function.
+        self.stats = stats
+        self.failures = []
+
+    def _run_operation(self, operation):
+        item, function, args = operation
+        if self.stats is not None:
+            start = time.perf_counter()
+        try:
+            function(*args)
+        except Exception as err:
+            logger.error('\nError while syncing "{}": {}'.format(item, err))
+            self.failures.append((item, err))
+        if self.stats is not None:
+            self.stats.add_time(function.__name__.lstrip('_'),
+                                time.perf_counter() - start)
+        if self.on_done is not None:
+            self.on_done()
+
+    def run(self, operations):
+        '''
+        Run `operations`, a list of `(item, function, args)` tuples where
+        `item` is the path to report in case `function(*args)` fails.
+        '''
+        if self.jobs <= 1 or len(operations) <= 1:
+            for operation in operations:
+                self._run_operation(operation)
+            return
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            # Consume the results so that the pool is drained before exit.
+            list(executor.map(self._run_operation, operations))
+
+
+def iter_tree_parallel(submit, get_result, root, max_pending):
+    '''
+    Yield the results of the comparisons of the directories of a tree in
+    depth-first order, the comparisons running concurrently ahead of the
+    consumer; but no more than `max_pending` of them are started and not
+    consumed yet, so that the results buffered do not grow with the size of
+    the tree when the consumer is slower (e.g. when streaming).
+    `submit(dir_args)`: Start the comparison of a directory, and return its
+                        future (a `concurrent.futures.Future` or an asyncio
+                        task).
+    `get_result(future)`: Wait for a comparison; it returns a tuple
+                          `(result, children)`, where `children` is the list
+                          of the `dir_args` of the subdirectories to compare
+                          next.
+    `root`: The `dir_args` of the root directory.
+    '''
+    # The directories to compare next, the last one first, as
+    # `[dir_args, future]` with a future once submitted.
+    stack = [[root, submit(root)]]
+    num_pending = 1
+    try:
+        while stack:
+            future = stack.pop()[1]
+            num_pending -= 1
+            result, children = get_result(future)
+            stack.extend([x, None] for x in reversed(children))
+            # Before the result is consumed, so that the pool keeps busy
+            # meanwhile; the directories coming next are started first.
+            for item in reversed(stack):
+                if num_pending >= max_pending:
+                    break
+                if item[1] is None:
+                    item[1] = submit(item[0])
+                    num_pending += 1
+            yield result
+    finally:
+        # If the consumer stopped early.
+        for _, future in stack:
+            if future is not None:
+                future.cancel()
@@ -0,0 +1,330 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import time
+
+from send2trash import send2trash
+
+from .copying import CopyStats, copy_file_atomic, copy_file_fanout
+from .core import DirectSync
+from .executor import PENDING_PER_JOB, SyncExecutor, iter_tree_parallel
+from .index import TreeIndex
+from .traversal import scan_dir, sort_key
+
+
+class FanOutSync:
+    '''
+    Compare and synchronize a src directory with several dst directories at
+    once, e.g. to mirror it to multiple backups.
+    There is a `DirectSync` per destination (see `self.syncs`), with its own
+    `dirs_data`; but src is only walked once: each directory of src is read
+    once and compared with the same directory of every destination having
+    it, so the metadata and the content hashes of the src files are shared.
+    Likewise, each src file to copy is read once and written to every
+    destination needing it.
+    '''
+
+    def __init__(self, dir_path_src, dir_paths_dst, **kwargs):
+        '''
+        `kwargs`: The options of every `DirectSync`, except
+                  `show_progress_bar`; there is no progress bar.
+        '''
+        self.syncs = [DirectSync(dir_path_src, dir_path_dst, **kwargs)
+                      for dir_path_dst in dir_paths_dst]
+        if any(x.dirs_data.data_src.is_manifest or
+               x.dirs_data.data_dst.is_manifest for x in self.syncs):
+            raise Exception('Manifests only support a single destination!')
+        first_sync = self.syncs[0]
+        for sync in self.syncs[1:]:
+            # The stats of the whole run are collected together.
+            sync.stats = first_sync.stats
+            sync.comparison.stats = first_sync.stats
+        self.src_path = first_sync.dirs_data.data_src.path
+        self.jobs = first_sync.jobs
+        self.stats = first_sync.stats
+        # The `(item, exception)` tuples of the last `sync_dirs()` call.
+        self.sync_failures = []
+        # The copy backends used by the last `sync_dirs()` call.
+        self.copy_stats = CopyStats()
+
+    def _compare_dir(self, src_dir_path, targets):
+        '''
+        Compare a directory of src with the same directory of each
+        destination of `targets`, a list of
+        `(index of the destination, directory path)`.
+        Returns the `(index of the destination, DiffEvents)` of each target,
+        and the `(src subdirectory, targets)` to explore next.
+        '''
+        follow_symlinks = self.syncs[0].symlinks == 'follow'
+        start = time.perf_counter()
+        try:
+            src_scan = scan_dir(src_dir_path, follow_symlinks)
+        except Exception as err:
+            for i, _ in targets:
+                self.syncs[i]._handle_dir_pair_error(src_dir_path, err)
+            return [], []
+        src_seconds = time.perf_counter() - start
+        results = []
+        # src subdirectory -> its targets
+        next_targets = {}
+        for i, dst_dir_path in targets:
+            sync = self.syncs[i]
+            events = []
+            try:
+                start = time.perf_counter()
+                dst_scan = scan_dir(dst_dir_path, follow_symlinks)
+                if self.stats is not None:
+                    sync._record_dir_pair_scan(
+                        src_seconds + time.perf_counter() - start, src_scan,
+                        dst_scan)
+                filtered_src_scan, filtered_dst_scan = sync._filter_scans(
+                    src_dir_path, dst_dir_path, src_scan, dst_scan)
+                next_subdirs = sync._compare_scanned_dir_pair(
+                    src_dir_path, dst_dir_path, filtered_src_scan,
+                    filtered_dst_scan, events)
+            except Exception as err:
+                sync._handle_dir_pair_error(src_dir_path, err)
+                next_subdirs = []
+            results.append((i, events))
+            for src_subdir_path, dst_subdir_path in next_subdirs:
+                next_targets.setdefault(src_subdir_path, []).append(
+                    (i, dst_subdir_path))
+        # In the same order as `DirectSync` explores them.
+        children = sorted(next_targets.items(),
+                          key=lambda x: sort_key(x[0].name))
+        return results, children
+
+    def _iter_dir_contents(self, src_dir_path, targets):
+        results, children = self._compare_dir(src_dir_path, targets)
+        yield results
+        for src_subdir_path, subdir_targets in children:
+            # Recursive call
+            for subdir_results in self._iter_dir_contents(src_subdir_path,
+                                                          subdir_targets):
+                yield subdir_results
+
+    def _iter_dir_contents_parallel(self, src_dir_path, targets):
+        '''
+        Same as `_iter_dir_contents()`, but with the directories compared on
+        a pool of `self.jobs` threads; see
+        `DirectSync._iter_dir_contents_parallel()`.
+        '''
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for results in iter_tree_parallel(
+                    lambda x: executor.submit(self._compare_dir, *x),
+                    lambda x: x.result(), (src_dir_path, targets),
+                    PENDING_PER_JOB * self.jobs):
+                yield results
+
+    def check_differences(self):
+        '''
+        Checks and stores the differences between src and every
+        destination, in the `dirs_data` of each `DirectSync`.
+        '''
+        start = time.perf_counter()
+        targets = []
+        for i, sync in enumerate(self.syncs):
+            sync.dir_matchers = {}
+            sync.dirs_data.data_src.excluded_count = 0
+            sync.dirs_data.data_dst.excluded_count = 0
+            targets.append((i, sync.dirs_data.data_dst.path))
+        use_index = self.syncs[0].use_index
+        if use_index:
+            # A single index of src, so that its files are hashed once.
+            index_src = TreeIndex(self.src_path)
+            for sync in self.syncs:
+                sync.index_src = index_src
+                sync.index_dst = TreeIndex(sync.dirs_data.data_dst.path)
+        try:
+            if self.jobs > 1:
+                all_results = self._iter_dir_contents_parallel(self.src_path,
+                                                               targets)
+            else:
+                all_results = self._iter_dir_contents(self.src_path, targets)
+            for results in all_results:
+                for i, events in results:
+                    for event in events:
+                        self.syncs[i].dirs_data.add_event(event)
+        finally:
+            if use_index:
+                index_src.close()
+                for sync in self.syncs:
+                    sync.index_dst.close()
+                    sync.index_src = None
+                    sync.index_dst = None
+        if self.stats is not None:
+            self.stats.add_time('check_differences',
+                                time.perf_counter() - start)
+
+    def sync_dirs(self,
+                  overwrite=False,
+                  add_missing=False,
+                  remove_extra=False,
+                  dry_run=False,
+                  use_trash=False,
+                  preserve_latest=False):
+        '''
+        Same as `DirectSync.sync_dirs()`, for every destination.
+        The removals and then the moves are done first; then each src item
+        to copy is copied to all the destinations needing it at once.
+        '''
+        if dry_run:
+            dry_run_report = ''
+            for sync in self.syncs:
+                dry_run_report += '\n\nFor "{}":'.format(
+                    sync.dirs_data.data_dst.path)
+                dry_run_report += sync.sync_dirs(
+                    overwrite, add_missing, remove_extra, dry_run, use_trash,
+                    preserve_latest)
+            return dry_run_report
+        self.sync_failures = []
+        self.copy_stats = CopyStats()
+        for sync in self.syncs:
+            sync.copy_stats = self.copy_stats
+        start = time.perf_counter()
+        executor = SyncExecutor(self.jobs, stats=self.stats)
+        # The items moved within each destination; neither removed nor
+        # copied.
+        moved_items = set()
+        move_operations = []
+        for sync in self.syncs:
+            for item, item_new, item_src in sync._find_moves(add_missing,
+                                                             remove_extra):
+                moved_items.add(item)
+                moved_items.add((sync, item_src))
+                move_operations.append(
+                    (item, sync._move_item, (item, item_new, item_src)))
+        if remove_extra:
+            executor.run([(item, sync._remove_item, (item, use_trash))
+                          for sync in self.syncs
+                          for item in sync.dirs_data.data_dst.diff
+                          if item not in moved_items])
+        # After the removals, which might free the new paths of the moved
+        # items.
+        executor.run(move_operations)
+        # src item -> the `(DirectSync, dst item, whether to overwrite)` to
+        # copy it to.
+        copies = OrderedDict()
+        for sync in self.syncs:
+            if add_missing:
+                for item_src in sync.dirs_data.data_src.diff:
+                    if (sync, item_src) in moved_items:
+                        continue
+                    item_dst = sync.dirs_data.data_dst.path /\
+                        item_src.relative_to(self.src_path)
+                    copies.setdefault(item_src, []).append(
+                        (sync, item_dst, overwrite))
+            if overwrite:
+                for item_src, item_dst in sync.dirs_data.content_diff:
+                    copies.setdefault(item_src, []).append(
+                        (sync, item_dst, True))
+        executor.run([(item_src, self._copy_to_all,
+                       (item_src, targets, use_trash, preserve_latest))
+                      for item_src, targets in copies.items()])
+        self.sync_failures = executor.failures
+        if self.stats is not None:
+            self.stats.add_time('sync_dirs', time.perf_counter() - start)
+        return ''
+
+    def _can_fan_out(self, sync, item_src, item_dst, overwrite,
+                     preserve_latest):
+        '''
+        Whether copying `item_src` to `item_dst` is a plain copy of a new
+        directory, or of a file, which can be shared with other
+        destinations; rather than a case for `DirectSync._sync_items()`
+        (symlinks, hardlinks, delta transfers, `preserve_latest` ...).
+        '''
+        if item_src.is_symlink() and sync.symlinks == 'copy':
+            return False
+        dst_exists = os.path.lexists(str(item_dst))
+        if item_src.is_dir():
+            return not dst_exists
+        if dst_exists and (not overwrite or preserve_latest or
+                           item_dst.is_symlink()):
+            return False
+        stat_result = item_src.stat()
+        if sync.preserve_hardlinks and stat_result.st_nlink > 1:
+            return False
+        return not (dst_exists and sync.delta_mode != 'off' and
+                    stat_result.st_size >= sync.delta_threshold)
+
+    def _copy_to_all(self, item_src, targets, use_trash, preserve_latest):
+        '''
+        Copy `item_src` to each of `targets`, a list of
+        `(DirectSync, dst item, whether to overwrite)`; reading it once for
+        all the targets where it is a plain copy.
+        '''
+        shared_targets = []
+        for sync, item_dst, overwrite in targets:
+            if len(targets) > 1 and self._can_fan_out(
+                    sync, item_src, item_dst, overwrite, preserve_latest):
+                shared_targets.append((sync, item_dst))
+            else:
+                sync._sync_items(item_src, item_dst, overwrite, use_trash,
+                                 preserve_latest)
+        if not shared_targets:
+            return
+        for sync, item_dst in shared_targets:
+            item_dst.parent.mkdir(parents=True, exist_ok=True)
+            if use_trash and item_dst.exists():
+                send2trash(str(item_dst.resolve()))
+        if item_src.is_dir():
+            self._copy_tree(item_src, shared_targets)
+            return
+        copy_file_fanout(item_src, [x[1] for x in shared_targets],
+                         self.copy_stats)
+        for sync, item_dst in shared_targets:
+            sync._copy_mtime(item_src, item_dst)
+
+    def _copy_tree(self, dir_src, targets):
+        '''
+        Copy the directory `dir_src` to each of `targets`, a list of
+        `(DirectSync, dst directory)`, like `DirectSync._copy_tree()`; but
+        reading each file once for all of them.
+        '''
+        sync = targets[0][0]
+        names = os.listdir(str(dir_src))
+        ignored_names = sync._get_ignored_names(str(dir_src), names)
+        for _, dir_dst in targets:
+            os.makedirs(str(dir_dst))
+        for name in names:
+            if name in ignored_names:
+                continue
+            path_src = dir_src / name
+            sub_targets = [(x, dir_dst / name) for x, dir_dst in targets]
+            if sync.symlinks == 'copy' and path_src.is_symlink():
+                link_target = os.readlink(str(path_src))
+                for _, path_dst in sub_targets:
+                    os.symlink(link_target, str(path_dst),
+                               target_is_directory=path_src.is_dir())
+            elif path_src.is_dir():
+                self._copy_tree(path_src, sub_targets)
+            elif sync.preserve_hardlinks and path_src.stat().st_nlink > 1:
+                for target_sync, path_dst in sub_targets:
+                    target_sync._copy_or_link(path_src, path_dst,
+                                              self._copy_with_stat)
+            else:
+                copy_file_fanout(path_src, [x[1] for x in sub_targets],
+                                 self.copy_stats)
+                for _, path_dst in sub_targets:
+                    shutil.copystat(str(path_src), str(path_dst))
+        for _, dir_dst in targets:
+            shutil.copystat(str(dir_src), str(dir_dst))
+
+    def _copy_with_stat(self, path_src, path_dst):
+        copy_file_atomic(path_src, path_dst, self.copy_stats)
+        shutil.copystat(str(path_src), str(path_dst))
+
+    def get_failures_report(self):
+        '''
+        Same as `DirectSync.get_failures_report()`, for all the
+        destinations.
+        '''
+        if not self.sync_failures:
+            return ''
+        report_string = '\nFailed to sync: ({})\n'.format(
+            len(self.sync_failures))
+        for item, err in self.sync_failures:
+            report_string += ' - "{}": {}\n'.format(item, err)
+        return report_string
@@ -1,42 +1,117 @@
-from binaryornot.check import is_binary
+import codecs
+import functools
+import locale
+import mmap
+import os
+import random
+import threading
 
+from binaryornot.helpers import is_binary_string
+try:
+    from binaryornot.helpers import CHUNK_SIZE, has_binary_extension
+except ImportError:
+    # Older versions of `binaryornot` only look at the first 1024 bytes.
+    CHUNK_SIZE = 1024
+    has_binary_extension = None
 
-def _is_file_text_test1(file_path):
+
+# The number of bytes at the start of a file used to tell text from binary.
+TEXT_PREFIX_SIZE = 4096
+# The number of verdicts of `is_file_text()` to memoize.
+TEXT_CACHE_SIZE = 65536
+
+
+def _is_text_test_decode(prefix):
     '''
-    Try to read the first few bytes in text mode.
+    Try to decode the prefix with the encoding used for text mode.
     '''
+    decoder = codecs.getincrementaldecoder(
+        locale.getpreferredencoding(False))()
     try:
-        with open(file_path, "r") as f:
-            f.read(1024)
+        # Not final, as the prefix may end in the middle of a character.
+        decoder.decode(prefix)
         return True
     except UnicodeDecodeError:
         return False
 
 
-def _is_file_text_test2(file_path):
+def _is_text_test_binaryornot(prefix):
+    return not is_binary_string(prefix[:CHUNK_SIZE])
+
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _is_file_text_cached(file_path, device, inode, size, mtime_ns):
     '''
-    Try to read first few lines in text mode.
+    The metadata arguments are only part of the memoization key, so that the
+    verdict is recomputed if the file changes.
     '''
-    try:
-        with open(file_path, "r") as f:
-            num_lines = 0
-            for l in f:
-                num_lines += 1
-                if (num_lines == 5):
-                    break
-        return True
-    except UnicodeDecodeError:
+    if has_binary_extension is not None and has_binary_extension(file_path):
         return False
+    with open(file_path, 'rb') as f:
+        prefix = f.read(TEXT_PREFIX_SIZE)
+    return _is_text_test_decode(prefix) and _is_text_test_binaryornot(prefix)
+
 
+def is_file_text(file_path, stat_result=None):
+    '''
+    Guess whether a file is a text file from a single read of its first
+    `TEXT_PREFIX_SIZE` bytes.
+    The verdict is memoized by the inode, size and modification time.
+    `stat_result`: The stat of `file_path`, if already known.
+    '''
+    file_path = str(file_path)
+    if stat_result is None:
+        stat_result = os.stat(file_path)
+    return _is_file_text_cached(file_path, stat_result.st_dev,
+                                stat_result.st_ino, stat_result.st_size,
+                                stat_result.st_mtime_ns)
 
-def _is_file_text_test3(file_path):
-    return not is_binary(str(file_path.resolve()))
+
+def get_sample_offsets(file_size, sample_count, block_size, seed=None):
+    '''
+    Return the sorted offsets of the blocks to compare in a file of size
+    `file_size`: the head, the tail, and `sample_count` blocks in between.
+    The blocks in between are evenly spaced, or placed pseudo-randomly if
+    a `seed` is given (deterministic for a given seed and file size).
+    '''
+    last_offset = max(file_size - block_size, 0)
+    offsets = {0, last_offset}
+    if last_offset > 0:
+        if seed is None:
+            step = last_offset / (sample_count + 1)
+            offsets.update(int(step * (i + 1)) for i in range(sample_count))
+        else:
+            rng = random.Random('{}:{}'.format(seed, file_size))
+            offsets.update(
+                rng.randrange(last_offset) for _ in range(sample_count))
+    return sorted(offsets)
 
 
-def is_file_text(file_path):
-    return _is_file_text_test1(file_path) and\
-           _is_file_text_test2(file_path) and\
-           _is_file_text_test3(file_path)
+def _read_block(fd, block_size, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, block_size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, block_size)
+
+
+def compare_file_samples(path1, path2, offsets, block_size):
+    '''
+    Compare only the blocks of `block_size` bytes starting at `offsets` of
+    2 files of the same size.
+    '''
+    fd1 = os.open(str(path1), os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        fd2 = os.open(str(path2), os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            for offset in offsets:
+                if _read_block(fd1, block_size, offset) !=\
+                        _read_block(fd2, block_size, offset):
+                    return False
+            return True
+        finally:
+            os.close(fd2)
+    finally:
+        os.close(fd1)
 
 
 def compare_file_contents_buffered(path1, path2, buffer_size=100000):
@@ -53,6 +128,146 @@ def compare_file_contents_buffered(path1, path2, buffer_size=100000):
                 return True
 
 
+# The bounds of the buffer size picked by `get_buffer_size()`.
+# Bigger buffers no longer fit in the CPU caches, which makes the
+# comparison itself slower than the reads.
+MIN_BUFFER_SIZE = 65536
+MAX_BUFFER_SIZE = 262144
+# Files at least this big are compared through `mmap` by default.
+MMAP_THRESHOLD = 67108864
+
+_buffers = threading.local()
+
+
+def get_buffer_size(file_size, fs_block_size=4096):
+    '''
+    Pick a read buffer size for a file: about 1/64th of the file,
+    rounded up to a power of 2, clamped to [`MIN_BUFFER_SIZE`,
+    `MAX_BUFFER_SIZE`] and to a multiple of the filesystem block size.
+    '''
+    buffer_size = MIN_BUFFER_SIZE
+    while buffer_size < file_size // 64 and buffer_size < MAX_BUFFER_SIZE:
+        buffer_size *= 2
+    fs_block_size = max(fs_block_size, 1)
+    return -(-buffer_size // fs_block_size) * fs_block_size
+
+
+def _get_buffers(buffer_size):
+    '''
+    Return a pair of buffers of `buffer_size` bytes, reused across calls
+    from the same thread.
+    '''
+    buffers = getattr(_buffers, 'buffers', None)
+    if buffers is None or len(buffers[0]) != buffer_size:
+        buffers = _buffers.buffers = (bytearray(buffer_size),
+                                      bytearray(buffer_size))
+    return buffers
+
+
+def _are_views_equal(view1, view2):
+    '''
+    Compare 2 `memoryview`s of bytes of the same length without copying
+    them; as 8-byte words but for the tail, which is several times faster
+    than byte by byte.
+    '''
+    split = len(view1) - len(view1) % 8
+    return view1[:split].cast('Q') == view2[:split].cast('Q') and\
+        view1[split:] == view2[split:]
+
+
+def compare_file_contents_readinto(path1, path2, buffer_size=MIN_BUFFER_SIZE):
+    '''
+    Compare file contents byte-to-byte, reading straight into a pair of
+    preallocated buffers instead of allocating new `bytes` on every read.
+    '''
+    buffer1, buffer2 = _get_buffers(buffer_size)
+    with open(str(path1), 'rb', buffering=0) as fp1,\
+            open(str(path2), 'rb', buffering=0) as fp2,\
+            memoryview(buffer1) as view1, memoryview(buffer2) as view2:
+        while True:
+            num_bytes1 = fp1.readinto(buffer1)
+            num_bytes2 = fp2.readinto(buffer2)
+            if num_bytes1 != num_bytes2:
+                # Short reads are legal; fall back to the generic version.
+                fp1.seek(fp1.tell() - num_bytes1)
+                fp2.seek(fp2.tell() - num_bytes2)
+                return _compare_file_objects(fp1, fp2, buffer_size)
+            if not num_bytes1:
+                return True
+            if num_bytes1 == buffer_size:
+                if buffer1 != buffer2:
+                    return False
+            elif not _are_views_equal(view1[:num_bytes1],
+                                      view2[:num_bytes2]):
+                # Not necessarily the last chunk, as the reads may be
+                # short anywhere.
+                return False
+
+
+def _compare_file_objects(fp1, fp2, buffer_size):
+    while True:
+        path1_bytes = fp1.read(buffer_size)
+        path2_bytes = fp2.read(buffer_size)
+        if path1_bytes != path2_bytes:
+            return False
+        if not path1_bytes:
+            return True
+
+
+def compare_file_contents_mmap(path1, path2, buffer_size=MIN_BUFFER_SIZE):
+    '''
+    Compare file contents byte-to-byte by memory-mapping both files and
+    comparing them in chunks of `buffer_size` bytes, without any read
+    calls. The kernel is advised of the sequential access, so that it
+    reads ahead aggressively.
+    '''
+    with open(str(path1), 'rb') as fp1, open(str(path2), 'rb') as fp2:
+        file_size = os.fstat(fp1.fileno()).st_size
+        if file_size != os.fstat(fp2.fileno()).st_size:
+            return False
+        if file_size == 0:
+            # Empty files cannot be mapped.
+            return True
+        with mmap.mmap(fp1.fileno(), 0, access=mmap.ACCESS_READ) as map1,\
+                mmap.mmap(fp2.fileno(), 0, access=mmap.ACCESS_READ) as map2:
+            if hasattr(map1, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                map1.madvise(mmap.MADV_SEQUENTIAL)
+                map2.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(map1) as view1, memoryview(map2) as view2:
+                for offset in range(0, file_size, buffer_size):
+                    if not _are_views_equal(
+                            view1[offset:offset + buffer_size],
+                            view2[offset:offset + buffer_size]):
+                        return False
+        return True
+
+
+def compare_file_contents(path1, path2, stat_result=None, use_mmap=None):
+    '''
+    Compare file contents byte-to-byte with a buffer size adapted to the
+    file, falling back to `compare_file_contents_buffered()` if the chosen
+    backend is not supported for it.
+    `stat_result`: The stat of `path1`, if already known.
+    `use_mmap`: Whether to memory-map the files instead of reading them.
+                By default, only the files of at least `MMAP_THRESHOLD`
+                bytes are memory-mapped.
+    '''
+    if stat_result is None:
+        stat_result = os.stat(str(path1))
+    file_size = stat_result.st_size
+    buffer_size = get_buffer_size(file_size,
+                                  getattr(stat_result, 'st_blksize', 4096))
+    if use_mmap is None:
+        use_mmap = file_size >= MMAP_THRESHOLD
+    try:
+        if use_mmap:
+            return compare_file_contents_mmap(path1, path2, buffer_size)
+        return compare_file_contents_readinto(path1, path2, buffer_size)
+    except (OSError, ValueError):
+        # E.g. the filesystem does not support memory-mapping.
+        return compare_file_contents_buffered(path1, path2, buffer_size)
+
+
 def is_src_file_bigger(path_src, path_dst):
     src_size = path_src.stat().st_size
     dst_size = path_dst.stat().st_size
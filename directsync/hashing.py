@@ -0,0 +1,58 @@
+import hashlib
+import threading
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# The size of the reads while hashing a file.
+HASH_BUFFER_SIZE = 1048576
+
+# The factories of the supported hash algorithms, fastest first.
+_ALGORITHMS = {}
+if xxhash is not None and hasattr(xxhash, 'xxh3_128'):
+    _ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+if blake3 is not None:
+    _ALGORITHMS['blake3'] = blake3.blake3
+_ALGORITHMS['blake2b'] = hashlib.blake2b
+
+_buffers = threading.local()
+
+
+def get_hash_algorithms():
+    '''
+    Return the names of the hash algorithms available, fastest first.
+    `xxh3_128` and `blake3` need the optional `xxhash` and `blake3`
+    packages respectively; `blake2b` is always available.
+    '''
+    return list(_ALGORITHMS)
+
+
+def get_default_hash_algorithm():
+    return get_hash_algorithms()[0]
+
+
+def hash_file(file_path, algorithm=None):
+    '''
+    Return the digest of the file contents.
+    The file is read straight into a buffer reused across calls (one per
+    thread), so hashing does not allocate per read.
+    '''
+    if algorithm is None:
+        algorithm = get_default_hash_algorithm()
+    hasher = _ALGORITHMS[algorithm]()
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = _buffers.buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(str(file_path), 'rb', buffering=0) as fp:
+        while True:
+            num_bytes = fp.readinto(buffer)
+            if not num_bytes:
+                return hasher.digest()
+            hasher.update(view[:num_bytes])
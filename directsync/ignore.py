@@ -0,0 +1,157 @@
+import re
+
+# The name of the files holding the ignore rules of a directory and its
+# subdirectories.
+IGNORE_FILE_NAME = '.directsyncignore'
+
+
+def _translate_glob(pattern):
+    '''
+    Translate a gitignore-style glob into a regex.
+    `*` and `?` do not match `/`, `**` matches across directories.
+    '''
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            # Any number of leading directories, including none.
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i) and i + 2 == len(pattern):
+            regex += '.*'
+            i += 2
+            continue
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                char_class = pattern[i + 1:end].replace('\\', '\\\\')
+                if char_class[0] == '!':
+                    char_class = '^' + char_class[1:]
+                regex += '(?!/)[' + char_class + ']'
+                i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+
+def parse_rule(line):
+    '''
+    Parse a line of gitignore-style rules.
+    Returns a tuple `(regex, is_negated, is_dir_only)`, where `regex` matches
+    the paths relative to the directory of the rule; or `None` for blank
+    lines and comments.
+    '''
+    line = line.rstrip('\n\r')
+    if not line.endswith('\\ '):
+        line = line.rstrip(' ')
+    if not line or line.startswith('#'):
+        return None
+    is_negated = line.startswith('!')
+    if is_negated:
+        line = line[1:]
+    elif line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+    is_dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    # A pattern with a slash other than a trailing one is relative to the
+    # directory of the rule; otherwise it matches a name at any depth.
+    is_anchored = '/' in line
+    line = line.lstrip('/')
+    regex = _translate_glob(line)
+    if not is_anchored:
+        regex = '(?:.*/)?' + regex
+    return regex, is_negated, is_dir_only
+
+
+class IgnoreRules:
+    '''
+    An ordered list of gitignore-style rules, compiled into a single regex
+    (one for files and one for directories, as rules ending with `/` only
+    apply to directories).
+    The rules are tried last to first in the combined regex, so that the
+    first alternative to match is the last matching rule, which decides;
+    like in gitignore.
+    '''
+
+    def __init__(self, lines):
+        self.rules = [x for x in map(parse_rule, lines) if x is not None]
+        self.file_regex = self._compile(
+            [x for x in enumerate(self.rules) if not x[1][2]])
+        self.dir_regex = self._compile(list(enumerate(self.rules)))
+
+    @staticmethod
+    def _compile(numbered_rules):
+        if not numbered_rules:
+            return None
+        return re.compile('|'.join(
+            '(?P<r{}>{})\\Z'.format(number, rule[0])
+            for number, rule in reversed(numbered_rules)), re.DOTALL)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, rel_path, is_dir):
+        '''
+        Return whether the rules exclude `rel_path`, or `None` if no rule
+        matches it.
+        '''
+        regex = self.dir_regex if is_dir else self.file_regex
+        if regex is None:
+            return None
+        match = regex.match(rel_path)
+        if match is None:
+            return None
+        return not self.rules[int(match.lastgroup[1:])][1]
+
+
+def read_ignore_file(file_path):
+    with open(str(file_path), encoding='utf-8', errors='surrogateescape')\
+            as f:
+        return IgnoreRules(f)
+
+
+class PathMatcher:
+    '''
+    Decide which paths are excluded, from the `IgnoreRules` of a directory
+    (relative to `base`, the posix path of the directory relative to the
+    root) and those of its ancestors, through `parent`.
+    The rules of a directory take precedence over those of its ancestors.
+    '''
+
+    def __init__(self, rules, base='', parent=None):
+        self.rules = rules
+        self.base = base
+        self.parent = parent
+        # Whether no path can be excluded at all.
+        self.is_empty = not rules and (parent is None or parent.is_empty)
+
+    def is_excluded(self, rel_path, is_dir):
+        '''
+        `rel_path`: The posix path relative to the root.
+        '''
+        matcher = self
+        while matcher is not None:
+            if matcher.rules:
+                if matcher.base:
+                    result = matcher.rules.match(
+                        rel_path[len(matcher.base) + 1:], is_dir)
+                else:
+                    result = matcher.rules.match(rel_path, is_dir)
+                if result is not None:
+                    return result
+            matcher = matcher.parent
+        return False
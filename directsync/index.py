@@ -0,0 +1,140 @@
+import json
+import sqlite3
+import threading
+
+from .serialization import get_index_filepath
+
+
+class TreeIndex:
+    '''
+    A persistent metadata index of a single directory tree, stored in an
+    SQLite database in the cache directory.
+    Entries are keyed by their path relative to the root of the tree, and
+    are only trusted as long as the metadata recorded with them still
+    matches the one on disk.
+    '''
+    # Bump on any change to `_SCHEMA`; older indexes are then discarded.
+    _SCHEMA_VERSION = 3
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            inode INTEGER,
+            hash_algorithm TEXT,
+            hash BLOB
+        );
+        CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            child_count INTEGER,
+            clean_peer TEXT
+        );
+        CREATE TABLE IF NOT EXISTS digests (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            config TEXT,
+            files_digest BLOB,
+            subdirs TEXT,
+            digest BLOB
+        );
+    '''
+
+    def __init__(self, root_path, index_path=None):
+        if index_path is None:
+            index_path = get_index_filepath(root_path)
+        # The connection is shared by the worker threads of a parallel
+        # comparison, hence the lock.
+        self.connection = sqlite3.connect(str(index_path),
+                                          check_same_thread=False)
+        version = self.connection.execute('PRAGMA user_version').fetchone()
+        if version[0] != self._SCHEMA_VERSION:
+            self.connection.executescript(
+                'DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS dirs;'
+                'DROP TABLE IF EXISTS digests;')
+            self.connection.execute(
+                'PRAGMA user_version = {}'.format(self._SCHEMA_VERSION))
+        self.connection.executescript(self._SCHEMA)
+        self.lock = threading.Lock()
+
+    def get_file_hash(self, rel_path, stat_result, hash_algorithm):
+        '''
+        Return the recorded content hash of the file, or `None` if the file
+        is unknown, its metadata has changed since the hash was recorded or
+        the hash was computed with a different algorithm.
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT size, mtime_ns, inode, hash_algorithm, hash FROM files\
+                 WHERE path = ?', (rel_path, )).fetchone()
+        if row is None or row[:4] != _file_metadata(stat_result) + (
+                hash_algorithm, ):
+            return None
+        return row[4]
+
+    def set_file_hash(self, rel_path, stat_result, hash_algorithm, file_hash):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                (rel_path, ) + _file_metadata(stat_result) +
+                (hash_algorithm, file_hash))
+
+    def is_dir_clean(self, rel_path, stat_result, child_count, peer):
+        '''
+        Whether the directory was found identical to the same directory in
+        the `peer` tree during the last run, and has neither been modified
+        nor gained or lost any entries since.
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT mtime_ns, child_count, clean_peer FROM dirs\
+                 WHERE path = ?', (rel_path, )).fetchone()
+        return row == (stat_result.st_mtime_ns, child_count, peer)
+
+    def set_dir(self, rel_path, stat_result, child_count, clean_peer=None):
+        '''
+        Record the metadata of a directory.
+        `clean_peer`: The root of the tree against which the directory was
+                      found identical, if any.
+        '''
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)',
+                (rel_path, stat_result.st_mtime_ns, child_count, clean_peer))
+
+    def forget_dir(self, rel_path):
+        with self.lock:
+            self.connection.execute('DELETE FROM dirs WHERE path = ?',
+                                    (rel_path, ))
+
+    def get_dir_digest(self, rel_path, stat_result, config):
+        '''
+        Return the `(digest of the files, names of the subdirectories)` of
+        the directory recorded by `set_dir_digest()`, or `None` if the
+        directory is unknown, has been modified since, or was recorded with
+        another `config`; see `TreeDigests`.
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT mtime_ns, config, files_digest, subdirs FROM digests\
+                 WHERE path = ?', (rel_path, )).fetchone()
+        if row is None or row[:2] != (stat_result.st_mtime_ns, config):
+            return None
+        return row[2], json.loads(row[3])
+
+    def set_dir_digest(self, rel_path, stat_result, config, files_digest,
+                       subdir_names, digest):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)',
+                (rel_path, stat_result.st_mtime_ns, config, files_digest,
+                 json.dumps(subdir_names), digest))
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def _file_metadata(stat_result):
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
@@ -0,0 +1,162 @@
+from pathlib import Path
+import functools
+import json
+import os
+import threading
+import time
+
+# The format version of the journal files.
+VERSION = 1
+# The functions of `DirectSync` which can be journaled.
+FUNCTIONS = ('_move_item', '_remove_item', '_sync_items')
+
+
+class JournalError(Exception):
+    pass
+
+
+class SyncJournal:
+    '''
+    A write-ahead log of the operations of a sync, so that an interrupted
+    sync can be resumed (see `read_unfinished_operations()`).
+    It is a file of JSON lines: a header with the roots of the 2 trees, the
+    planned operations (all written and synced to disk before any is run),
+    and then the ids of the operations done, appended in batches at most
+    every `checkpoint_size` operations or `checkpoint_interval` seconds.
+    An operation done after the last checkpoint is run again on resume,
+    which is harmless as they are idempotent.
+    '''
+
+    def __init__(self, file_path, src_root, dst_root, checkpoint_size=1000,
+                 checkpoint_interval=5.0):
+        self.file_path = Path(file_path)
+        self.roots = {'src': Path(src_root), 'dst': Path(dst_root)}
+        self.checkpoint_size = checkpoint_size
+        self.checkpoint_interval = checkpoint_interval
+        self.lock = threading.Lock()
+        self.file = open(str(self.file_path), 'w', encoding='utf-8',
+                         errors='surrogateescape')
+        self.num_operations = 0
+        # The ids of the operations done since the last checkpoint.
+        self.done_ids = []
+        self.last_checkpoint_time = time.monotonic()
+        self._write({'version': VERSION, 'src': str(src_root),
+                     'dst': str(dst_root)})
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _encode_arg(self, arg):
+        '''
+        Paths are stored relative to the root of their tree.
+        '''
+        if isinstance(arg, Path):
+            for tree, root in self.roots.items():
+                try:
+                    return [tree, arg.relative_to(root).as_posix()]
+                except ValueError:
+                    pass
+            raise JournalError('"{}" is in neither tree'.format(arg))
+        return arg
+
+    def plan(self, phases):
+        '''
+        Record `phases`, lists of `(item, function, args)` operations to run
+        one list after the other, as planned.
+        Returns them with every function wrapped so that its operation is
+        marked as done once it returns.
+        '''
+        journaled_phases = []
+        for phase, operations in enumerate(phases):
+            journaled_operations = []
+            for item, function, args in operations:
+                if function.__name__ not in FUNCTIONS:
+                    raise JournalError('Cannot journal "{}"'.format(
+                        function.__name__))
+                operation_id = self.num_operations
+                self.num_operations += 1
+                self._write({'id': operation_id, 'phase': phase,
+                             'function': function.__name__,
+                             'args': [self._encode_arg(x) for x in args]})
+                journaled_operations.append(
+                    (item, self._wrap(operation_id, function), args))
+            journaled_phases.append(journaled_operations)
+        self._sync()
+        return journaled_phases
+
+    def _wrap(self, operation_id, function):
+        @functools.wraps(function)
+        def journaled_function(*args):
+            function(*args)
+            self.mark_done(operation_id)
+        return journaled_function
+
+    def mark_done(self, operation_id):
+        with self.lock:
+            self.done_ids.append(operation_id)
+            if len(self.done_ids) >= self.checkpoint_size or\
+                    time.monotonic() - self.last_checkpoint_time >=\
+                    self.checkpoint_interval:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        if self.done_ids:
+            self._write({'done': self.done_ids})
+            self.done_ids = []
+        self._sync()
+        self.last_checkpoint_time = time.monotonic()
+
+    def close(self, remove=False):
+        '''
+        Write the last checkpoint, and remove the journal if `remove`, e.g.
+        once all the operations succeeded.
+        '''
+        with self.lock:
+            self._checkpoint()
+            self.file.close()
+        if remove:
+            self.file_path.unlink()
+
+
+def read_unfinished_operations(file_path, src_root, dst_root):
+    '''
+    Read a journal written by `SyncJournal` for the trees `src_root` and
+    `dst_root`.
+    Returns the operations not marked as done, in their planned order, as
+    `(phase, function name, args)` tuples.
+    A line cut short by the interruption is ignored.
+    '''
+    operations = []
+    done_ids = set()
+    with open(str(file_path), encoding='utf-8',
+              errors='surrogateescape') as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = {}
+        if header.get('version') != VERSION:
+            raise JournalError('Unsupported journal "{}"'.format(file_path))
+        # The paths are rebuilt from the given roots, so that the journal
+        # can be resumed from another working directory.
+        roots = {'src': Path(src_root), 'dst': Path(dst_root)}
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if 'done' in record:
+                done_ids.update(record['done'])
+                continue
+            if record['function'] not in FUNCTIONS:
+                raise JournalError('Unknown operation in "{}"'.format(
+                    file_path))
+            args = [roots[x[0]] / x[1] if isinstance(x, list) else x
+                    for x in record['args']]
+            operations.append((record['id'], record['phase'],
+                               record['function'], args))
+    unfinished = [x[1:] for x in operations if x[0] not in done_ids]
+    return unfinished
@@ -0,0 +1,263 @@
+import binascii
+import gzip
+import heapq
+import logging
+import os
+import re
+
+from .events import CONTENT, EXTRA_SRC, EXTRA_DST
+from .traversal import scan_dir, sort_key
+
+logger = logging.getLogger(__file__)
+
+# The first field of the header line of the manifests.
+MAGIC = '#directsync-manifest'
+# The format version of the manifests.
+VERSION = 2
+# The first field of the last line of the manifests, if any: the number of
+# items left out.
+EXCLUDED = '#excluded'
+
+# The kinds of records.
+FILE = 'f'
+DIR = 'd'
+LINK = 'l'
+
+_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+_UNESCAPES = {v: k for k, v in _ESCAPES.items()}
+_ESCAPE_REGEX = re.compile('[\\\\\t\n\r]')
+_UNESCAPE_REGEX = re.compile('\\\\[\\\\tnr]')
+
+
+class ManifestRecord:
+    '''
+    An item of a tree, as listed in a manifest.
+    `rel_path`: The posix path relative to the root of the tree.
+    `content_hash`: The hash of the contents of a file, if known.
+    `target`: The target of a symlink which is not followed.
+    `entry`: The `ScanEntry` of the item, for a tree read from disk.
+    '''
+    __slots__ = ('kind', 'rel_path', 'size', 'mtime_ns', 'content_hash',
+                 'target', 'entry')
+
+    def __init__(self, kind, rel_path, size=None, mtime_ns=None,
+                 content_hash=None, target=None, entry=None):
+        self.kind = kind
+        self.rel_path = rel_path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.content_hash = content_hash
+        self.target = target
+        self.entry = entry
+
+    def get_key(self):
+        '''
+        The key by which records are ordered; the order in which
+        `DirectSync` compares 2 trees: the directories depth first, each
+        listed with its files and then its subdirectories, ordered like in
+        `scan_dir()`, before the contents of its subdirectories.
+        '''
+        path_key = self.get_path_key()
+        return path_key[:-1], self.kind == DIR, path_key[-1]
+
+    def get_path_key(self):
+        '''
+        The key of the path alone; it prefixes the first part of the keys of
+        the records inside a directory.
+        '''
+        return tuple(sort_key(x) for x in self.rel_path.split('/'))
+
+
+def _escape(text):
+    return _ESCAPE_REGEX.sub(lambda x: _ESCAPES[x.group()], text)
+
+
+def _unescape(text):
+    return _UNESCAPE_REGEX.sub(lambda x: _UNESCAPES[x.group()], text)
+
+
+def iter_tree_records(root_path, filter_scan=None, follow_symlinks=True,
+                      get_file_hash=None, rel_dir=''):
+    '''
+    Yield the `ManifestRecord`s of the items of a tree in manifest order,
+    reading each directory once.
+    `filter_scan(rel_dir, scan)`: Return the result of `scan_dir()` of a
+                                  directory without its excluded entries.
+    `get_file_hash(entry)`: Return the content hash of the file of a
+                            `ScanEntry`; only if the hashes are to be
+                            listed.
+    '''
+    dir_path = root_path / rel_dir
+    try:
+        scan = scan_dir(dir_path, follow_symlinks)
+        if filter_scan is not None:
+            scan = filter_scan(rel_dir, scan)
+    except OSError as err:
+        logger.warning('Cannot list "%s": %s', dir_path, err)
+        return
+    files, subdirs = scan
+    prefix = rel_dir + '/' if rel_dir else ''
+    for entry in files:
+        rel_path = prefix + entry.name
+        if entry.is_link:
+            yield ManifestRecord(LINK, rel_path,
+                                 target=os.readlink(str(entry.path)),
+                                 entry=entry)
+        else:
+            try:
+                stat_result = entry.stat()
+                content_hash = None
+                if get_file_hash is not None:
+                    content_hash = get_file_hash(entry)
+            except OSError as err:
+                logger.warning('Cannot read "%s": %s', entry.path, err)
+                continue
+            yield ManifestRecord(FILE, rel_path, stat_result.st_size,
+                                 stat_result.st_mtime_ns, content_hash,
+                                 entry=entry)
+    for entry in subdirs:
+        yield ManifestRecord(DIR, prefix + entry.name, entry=entry)
+    for entry in subdirs:
+        # Recursive call
+        for record in iter_tree_records(root_path, filter_scan,
+                                        follow_symlinks, get_file_hash,
+                                        prefix + entry.name):
+            yield record
+
+
+def write_manifest(file_path, records, hash_algorithm=None,
+                   get_excluded_count=None):
+    '''
+    Write `records`, in manifest order, to a gzip-compressed manifest file:
+    a header line, then a line of tab-separated fields per record: its
+    kind, size, modification time, content hash (or symlink target) and
+    relative path; with `-` for the fields not applying.
+    `hash_algorithm`: The algorithm of the content hashes, if listed.
+    `get_excluded_count()`: Return the number of items left out of
+                            `records`, once they are all read; written in
+                            a last `#excluded` line.
+    Returns the number of records written.
+    '''
+    count = 0
+    with gzip.open(str(file_path), 'wt', compresslevel=6, encoding='utf-8',
+                   errors='surrogateescape', newline='\n') as f:
+        f.write('{}\t{}\t{}\n'.format(MAGIC, VERSION, hash_algorithm or '-'))
+        for record in records:
+            if record.kind == FILE:
+                fields = (FILE, str(record.size), str(record.mtime_ns),
+                          binascii.hexlify(record.content_hash).decode()
+                          if record.content_hash is not None else '-')
+            elif record.kind == LINK:
+                fields = (LINK, '-', '-', _escape(record.target))
+            else:
+                fields = (DIR, '-', '-', '-')
+            f.write('\t'.join(fields + (_escape(record.rel_path), )) + '\n')
+            count += 1
+        if get_excluded_count is not None:
+            f.write('{}\t{}\n'.format(EXCLUDED, get_excluded_count()))
+    return count
+
+
+class Manifest:
+    '''
+    A manifest file written by `write_manifest()`, read as a stream of
+    `ManifestRecord`s; uncompressed manifests are read too.
+    '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(str(file_path), 'rb') as f:
+            is_compressed = f.read(2) == b'\x1f\x8b'
+        opener = gzip.open if is_compressed else open
+        self.file = opener(str(file_path), 'rt', encoding='utf-8',
+                           errors='surrogateescape', newline='\n')
+        header = self.file.readline().rstrip('\n').split('\t')
+        if len(header) != 3 or header[:2] != [MAGIC, str(VERSION)]:
+            self.file.close()
+            raise Exception('"{}" is not a valid manifest!'.format(file_path))
+        # The algorithm of the content hashes, if listed.
+        self.hash_algorithm = header[2] if header[2] != '-' else None
+        # The number of items left out of the manifest; only known once
+        # all the records are read.
+        self.excluded_count = 0
+
+    def __iter__(self):
+        for line in self.file:
+            if line.startswith(EXCLUDED + '\t'):
+                self.excluded_count = int(line.split('\t')[1])
+                continue
+            kind, size, mtime_ns, extra, rel_path = line.rstrip('\n').split(
+                '\t')
+            rel_path = _unescape(rel_path)
+            if kind == FILE:
+                yield ManifestRecord(
+                    FILE, rel_path, int(size), int(mtime_ns),
+                    binascii.unhexlify(extra) if extra != '-' else None)
+            elif kind == LINK:
+                yield ManifestRecord(LINK, rel_path, target=_unescape(extra))
+            else:
+                yield ManifestRecord(DIR, rel_path)
+
+    def close(self):
+        self.file.close()
+
+
+def _next_record(records, skipped_keys):
+    '''
+    Return the next of `records` which is not inside one of the directories
+    of `skipped_keys`, a heap of their path keys.
+    The contents of a directory come in a row, after those of the
+    directories listed before it; so that a directory is dropped from the
+    heap once they are past.
+    '''
+    for record in records:
+        dir_key = record.get_key()[0]
+        while skipped_keys and skipped_keys[0] < dir_key and\
+                dir_key[:len(skipped_keys[0])] != skipped_keys[0]:
+            heapq.heappop(skipped_keys)
+        if not skipped_keys or\
+                dir_key[:len(skipped_keys[0])] != skipped_keys[0]:
+            return record
+    return None
+
+
+def diff_records(records_src, records_dst, are_files_equal):
+    '''
+    Compare 2 streams of `ManifestRecord`s in manifest order, with a linear
+    merge; so that 2 manifests are compared without touching the trees.
+    Like the comparison of directories, the contents of an item extra on
+    one side are not reported on their own, and the differences come in the
+    same order.
+    `are_files_equal(src_record, dst_record)`: Whether 2 files (or
+                                               symlinks) of the same path
+                                               are identical.
+    Yields a `(kind of DiffEvent, src record, dst record)` tuple per
+    difference, with `None` for the record of the side where the item is
+    absent.
+    '''
+    records_src = iter(records_src)
+    records_dst = iter(records_dst)
+    # The path keys of the directories extra on each side.
+    skipped_src = []
+    skipped_dst = []
+    src = _next_record(records_src, skipped_src)
+    dst = _next_record(records_dst, skipped_dst)
+    while src is not None or dst is not None:
+        src_key = src.get_key() if src is not None else None
+        dst_key = dst.get_key() if dst is not None else None
+        if dst is None or (src is not None and src_key < dst_key):
+            yield EXTRA_SRC, src, None
+            if src.kind == DIR:
+                heapq.heappush(skipped_src, src.get_path_key())
+            src = _next_record(records_src, skipped_src)
+        elif src is None or src_key > dst_key:
+            yield EXTRA_DST, None, dst
+            if dst.kind == DIR:
+                heapq.heappush(skipped_dst, dst.get_path_key())
+            dst = _next_record(records_dst, skipped_dst)
+        else:
+            # The same key means the same kind, but for symlinks.
+            if src.kind != DIR and not are_files_equal(src, dst):
+                yield CONTENT, src, dst
+            src = _next_record(records_src, skipped_src)
+            dst = _next_record(records_dst, skipped_dst)
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import stat
+
+from .hashing import hash_file
+
+
+class MoveDetector:
+    '''
+    Find the items extra in dst which are identical to items extra in src,
+    under another path; i.e. moved or renamed in src since the last sync.
+    They can then be renamed within dst, instead of being copied again and
+    removed.
+    The items are first grouped by shape: the size of a file, or the
+    relative paths and sizes of all the files of a directory. Only the
+    items whose shape is found on both sides are then fingerprinted by
+    content: the hash of a file, or a Merkle hash of the hashes of the files
+    of a directory.
+    '''
+
+    def __init__(self, hash_algorithm, get_ignored_names=None, stats=None):
+        '''
+        `get_ignored_names`: The `ignore` function of `shutil.copytree()`
+                             leaving out the items of src which are not
+                             copied.
+        '''
+        self.hash_algorithm = hash_algorithm
+        self.get_ignored_names = get_ignored_names
+        self.stats = stats
+
+    def _get_shape(self, item, get_ignored_names):
+        '''
+        Returns a tuple `(shape, files)`, where `files` is the list of the
+        `(posix path relative to item, size)` of the files of `item`; or
+        `None` if `item` is not worth moving: a symlink, an empty file or a
+        directory without any data (cheap to copy), or containing symlinks.
+        '''
+        if item.is_symlink():
+            return None
+        if not item.is_dir():
+            size = item.stat().st_size
+            if not size:
+                return None
+            return ('file', size), [('', size)]
+        files = []
+        # The subdirectories are part of the shape, as they are copied too.
+        subdirs = []
+        total_size = 0
+        for dir_path, dir_names, file_names in os.walk(str(item)):
+            rel_dir = os.path.relpath(dir_path, str(item))
+            rel_dir = '' if rel_dir == '.' else rel_dir.replace(os.sep,
+                                                                '/') + '/'
+            if get_ignored_names is not None:
+                ignored_names = get_ignored_names(dir_path,
+                                                  dir_names + file_names)
+                dir_names[:] = [x for x in dir_names
+                                if x not in ignored_names]
+                file_names = [x for x in file_names
+                              if x not in ignored_names]
+            dir_names.sort()
+            for name in dir_names:
+                if os.path.islink(os.path.join(dir_path, name)):
+                    return None
+                subdirs.append(rel_dir + name)
+            for name in sorted(file_names):
+                stat_result = os.lstat(os.path.join(dir_path, name))
+                if stat.S_ISLNK(stat_result.st_mode):
+                    return None
+                files.append((rel_dir + name, stat_result.st_size))
+                total_size += stat_result.st_size
+        if not total_size:
+            return None
+        shape_hash = hashlib.sha1()
+        for rel_path in subdirs:
+            shape_hash.update(os.fsencode(rel_path) + b'/\0')
+        for rel_path, size in files:
+            shape_hash.update(os.fsencode(rel_path) + b'\0' +
+                              str(size).encode() + b'\0')
+        return ('dir', shape_hash.digest()), files
+
+    def _get_fingerprint(self, item, files):
+        '''
+        The content hash of a file, or the Merkle hash of the `files` of a
+        directory.
+        '''
+        if self.stats is not None:
+            self.stats.count('move_candidates_hashed')
+        if len(files) == 1 and not files[0][0]:
+            return hash_file(item, self.hash_algorithm)
+        dir_hash = hashlib.sha1()
+        for rel_path, _ in files:
+            dir_hash.update(os.fsencode(rel_path) + b'\0' +
+                            hash_file(os.path.join(str(item), rel_path),
+                                      self.hash_algorithm))
+        return dir_hash.digest()
+
+    def find_moves(self, items_src, items_dst):
+        '''
+        Returns the `(item of items_dst, item of items_src)` pairs of
+        identical items; each item is in one pair at most.
+        '''
+        # shape -> the [(item, files)] of dst having it
+        shapes_dst = {}
+        for item_dst in items_dst:
+            shape = self._get_shape(item_dst, None)
+            if shape is not None:
+                shapes_dst.setdefault(shape[0], []).append(
+                    (item_dst, shape[1]))
+        # (shape, fingerprint) -> the items of dst having them; only built
+        # for the shapes found in src.
+        fingerprints_dst = {}
+        fingerprinted_shapes = set()
+        moves = []
+        for item_src in items_src:
+            shape = self._get_shape(item_src, self.get_ignored_names)
+            if shape is None or shape[0] not in shapes_dst:
+                continue
+            shape_key, files = shape
+            if shape_key not in fingerprinted_shapes:
+                fingerprinted_shapes.add(shape_key)
+                for item_dst, files_dst in shapes_dst[shape_key]:
+                    fingerprint_key = (shape_key, self._get_fingerprint(
+                        item_dst, files_dst))
+                    fingerprints_dst.setdefault(fingerprint_key, []).append(
+                        item_dst)
+            same_items_dst = fingerprints_dst.get(
+                (shape_key, self._get_fingerprint(item_src, files)))
+            if same_items_dst:
+                moves.append((same_items_dst.pop(0), item_src))
+        return moves
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from tqdm import tqdm
+
+
+class ScanProgress:
+    '''
+    The progress bar of the difference check.
+    The total number of items is not counted up front, as that would take a
+    walk of both trees of its own. It is taken from the previous run on the
+    same directories if any, and is otherwise extrapolated from the average
+    number of items of the directories compared so far, times the number of
+    directories discovered but not yet compared.
+    '''
+
+    def __init__(self, previous_total=None):
+        self.lock = threading.Lock()
+        self.previous_total = previous_total or 0
+        # The number of directory pairs compared so far, and of those
+        # discovered but not compared yet.
+        self.dirs_done = 0
+        self.dirs_pending = 1
+        self.bytes_compared = 0
+        self.start_time = time.perf_counter()
+        self.bar = tqdm(total=self.previous_total or None,
+                        desc='Checking differences', unit=' items')
+
+    def update(self, item_count, byte_count, subdir_count):
+        '''
+        Record the comparison of a directory pair with `item_count` entries
+        on both sides, whose common files add up to `byte_count` bytes, and
+        `subdir_count` common subdirectories still to compare.
+        '''
+        with self.lock:
+            self.dirs_done += 1
+            self.dirs_pending += subdir_count - 1
+            self.bytes_compared += byte_count
+            visited = self.bar.n + item_count
+            estimate = visited + \
+                self.dirs_pending * visited // self.dirs_done
+            if estimate > (self.bar.total or 0):
+                self.bar.total = max(estimate, self.previous_total)
+            # tqdm shows the rate of items; add the rate of bytes.
+            elapsed = time.perf_counter() - self.start_time
+            if elapsed > 0:
+                self.bar.set_postfix_str(tqdm.format_sizeof(
+                    self.bytes_compared / elapsed, 'B/s', 1024),
+                    refresh=False)
+            self.bar.update(item_count)
+
+    def close(self, finished):
+        '''
+        Close the progress bar; completing it if the whole trees were
+        compared, as the total is only an estimate.
+        Returns the number of items compared.
+        '''
+        with self.lock:
+            if finished:
+                self.bar.total = self.bar.n
+                self.bar.refresh()
+            self.bar.close()
+            return self.bar.n
+
+
+def read_item_count(file_path):
+    '''
+    Read the number of items stored by `write_item_count()`, or `None` if
+    there is none.
+    '''
+    try:
+        with open(str(file_path)) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_item_count(file_path, item_count):
+    with open(str(file_path), 'w') as f:
+        f.write(str(item_count))
@@ -0,0 +1,226 @@
+from array import array
+from pathlib import Path
+import mmap
+import os
+import struct
+import sys
+
+from .copying import get_temp_path
+from .events import CONTENT, EXTRA_SRC, EXTRA_DST
+
+# The layout of a result store file (all integers in native byte order):
+# - Header: `MAGIC`, the format version, the byte order, the src and dst
+#   root paths, the record counts per kind, and the numbers of items
+#   excluded by the ignore rules in src and dst.
+# - Prefix table: the distinct parent directories of the records, relative
+#   to the roots.
+# - Columns of the records, grouped by kind: a kind code, the index of the
+#   parent directory in the prefix table, and the offset of the name in the
+#   names blob; followed by the names blob itself.
+# The columns are aligned so that they can be used straight from a memory
+# map.
+MAGIC = b'DSRS'
+VERSION = 2
+# The records are stored grouped by kind, in this order.
+KINDS = (CONTENT, EXTRA_SRC, EXTRA_DST)
+_HEADER = struct.Struct('=4sHB')
+_COUNT = struct.Struct('=Q')
+_ALIGNMENT = 8
+
+
+class ResultStoreError(Exception):
+    pass
+
+
+def _pack_bytes(data):
+    return _COUNT.pack(len(data)) + data
+
+
+def _pad(buffer):
+    buffer.extend(b'\0' * (-len(buffer) % _ALIGNMENT))
+
+
+def write_result_store(file_path, dirs_data):
+    '''
+    Write the differences stored in `dirs_data` to a result store file.
+    Only the paths relative to the roots are stored, with their parent
+    directories interned in a shared prefix table.
+    The file is written aside and then renamed over `file_path`, so that an
+    interrupted run never leaves it half-written.
+    '''
+    src_root = str(dirs_data.data_src.path)
+    dst_root = str(dirs_data.data_dst.path)
+    items = (
+        (src_root, (x[0] for x in dirs_data.content_diff)),
+        (src_root, dirs_data.data_src.diff),
+        (dst_root, dirs_data.data_dst.diff),
+    )
+    prefix_ids = {}
+    prefix_column = array('Q')
+    kind_column = array('B')
+    name_offsets = array('Q', [0])
+    names = bytearray()
+    counts = []
+    for kind_code, (root, paths) in enumerate(items):
+        count = 0
+        for path in paths:
+            rel_path = os.path.relpath(str(path), root)
+            prefix, _, name = rel_path.rpartition(os.sep)
+            prefix_id = prefix_ids.setdefault(prefix, len(prefix_ids))
+            prefix_column.append(prefix_id)
+            kind_column.append(kind_code)
+            names.extend(os.fsencode(name))
+            name_offsets.append(len(names))
+            count += 1
+        counts.append(count)
+
+    buffer = bytearray(_HEADER.pack(MAGIC, VERSION,
+                                    sys.byteorder == 'little'))
+    buffer.extend(_pack_bytes(os.fsencode(src_root)))
+    buffer.extend(_pack_bytes(os.fsencode(dst_root)))
+    for count in counts:
+        buffer.extend(_COUNT.pack(count))
+    buffer.extend(_COUNT.pack(dirs_data.data_src.excluded_count))
+    buffer.extend(_COUNT.pack(dirs_data.data_dst.excluded_count))
+    buffer.extend(_COUNT.pack(len(prefix_ids)))
+    for prefix in prefix_ids:
+        buffer.extend(_pack_bytes(os.fsencode(prefix)))
+    buffer.extend(_COUNT.pack(len(names)))
+    for column in (kind_column, prefix_column, name_offsets):
+        _pad(buffer)
+        buffer.extend(column.tobytes())
+    buffer.extend(names)
+    path_tmp = get_temp_path(file_path)
+    try:
+        with open(path_tmp, 'wb') as f:
+            f.write(buffer)
+        os.replace(path_tmp, str(file_path))
+    except BaseException:
+        if os.path.exists(path_tmp):
+            os.unlink(path_tmp)
+        raise
+
+
+class ResultStore:
+    '''
+    A read-only view of a result store file.
+    The file is memory-mapped (read in one go on Windows, where mapped files
+    cannot be deleted), and records are only turned into `Path`s when they
+    are accessed; so loading it costs time proportional to the number of
+    distinct parent directories rather than the number of records.
+    Raises `ResultStoreError` if the file is of another format or version,
+    or is not a complete result store.
+    '''
+
+    def __init__(self, file_path):
+        with open(str(file_path), 'rb') as f:
+            if os.name == 'nt' or not os.fstat(f.fileno()).st_size:
+                # An empty file cannot be memory-mapped.
+                self.data = f.read()
+            else:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read(memoryview(self.data), file_path)
+        except (struct.error, ValueError, TypeError) as err:
+            raise ResultStoreError('Corrupt result store "{}": {}'.format(
+                file_path, err))
+
+    def _read(self, view, file_path):
+        magic, version, is_little_endian = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION or\
+                bool(is_little_endian) != (sys.byteorder == 'little'):
+            raise ResultStoreError(
+                'Unsupported result store "{}"'.format(file_path))
+        offset = _HEADER.size
+        src_root, offset = self._read_bytes(view, offset)
+        dst_root, offset = self._read_bytes(view, offset)
+        self.src_root = Path(os.fsdecode(src_root))
+        self.dst_root = Path(os.fsdecode(dst_root))
+        self.counts = []
+        for _ in KINDS:
+            self.counts.append(_COUNT.unpack_from(view, offset)[0])
+            offset += _COUNT.size
+        self.excluded_counts = []
+        for _ in range(2):
+            self.excluded_counts.append(_COUNT.unpack_from(view, offset)[0])
+            offset += _COUNT.size
+        num_prefixes = _COUNT.unpack_from(view, offset)[0]
+        offset += _COUNT.size
+        self.prefixes = []
+        for _ in range(num_prefixes):
+            prefix, offset = self._read_bytes(view, offset)
+            self.prefixes.append(os.fsdecode(prefix))
+        names_size = _COUNT.unpack_from(view, offset)[0]
+        offset += _COUNT.size
+        num_records = sum(self.counts)
+        columns = []
+        for typecode, length in (('B', num_records), ('Q', num_records),
+                                 ('Q', num_records + 1)):
+            offset += -offset % _ALIGNMENT
+            item_size = struct.calcsize('=' + typecode)
+            columns.append(view[offset:offset + length * item_size].cast(
+                typecode))
+            offset += length * item_size
+        if offset + names_size != len(view):
+            raise ResultStoreError(
+                'Truncated result store "{}"'.format(file_path))
+        self.kinds, self.prefix_ids, self.name_offsets = columns
+        self.names = view[offset:offset + names_size]
+
+    @staticmethod
+    def _read_bytes(view, offset):
+        length = _COUNT.unpack_from(view, offset)[0]
+        offset += _COUNT.size
+        return bytes(view[offset:offset + length]), offset + length
+
+    def get_rel_path(self, index):
+        '''
+        Return the path of a record, relative to the roots.
+        '''
+        name = os.fsdecode(bytes(self.names[
+            self.name_offsets[index]:self.name_offsets[index + 1]]))
+        prefix = self.prefixes[self.prefix_ids[index]]
+        return os.path.join(prefix, name) if prefix else name
+
+    def get_items(self, kind):
+        '''
+        Return a lazy sequence of the records of a kind, in the same form as
+        the corresponding list of `DirsData`.
+        '''
+        kind_index = KINDS.index(kind)
+        start = sum(self.counts[:kind_index])
+        return StoredItems(self, kind, start, start + self.counts[kind_index])
+
+
+class StoredItems:
+    '''
+    A read-only sequence of the records of one kind of a `ResultStore`.
+    '''
+
+    def __init__(self, store, kind, start, stop):
+        self.store = store
+        self.kind = kind
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('StoredItems index out of range')
+        rel_path = self.store.get_rel_path(self.start + index)
+        if self.kind == CONTENT:
+            return (self.store.src_root / rel_path,
+                    self.store.dst_root / rel_path)
+        if self.kind == EXTRA_SRC:
+            return self.store.src_root / rel_path
+        return self.store.dst_root / rel_path
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
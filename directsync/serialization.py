@@ -1,22 +1,88 @@
-import pickle
 import tempfile
 from pathlib import Path
 import hashlib
+import logging
+
+from .events import CONTENT, EXTRA_SRC, EXTRA_DST
+from .result_store import ResultStore, ResultStoreError, write_result_store
+
+logger = logging.getLogger(__file__)
 
 
 def serialize_directsync(dirsync):
+    '''
+    Store the differences found by `dirsync` in a result store file.
+    The settings of `dirsync` itself are not stored; they come from the
+    command line of every run.
+    '''
     filepath = get_serialization_filepath(dirsync)
-    with open(filepath, 'wb') as serial_file:
-        pickle.dump(dirsync, serial_file, protocol=-1)
+    write_result_store(filepath, dirsync.dirs_data)
 
 
 def deserialize_directsync(dirsync):
-    filepath = get_serialization_filepath(dirsync)
-    with open(filepath, 'rb') as serial_file:
-        return pickle.load(serial_file)
+    '''
+    Load the differences stored by `serialize_directsync()` into `dirsync`.
+    The lists of `dirsync.dirs_data` are replaced by read-only sequences
+    which only build the paths as they are accessed.
+    '''
+    _load_result_store(dirsync,
+                       ResultStore(get_serialization_filepath(dirsync)))
+    return dirsync
+
+
+def load_cached_differences(dirsyncs):
+    '''
+    Load the differences stored by `serialize_directsync()` into every one
+    of `dirsyncs`, or into none of them.
+    Returns whether they were loaded; not if any result store is missing,
+    or cannot be read (e.g. of an older version, or cut short), in which
+    case the directories have to be compared again.
+    '''
+    stores = []
+    for dirsync in dirsyncs:
+        filepath = get_serialization_filepath(dirsync)
+        if not filepath.exists():
+            return False
+        try:
+            stores.append(ResultStore(filepath))
+        except (OSError, ResultStoreError) as err:
+            logger.warning('Ignoring the cache: %s', err)
+            return False
+    for dirsync, store in zip(dirsyncs, stores):
+        _load_result_store(dirsync, store)
+    return True
+
+
+def _load_result_store(dirsync, store):
+    dirs_data = dirsync.dirs_data
+    dirs_data.content_diff = store.get_items(CONTENT)
+    dirs_data.data_src.diff = store.get_items(EXTRA_SRC)
+    dirs_data.data_dst.diff = store.get_items(EXTRA_DST)
+    dirs_data.data_src.excluded_count, dirs_data.data_dst.excluded_count =\
+        store.excluded_counts
 
 
 def get_serialization_filepath(dirsync):
+    return _get_dirs_filepath(dirsync, '.results')
+
+
+def get_progress_filepath(dirsync):
+    '''
+    The file where the number of items of the last difference check is kept,
+    for the progress bar of the next one.
+    '''
+    return _get_dirs_filepath(dirsync, '.count')
+
+
+def get_journal_filepath(dirsync):
+    '''
+    The journal of the operations of the last sync, kept until it succeeds;
+    see `SyncJournal`.
+    '''
+    return _get_dirs_filepath(dirsync, '.journal')
+
+
+def _get_dirs_filepath(dirsync, extension):
     '''
     Make a file in `$TEMP/directsync/` with the name being
     a union of the two directory names and their hashes.
@@ -27,10 +93,26 @@ def get_serialization_filepath(dirsync):
     src_path = dirsync.dirs_data.data_src.path.resolve()
     dst_path = dirsync.dirs_data.data_dst.path.resolve()
     filename = str(src_path) + '&&' + str(dst_path)
-    filename = hashlib.sha1(filename.encode()).hexdigest() + '.pickle'
+    filename = hashlib.sha1(filename.encode()).hexdigest() + extension
     filename = src_path.stem + '_' + dst_path.stem + '_' + filename
+    filepath = _get_cache_dir() / filename
+    return filepath
+
+
+def get_index_filepath(dir_path):
+    '''
+    Similar to `get_serialization_filepath()`, but for the persistent
+    metadata index of a single directory tree.
+    '''
+    dir_path = Path(dir_path).resolve()
+    filename = hashlib.sha1(str(dir_path).encode()).hexdigest() + '.index'
+    filename = dir_path.stem + '_' + filename
+    filepath = _get_cache_dir() / filename
+    return filepath
+
+
+def _get_cache_dir():
     tmp_dir = Path(tempfile.gettempdir())
     tmp_dir = tmp_dir / 'directsync'
     tmp_dir.mkdir(exist_ok=True)
-    filepath = tmp_dir / filename
-    return filepath
+    return tmp_dir
@@ -0,0 +1,132 @@
+import threading
+import time
+
+
+class RunStats:
+    '''
+    Thread-safe counters, and timers with a latency histogram, of the
+    operations of a run.
+    The code being measured only calls these methods when stats are
+    enabled, so that they cost nothing otherwise.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        # Counter name -> value
+        self.counters = {}
+        # Timer name -> [count, total seconds, max seconds, histogram], where
+        # `histogram[i]` is the number of durations of less than `2 ** i`
+        # microseconds, but not less than `2 ** (i - 1)`.
+        self.timers = {}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        bucket = int(seconds * 1000000).bit_length()
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0, 0.0, []]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            histogram = timer[3]
+            if bucket >= len(histogram):
+                histogram.extend([0] * (bucket + 1 - len(histogram)))
+            histogram[bucket] += 1
+
+    @staticmethod
+    def _get_percentile(histogram, count, percentile):
+        '''
+        The upper bound, in seconds, of the histogram bucket holding the
+        given percentile; so only accurate within a factor of 2.
+        '''
+        rank = count * percentile / 100
+        seen = 0
+        for bucket, bucket_count in enumerate(histogram):
+            seen += bucket_count
+            if seen >= rank:
+                return (2 ** bucket) / 1000000
+        return (2 ** len(histogram)) / 1000000
+
+    def to_dict(self):
+        '''
+        Return the stats as a JSON-serializable dict.
+        '''
+        with self.lock:
+            timers = {}
+            for name, (count, total, maximum, histogram) in \
+                    self.timers.items():
+                timers[name] = {
+                    'count': count,
+                    'total_seconds': total,
+                    'max_seconds': maximum,
+                    'p50_seconds': min(maximum, self._get_percentile(
+                        histogram, count, 50)),
+                    'p99_seconds': min(maximum, self._get_percentile(
+                        histogram, count, 99)),
+                    'histogram_us': {
+                        '<{}'.format(2 ** bucket): bucket_count
+                        for bucket, bucket_count in enumerate(histogram)
+                        if bucket_count
+                    },
+                }
+            return {
+                'wall_seconds': time.perf_counter() - self.start_time,
+                'counters': dict(self.counters),
+                'timers': timers,
+            }
+
+    def get_report(self):
+        stats = self.to_dict()
+        report_string = '\nStats (wall time {:.3f} s):\n'.format(
+            stats['wall_seconds'])
+        for name in sorted(stats['counters']):
+            report_string += ' - {}: {}\n'.format(name,
+                                                  stats['counters'][name])
+        if stats['timers']:
+            report_string += '{:<22} {:>9} {:>11} {:>10} {:>10} {:>10}\n'\
+                .format('   timer', 'count', 'total (s)', 'p50 (ms)',
+                        'p99 (ms)', 'max (ms)')
+        for name in sorted(stats['timers']):
+            timer = stats['timers'][name]
+            report_string += \
+                ' - {:<19} {:>9} {:>11.3f} {:>10.3f} {:>10.3f} {:>10.3f}\n'\
+                .format(name, timer['count'], timer['total_seconds'],
+                        timer['p50_seconds'] * 1000,
+                        timer['p99_seconds'] * 1000,
+                        timer['max_seconds'] * 1000)
+        return report_string
+
+
+def run_profiled(function, output_path):
+    '''
+    Call `function` under a profiler, and write the profile to
+    `output_path`.
+    If `output_path` ends in `.html` and pyinstrument is installed, it is
+    used and writes an HTML report; otherwise cProfile writes a file for
+    `pstats`.
+    '''
+    if output_path.endswith('.html'):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+        if Profiler is not None:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                return function()
+            finally:
+                profiler.stop()
+                with open(output_path, 'w') as f:
+                    f.write(profiler.output_html())
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        profiler.dump_stats(output_path)
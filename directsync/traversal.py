@@ -0,0 +1,103 @@
+import os
+from pathlib import Path
+
+# How symlinks are handled: `follow`ed, `copy`ed as links, or `skip`ped.
+SYMLINK_POLICIES = ('follow', 'copy', 'skip')
+
+
+class ScanEntry:
+    '''
+    A compact record of a single directory entry, as returned by
+    `scan_dir()`.
+    The file type is taken from the underlying `os.DirEntry`, which gets it
+    for free from the directory read on most platforms, and the `stat()`
+    result is fetched lazily and at most once.
+    Unless `follow_symlinks`, a symlink is neither a file nor a directory
+    but a link (see `is_link`), and is stat'd itself.
+    '''
+    __slots__ = ('name', 'is_dir', 'is_file', 'is_symlink', 'content_hash',
+                 '_dir_entry', '_path')
+
+    def __init__(self, dir_entry, follow_symlinks=True):
+        self.name = dir_entry.name
+        self.is_symlink = dir_entry.is_symlink()
+        self.is_dir = dir_entry.is_dir(follow_symlinks=follow_symlinks)
+        self.is_file = not self.is_dir and\
+            dir_entry.is_file(follow_symlinks=follow_symlinks)
+        # Set once the file is hashed, so that it is only hashed once.
+        self.content_hash = None
+        self._dir_entry = dir_entry
+        self._path = None
+
+    @property
+    def is_link(self):
+        '''
+        Whether the entry is a symlink which is not followed.
+        '''
+        return self.is_symlink and not (self.is_dir or self.is_file)
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = Path(self._dir_entry.path)
+        return self._path
+
+    def stat(self):
+        # `os.DirEntry` caches the result, so repeated calls are free.
+        return self._dir_entry.stat(follow_symlinks=not self.is_link)
+
+    def __repr__(self):
+        return 'ScanEntry({!r})'.format(self._dir_entry.path)
+
+
+def sort_key(name):
+    '''
+    The key by which entry names are ordered for the merging comparison.
+    Mirrors the ordering of `Path` objects (case-insensitive on Windows).
+    '''
+    return os.path.normcase(name)
+
+
+def scan_dir(dir_path, follow_symlinks=True):
+    '''
+    List a directory with a single `os.scandir()` call.
+    Returns a tuple `(files, subdirs)` of `ScanEntry` lists, each sorted by
+    `sort_key()` of the entry name.
+    Entries which are neither files nor directories (broken symlinks,
+    sockets etc.) are left out, just like `Path.is_file()` and
+    `Path.is_dir()` would.
+    `follow_symlinks`: If false, symlinks are not followed but listed along
+                       with the files instead, whatever they point to.
+    '''
+    files = []
+    subdirs = []
+    for dir_entry in os.scandir(str(dir_path)):
+        entry = ScanEntry(dir_entry, follow_symlinks)
+        if entry.is_dir:
+            subdirs.append(entry)
+        elif entry.is_file or (entry.is_symlink and not follow_symlinks):
+            files.append(entry)
+    files.sort(key=lambda x: sort_key(x.name))
+    subdirs.sort(key=lambda x: sort_key(x.name))
+    return files, subdirs
+
+
+def is_dir_loop(dir_path, base_path):
+    '''
+    Whether `dir_path`, typically reached through a symlink, is the same
+    directory (by device and inode) as one of the directories containing it
+    up to `base_path`; following it would then never end.
+    '''
+    try:
+        stat_result = os.stat(str(dir_path))
+    except OSError:
+        return False
+    identity = (stat_result.st_dev, stat_result.st_ino)
+    dir_path = Path(dir_path)
+    base_path = Path(base_path)
+    while dir_path != base_path and dir_path.parent != dir_path:
+        dir_path = dir_path.parent
+        stat_result = os.stat(str(dir_path))
+        if (stat_result.st_dev, stat_result.st_ino) == identity:
+            return True
+    return False
@@ -0,0 +1,453 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from .events import EXTRA_SRC, EXTRA_DST
+from .traversal import scan_dir
+
+# inotify event masks, from `<sys/inotify.h>`.
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |\
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+# The header of a `struct inotify_event`; followed by `len` bytes of name.
+_EVENT = struct.Struct('iIII')
+
+# The polling interval in seconds, where inotify is not available.
+DEFAULT_POLL_INTERVAL = 5.0
+
+_libc = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+        _libc.inotify_init1
+    except (OSError, AttributeError):
+        _libc = None
+
+
+def _is_within(rel_path, rel_dir):
+    '''
+    Whether `rel_path` is `rel_dir` or inside it; the root being `''`.
+    '''
+    return not rel_dir or rel_path == rel_dir or\
+        rel_path.startswith(rel_dir + os.sep)
+
+
+def _scan_watched_dir(root_path, rel_path, filter_scan):
+    '''
+    `scan_dir()` of a directory of the watched tree, without the entries
+    excluded by `filter_scan` (see `DirectSync._get_tree_filter()`), if
+    given.
+    Symlinks are listed with the files, so that symlinked directories are
+    not watched, as they might loop.
+    '''
+    scan = scan_dir(os.path.join(root_path, rel_path), False)
+    if filter_scan is not None:
+        scan = filter_scan(rel_path.replace(os.sep, '/'), scan)
+    return scan
+
+
+class InotifyWatcher:
+    '''
+    Watches a directory tree for changes with Linux's inotify, through
+    ctypes. A watch is added on every directory of the tree which is not
+    excluded, and on the directories created or moved into it later on.
+    '''
+
+    def __init__(self, root_path, filter_scan=None):
+        '''
+        `filter_scan(rel_dir, scan)`: Return the result of `scan_dir()` of a
+                                      directory without its excluded
+                                      entries; those are not watched.
+        '''
+        self.root_path = str(root_path)
+        self.filter_scan = filter_scan
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # Watch descriptor <-> path relative to the root.
+        self.paths = {}
+        self.wds = {}
+        # Set if the kernel dropped events; the whole tree has to be
+        # compared again.
+        self.overflowed = False
+        self._add_tree('')
+
+    def close(self):
+        os.close(self.fd)
+
+    def _add_tree(self, rel_path):
+        path = os.path.join(self.root_path, rel_path)
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                # Already gone.
+                return
+            # e.g. `ENOSPC` for too many watches; see
+            # `/proc/sys/fs/inotify/max_user_watches`.
+            raise OSError(err, os.strerror(err), path)
+        self.paths[wd] = rel_path
+        self.wds[rel_path] = wd
+        for name in self._get_subdir_names(rel_path):
+            self._add_tree(os.path.join(rel_path, name))
+
+    def _get_subdir_names(self, rel_path):
+        '''
+        The names of the subdirectories of `rel_path` to watch.
+        '''
+        try:
+            _, subdirs = _scan_watched_dir(self.root_path, rel_path,
+                                           self.filter_scan)
+        except OSError:
+            return set()
+        return {x.name for x in subdirs}
+
+    def _remove_tree(self, rel_path):
+        for path in [x for x in self.wds if _is_within(x, rel_path)]:
+            wd = self.wds.pop(path)
+            del self.paths[wd]
+            _libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        '''
+        Wait up to `timeout` seconds (forever if `None`) for changes.
+        Returns a dict from the path, relative to the root, of each directory
+        whose entries changed, to whether its whole subtree is new; empty if
+        the timeout expired.
+        '''
+        changes = {}
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changes
+        # The path of each directory -> the names of the directories
+        # created or moved into it.
+        new_dirs = {}
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self._handle_event(wd, mask, name, changes, new_dirs)
+        # Once all the events are read, so that each directory is listed
+        # once to leave out the excluded ones.
+        for rel_path, names in new_dirs.items():
+            subdir_names = self._get_subdir_names(rel_path)
+            for name in names:
+                child_path = os.path.join(rel_path, name)
+                if name in subdir_names and child_path not in self.wds:
+                    self._add_tree(child_path)
+                    changes[child_path] = True
+        return changes
+
+    def _handle_event(self, wd, mask, name, changes, new_dirs):
+        if mask & IN_Q_OVERFLOW:
+            self.overflowed = True
+            return
+        rel_path = self.paths.get(wd)
+        if rel_path is None:
+            return
+        if mask & IN_IGNORED:
+            # The directory is gone, or its watch was removed.
+            del self.paths[wd]
+            if self.wds.get(rel_path) == wd:
+                del self.wds[rel_path]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # Reported as a change of the parent directory.
+            return
+        changes.setdefault(rel_path, False)
+        if mask & IN_ISDIR and name:
+            child_path = os.path.join(rel_path, name)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                new_dirs.setdefault(rel_path, []).append(name)
+            elif mask & IN_MOVED_FROM:
+                self._remove_tree(child_path)
+
+
+class PollingWatcher:
+    '''
+    Same interface as `InotifyWatcher`, but finds the changes by walking the
+    whole tree every `interval` seconds; so it costs time proportional to
+    the size of the tree, but works everywhere.
+    '''
+
+    def __init__(self, root_path, interval=DEFAULT_POLL_INTERVAL,
+                 filter_scan=None):
+        self.root_path = str(root_path)
+        self.interval = interval
+        self.filter_scan = filter_scan
+        self.overflowed = False
+        self.snapshot = self._take_snapshot()
+
+    def close(self):
+        pass
+
+    def _take_snapshot(self):
+        '''
+        Return a dict from the path, relative to the root, of each directory
+        to the metadata of its entries.
+        '''
+        snapshot = {}
+        stack = ['']
+        while stack:
+            rel_path = stack.pop()
+            try:
+                files, subdirs = _scan_watched_dir(self.root_path, rel_path,
+                                                   self.filter_scan)
+            except OSError:
+                continue
+            signature = []
+            for entry in files:
+                try:
+                    stat_result = entry.stat()
+                except OSError:
+                    continue
+                signature.append((entry.name, False, stat_result.st_size,
+                                  stat_result.st_mtime_ns))
+            for entry in subdirs:
+                # The modification time of a directory only changes with its
+                # own entries.
+                signature.append((entry.name, True, 0, 0))
+                stack.append(os.path.join(rel_path, entry.name))
+            snapshot[rel_path] = frozenset(signature)
+        return snapshot
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.monotonic(), 0))
+            time.sleep(delay)
+            old_snapshot = self.snapshot
+            self.snapshot = self._take_snapshot()
+            changes = {
+                rel_path: rel_path not in old_snapshot
+                for rel_path, signature in self.snapshot.items()
+                if old_snapshot.get(rel_path) != signature
+            }
+            if changes or (deadline is not None and
+                           time.monotonic() >= deadline):
+                return changes
+
+
+def get_watcher(root_path, poll_interval=None, filter_scan=None):
+    '''
+    Return an `InotifyWatcher` where available, else a `PollingWatcher`.
+    `poll_interval`: If given, always poll at this interval in seconds.
+    `filter_scan`: See `InotifyWatcher.__init__()`.
+    '''
+    if poll_interval is None and _libc is not None:
+        try:
+            return InotifyWatcher(root_path, filter_scan)
+        except OSError:
+            pass
+    return PollingWatcher(root_path, poll_interval or DEFAULT_POLL_INTERVAL,
+                          filter_scan)
+
+
+def _wait_for_changes(watcher, debounce, max_delay, stop_event=None):
+    '''
+    Wait for changes, then keep collecting them until none came for
+    `debounce` seconds, or for `max_delay` seconds at most.
+    Returns nothing if `stop_event` is set meanwhile.
+    '''
+    while True:
+        # Wake up regularly to check `stop_event`.
+        changes = watcher.wait(None if stop_event is None else 1.0)
+        if changes or watcher.overflowed:
+            break
+        if stop_event is not None and stop_event.is_set():
+            return changes
+    deadline = time.monotonic() + max_delay
+    while True:
+        timeout = min(debounce, deadline - time.monotonic())
+        if timeout <= 0:
+            break
+        more_changes = watcher.wait(timeout)
+        if not more_changes:
+            break
+        for rel_path, is_new in more_changes.items():
+            changes[rel_path] = changes.get(rel_path, False) or is_new
+    return changes
+
+
+class DirWatch:
+    '''
+    Keeps the differences of a `DirectSync` up to date while src changes,
+    and applies the sync actions to them.
+    After a first full comparison, only the directories in which the
+    watcher saw changes are compared again; the differences of the others
+    are kept from before. So the cost is proportional to the rate of
+    changes rather than to the size of the trees.
+    Changes made to dst by other programs are not noticed.
+    The sync arguments are those of `DirectSync.sync_events()`.
+    '''
+
+    def __init__(self, direct_sync, overwrite=False, add_missing=False,
+                 remove_extra=False, dry_run=False, use_trash=False,
+                 preserve_latest=False, stream=sys.stdout):
+        self.direct_sync = direct_sync
+        self.overwrite = overwrite
+        self.add_missing = add_missing
+        self.remove_extra = remove_extra
+        self.dry_run = dry_run
+        self.use_trash = use_trash
+        self.preserve_latest = preserve_latest
+        self.stream = stream
+        # The path relative to the roots of each directory with unresolved
+        # differences -> its `DiffEvent`s.
+        self.differences = {}
+
+    def _get_rel_dir(self, event):
+        dirs_data = self.direct_sync.dirs_data
+        if event.src is not None:
+            rel_dir = event.src.parent.relative_to(dirs_data.data_src.path)
+        else:
+            rel_dir = event.dst.parent.relative_to(dirs_data.data_dst.path)
+        rel_dir = str(rel_dir)
+        return '' if rel_dir == '.' else rel_dir
+
+    def _is_resolved(self, event, failed_items):
+        if self.dry_run:
+            return False
+        if event.kind == EXTRA_DST:
+            return self.remove_extra and str(event.dst) not in failed_items
+        if event.kind == EXTRA_SRC:
+            return self.add_missing and str(event.src) not in failed_items
+        return self.overwrite and str(event.src) not in failed_items
+
+    def _apply(self, events):
+        '''
+        Report and sync `events`, and keep those left unresolved.
+        '''
+        direct_sync = self.direct_sync
+        events = list(events)
+        reported_events = direct_sync.report_events(iter(events),
+                                                    self.stream)
+        failed_items = set()
+        if self.add_missing or self.remove_extra or self.overwrite:
+            direct_sync.sync_events(
+                reported_events, self.overwrite, self.add_missing,
+                self.remove_extra, self.dry_run, self.use_trash,
+                self.preserve_latest, stream=self.stream)
+            self.stream.write(direct_sync.copy_stats.get_report())
+            self.stream.write(direct_sync.get_failures_report())
+            failed_items = {str(x[0]) for x in direct_sync.sync_failures}
+        else:
+            for _ in reported_events:
+                pass
+        for event in events:
+            if not self._is_resolved(event, failed_items):
+                self.differences.setdefault(self._get_rel_dir(event),
+                                            []).append(event)
+        self._update_dirs_data()
+        self.stream.flush()
+
+    def _update_dirs_data(self):
+        dirs_data = self.direct_sync.dirs_data
+        dirs_data.content_diff = []
+        dirs_data.data_src.diff = []
+        dirs_data.data_dst.diff = []
+        for rel_dir in sorted(self.differences):
+            for event in self.differences[rel_dir]:
+                dirs_data.add_event(event)
+
+    def check_all(self):
+        '''
+        Compare the whole trees, and apply the differences found.
+        '''
+        self.differences = {}
+        self._apply(self.direct_sync.iter_differences())
+
+    def check_changes(self, changes):
+        '''
+        Compare again the directories of `changes` (see
+        `InotifyWatcher.wait()`), and apply the differences found.
+        '''
+        direct_sync = self.direct_sync
+        src_base_path = direct_sync.dirs_data.data_src.path
+        dst_base_path = direct_sync.dirs_data.data_dst.path
+        new_dirs = [x for x in changes if changes[x]]
+        events = []
+        for rel_dir in sorted(changes):
+            if any(_is_within(rel_dir, x) and rel_dir != x
+                   for x in new_dirs):
+                # Covered by the comparison of a new ancestor.
+                continue
+            is_new = changes[rel_dir]
+            for path in list(self.differences):
+                if path == rel_dir or (is_new and _is_within(path, rel_dir)):
+                    del self.differences[path]
+            src_dir_path = src_base_path / rel_dir
+            dst_dir_path = dst_base_path / rel_dir
+            if not (src_dir_path.is_dir() and dst_dir_path.is_dir()):
+                # Gone, or new on one side only; so covered by the
+                # comparison of its parent.
+                continue
+            if is_new:
+                events.extend(direct_sync._iter_dir_contents(src_dir_path,
+                                                             dst_dir_path))
+            else:
+                events.extend(direct_sync._compare_dir_pair(src_dir_path,
+                                                            dst_dir_path)[0])
+        self._apply(events)
+
+    def run(self, debounce=2.0, poll_interval=None, stop_event=None):
+        '''
+        Apply the differences, then keep applying the changes of src until
+        `stop_event` (a `threading.Event`) is set, or forever.
+        `debounce`: The number of seconds without changes to wait for before
+                    applying them; they are applied after `10 * debounce`
+                    seconds of continuous changes at the latest.
+        `poll_interval`: See `get_watcher()`.
+        '''
+        src_base_path = self.direct_sync.dirs_data.data_src.path
+        # Start watching first, so that the changes made during the first
+        # comparison are not missed. The excluded directories are not
+        # watched.
+        watcher = get_watcher(
+            src_base_path, poll_interval,
+            self.direct_sync._get_tree_filter(src_base_path))
+        try:
+            self.check_all()
+            while stop_event is None or not stop_event.is_set():
+                changes = _wait_for_changes(watcher, debounce,
+                                            10 * debounce, stop_event)
+                if watcher.overflowed:
+                    watcher.overflowed = False
+                    self.stream.write('\nToo many changes; comparing the'
+                                      ' whole directories again.\n')
+                    self.check_all()
+                elif changes:
+                    self.stream.write('\nChanges in {} directories:\n'.format(
+                        len(changes)))
+                    self.check_changes(changes)
+        finally:
+            watcher.close()
@@ -21,6 +21,7 @@ REQUIRED = [
 ]
 
 EXTRAS = {
+    'fast-hash': ['xxhash', 'blake3'],
 }
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -0,0 +1,39 @@
+import tempfile
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    '''
+    Keep the caches, journals and indexes of every test in its own
+    temporary directory.
+    '''
+    tmp_dir = tmp_path / 'tmp'
+    tmp_dir.mkdir()
+    monkeypatch.setenv('TMPDIR', str(tmp_dir))
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_dir))
+    return tmp_dir / 'directsync'
+
+
+def make_tree(root, files):
+    '''
+    Create the files of `files`, a dict of posix relative paths to their
+    contents (`None` for an empty directory).
+    '''
+    root.mkdir(parents=True, exist_ok=True)
+    for rel_path, content in files.items():
+        path = root / rel_path
+        if content is None:
+            path.mkdir(parents=True, exist_ok=True)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+
+
+def list_tree(root):
+    '''
+    Return the posix relative paths of the files of a tree.
+    '''
+    return sorted(x.relative_to(root).as_posix() for x in root.rglob('*')
+                  if x.is_file())
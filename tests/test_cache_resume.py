@@ -0,0 +1,157 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import directsync.core
+from directsync.core import DirectSync
+from directsync.serialization import get_journal_filepath,\
+                                     get_serialization_filepath
+
+from conftest import list_tree, make_tree
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_cli(*args):
+    '''
+    Run `python -m directsync` with `args`, with the same temporary
+    directory as the test; returns its output.
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = PACKAGE_DIR
+    process = subprocess.run(
+        [sys.executable, '-m', 'directsync'] + [str(x) for x in args] +
+        ['-no-bar'], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    assert process.returncode == 0, process.stderr
+    return process.stdout
+
+
+def make_trees(tmp_path):
+    src = tmp_path / 'src'
+    dst = tmp_path / 'dst'
+    make_tree(src, {
+        '.directsyncignore': b'node_modules/\n*.log\n',
+        'keep.txt': b'keep',
+        'changed.txt': b'new',
+        'sub/a.txt': b'a',
+        'sub/b.log': b'b',
+        'sub/node_modules/c.js': b'c',
+        'sub/deep/d.txt': b'd',
+    })
+    make_tree(dst, {
+        'changed.txt': b'old',
+        'extra.txt': b'extra',
+    })
+    return src, dst
+
+
+EXPECTED_FILES = ['.directsyncignore', 'changed.txt', 'extra.txt',
+                  'keep.txt', 'sub/a.txt', 'sub/deep/d.txt']
+
+
+def test_cache(tmp_path):
+    src, dst = make_trees(tmp_path)
+    direct_sync = DirectSync(src, dst)
+    cache_path = get_serialization_filepath(direct_sync)
+    output = run_cli(src, dst)
+    assert 'Creating cache!' in output
+    assert cache_path.exists()
+    output = run_cli(src, dst, '-cache')
+    assert 'Loading from cache!' in output
+    # The cache is invalidated by a sync.
+    output = run_cli(src, dst, '-cache', '-add')
+    assert 'Loading from cache!' in output
+    assert not cache_path.exists()
+    # The ignore rules of the ancestors of the directories copied apply,
+    # though the trees were not walked.
+    assert list_tree(dst) == EXPECTED_FILES
+    assert (dst / 'changed.txt').read_bytes() == b'old'
+
+
+@pytest.mark.parametrize('content', [b'', b'DSRS\1\0', b'garbage'])
+def test_cache_unreadable(tmp_path, content):
+    '''
+    A cache which cannot be read is a miss, rather than an error.
+    '''
+    src, dst = make_trees(tmp_path)
+    cache_path = get_serialization_filepath(DirectSync(src, dst))
+    cache_path.write_bytes(content)
+    output = run_cli(src, dst, '-cache', '-add')
+    assert 'Creating cache!' in output
+    assert list_tree(dst) == EXPECTED_FILES
+
+
+def test_cache_fan_out(tmp_path):
+    src, dst1 = make_trees(tmp_path)
+    dst2 = tmp_path / 'dst2'
+    dst2.mkdir()
+    output = run_cli(src, dst1, dst2)
+    assert 'Creating cache!' in output
+    # Only one of the caches is readable.
+    get_serialization_filepath(DirectSync(src, dst2)).write_bytes(b'')
+    output = run_cli(src, dst1, dst2, '-cache', '-add')
+    assert 'Creating cache!' in output
+    assert list_tree(dst1) == EXPECTED_FILES
+    assert list_tree(dst2) == [x for x in EXPECTED_FILES
+                               if x != 'extra.txt']
+
+
+def interrupt_sync(src, dst, monkeypatch, exception):
+    '''
+    Run a journaled sync which raises `exception` when copying `d.txt`,
+    after the other files of `sub` are copied.
+    '''
+    copy_file_atomic = directsync.core.copy_file_atomic
+
+    def failing_copy_file_atomic(path_src, path_dst, *args):
+        if os.path.basename(str(path_src)) == 'd.txt':
+            raise exception
+        return copy_file_atomic(path_src, path_dst, *args)
+    direct_sync = DirectSync(src, dst, use_journal=True)
+    direct_sync.check_differences()
+    with monkeypatch.context() as patch:
+        patch.setattr(directsync.core, 'copy_file_atomic',
+                      failing_copy_file_atomic)
+        try:
+            direct_sync.sync_dirs(overwrite=True, add_missing=True,
+                                  remove_extra=True)
+        except KeyboardInterrupt:
+            pass
+    return direct_sync
+
+
+@pytest.mark.parametrize('exception', [
+    KeyboardInterrupt(), OSError(5, 'Input/output error')])
+def test_resume(tmp_path, monkeypatch, exception):
+    src, dst = make_trees(tmp_path)
+    direct_sync = interrupt_sync(src, dst, monkeypatch, exception)
+    journal_path = get_journal_filepath(direct_sync)
+    assert journal_path.exists()
+    assert 'sub/deep/d.txt' not in list_tree(dst)
+    direct_sync = DirectSync(src, dst)
+    assert direct_sync.resume_sync()
+    assert not direct_sync.sync_failures
+    assert not journal_path.exists()
+    assert list_tree(dst) == [x for x in EXPECTED_FILES
+                              if x != 'extra.txt']
+    assert (dst / 'changed.txt').read_bytes() == b'new'
+    assert not direct_sync.resume_sync()
+
+
+def test_resume_cli(tmp_path, monkeypatch):
+    src, dst = make_trees(tmp_path)
+    output = run_cli(src, dst, '-resume')
+    assert 'No interrupted sync to resume!' in output
+    direct_sync = interrupt_sync(src, dst, monkeypatch, KeyboardInterrupt())
+    run_cli(src, dst)
+    cache_path = get_serialization_filepath(direct_sync)
+    assert cache_path.exists()
+    run_cli(src, dst, '-resume')
+    assert not get_journal_filepath(direct_sync).exists()
+    # The cache is invalidated by the sync.
+    assert not cache_path.exists()
+    assert list_tree(dst) == [x for x in EXPECTED_FILES
+                              if x != 'extra.txt']
@@ -0,0 +1,147 @@
+import io
+import os
+
+import pytest
+
+from directsync.core import DirectSync
+from directsync.events import CONTENT
+from directsync.file_comparison import compare_file_contents_buffered,\
+                                       compare_file_contents_mmap,\
+                                       compare_file_contents_readinto
+import directsync.file_comparison as file_comparison
+
+MTIME_NS = 1500000000 * 10 ** 9
+
+
+def make_pair(tmp_path, src_content, dst_content, same_mtime=True):
+    src = tmp_path / 'src'
+    dst = tmp_path / 'dst'
+    src.mkdir()
+    dst.mkdir()
+    (src / 'file.bin').write_bytes(src_content)
+    (dst / 'file.bin').write_bytes(dst_content)
+    os.utime(str(src / 'file.bin'), ns=(MTIME_NS, MTIME_NS))
+    dst_mtime_ns = MTIME_NS if same_mtime else MTIME_NS + 10 ** 9
+    os.utime(str(dst / 'file.bin'), ns=(dst_mtime_ns, dst_mtime_ns))
+    return src, dst
+
+
+def get_content_diff(src, dst, compare_mode, **options):
+    direct_sync = DirectSync(src, dst, compare_mode=compare_mode, **options)
+    return [x for x in direct_sync.iter_differences() if x.kind == CONTENT]
+
+
+@pytest.mark.parametrize('compare_mode, same_mtime, is_different', [
+    ('size', True, False),
+    ('size', False, False),
+    ('mtime', True, False),
+    ('mtime', False, True),
+    ('mtime-content', True, False),
+    ('mtime-content', False, True),
+    ('sampled', True, True),
+    ('full', True, True),
+    ('checksum', True, True),
+])
+def test_same_size_different_content(tmp_path, compare_mode, same_mtime,
+                                     is_different):
+    src, dst = make_pair(tmp_path, b'a' * 1000, b'a' * 999 + b'b',
+                         same_mtime)
+    assert bool(get_content_diff(src, dst, compare_mode)) == is_different
+
+
+@pytest.mark.parametrize('compare_mode', [
+    'size', 'mtime-content', 'sampled', 'full', 'checksum'])
+def test_identical_files(tmp_path, compare_mode):
+    '''
+    Only `mtime` trusts the modification times alone.
+    '''
+    src, dst = make_pair(tmp_path, b'abc' * 1000, b'abc' * 1000,
+                         same_mtime=False)
+    assert not get_content_diff(src, dst, compare_mode)
+
+
+@pytest.mark.parametrize('compare_mode', [
+    'size', 'mtime', 'mtime-content', 'sampled', 'full', 'checksum'])
+def test_different_sizes(tmp_path, compare_mode):
+    src, dst = make_pair(tmp_path, b'abc', b'abcd')
+    assert len(get_content_diff(src, dst, compare_mode)) == 1
+
+
+def test_mtime_modify_window(tmp_path):
+    src, dst = make_pair(tmp_path, b'abc', b'abc', same_mtime=False)
+    assert get_content_diff(src, dst, 'mtime')
+    assert not get_content_diff(src, dst, 'mtime', comparison_options={
+        'modify_window': 2})
+
+
+def test_sampled_big_binary_files(tmp_path):
+    '''
+    Only the sampled blocks of the files above the threshold are compared.
+    '''
+    content = bytes(range(256)) * 4096
+    changed = content[:-1] + b'\1'
+    src, dst = make_pair(tmp_path, content, changed)
+    options = {'threshold': 65536, 'sample_count': 4, 'block_size': 4096,
+               'seed': 0}
+    assert get_content_diff(src, dst, 'sampled', comparison_options=options)
+    assert not get_content_diff(src, src, 'sampled',
+                                comparison_options=options)
+
+
+class ShortReadFileIO(io.FileIO):
+    '''
+    A file whose reads return at most `max_read` bytes, as those of a pipe
+    or a network filesystem may.
+    '''
+    max_read = 1000
+
+    def readinto(self, buffer):
+        with memoryview(buffer) as view:
+            return super().readinto(view[:self.max_read])
+
+
+def open_short_read(file_path, mode='r', buffering=-1):
+    return ShortReadFileIO(file_path, mode)
+
+
+@pytest.mark.parametrize('size', [0, 1, 4095, 4096, 100000, 300007])
+def test_compare_file_contents(tmp_path, monkeypatch, size):
+    path1 = tmp_path / 'file1'
+    path2 = tmp_path / 'file2'
+    path3 = tmp_path / 'file3'
+    content = os.urandom(size)
+    path1.write_bytes(content)
+    path2.write_bytes(content)
+    if size:
+        path3.write_bytes(content[:-1] + bytes([content[-1] ^ 1]))
+    for function in (compare_file_contents_buffered,
+                     compare_file_contents_readinto,
+                     compare_file_contents_mmap):
+        assert function(path1, path2)
+        if size:
+            assert not function(path1, path3)
+    monkeypatch.setattr(file_comparison, 'open', open_short_read,
+                        raising=False)
+    assert compare_file_contents_readinto(path1, path2)
+    if size:
+        assert not compare_file_contents_readinto(path1, path3)
+
+
+def test_compare_file_contents_uneven_reads(tmp_path, monkeypatch):
+    '''
+    The 2 files of a pair may come in chunks of different sizes.
+    '''
+    path1 = tmp_path / 'file1'
+    path2 = tmp_path / 'file2'
+    content = os.urandom(100000)
+    path1.write_bytes(content)
+    path2.write_bytes(content)
+
+    def open_uneven(file_path, mode='r', buffering=-1):
+        if file_path == str(path1):
+            return open_short_read(file_path, mode)
+        return io.open(file_path, mode, buffering)
+    monkeypatch.setattr(file_comparison, 'open', open_uneven, raising=False)
+    assert compare_file_contents_readinto(path1, path2)
+    path2.write_bytes(content[:-1] + bytes([content[-1] ^ 1]))
+    assert not compare_file_contents_readinto(path1, path2)
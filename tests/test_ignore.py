@@ -0,0 +1,138 @@
+import pytest
+
+from directsync.core import DirectSync
+from directsync.ignore import IgnoreRules, PathMatcher, read_ignore_file
+
+from conftest import list_tree, make_tree
+
+
+@pytest.mark.parametrize('lines, rel_path, is_dir, result', [
+    (['*.log'], 'a.log', False, True),
+    (['*.log'], 'a/b/c.log', False, True),
+    (['*.log'], 'a.txt', False, None),
+    # `*` and `?` do not match `/`, `**` does.
+    (['a/*.log'], 'a/b/c.log', False, None),
+    (['a/**/*.log'], 'a/b/c.log', False, True),
+    (['a/**/*.log'], 'a/c.log', False, True),
+    (['a?c'], 'abc', False, True),
+    (['a?c'], 'a/c', False, None),
+    (['[!a]b'], 'cb', False, True),
+    (['[!a]b'], 'ab', False, None),
+    # A pattern with a slash is anchored to the directory of the rules.
+    (['/build'], 'build', True, True),
+    (['/build'], 'src/build', True, None),
+    (['doc/build'], 'src/doc/build', True, None),
+    (['build'], 'src/build', True, True),
+    # A trailing slash only matches directories.
+    (['cache/'], 'cache', True, True),
+    (['cache/'], 'cache', False, None),
+    # The last matching rule decides.
+    (['*.log', '!keep.log'], 'keep.log', False, False),
+    (['!keep.log', '*.log'], 'keep.log', False, True),
+    (['# *.log', '', '  '], 'a.log', False, None),
+    (['\\#a'], '#a', False, True),
+    (['\\!a'], '!a', False, True),
+])
+def test_ignore_rules(lines, rel_path, is_dir, result):
+    assert IgnoreRules(lines).match(rel_path, is_dir) is result
+
+
+def test_read_ignore_file(tmp_path):
+    ignore_file_path = tmp_path / 'rules'
+    ignore_file_path.write_text('# comment\nnode_modules/\n*.log\n')
+    rules = read_ignore_file(ignore_file_path)
+    assert rules.match('node_modules', True)
+    assert rules.match('x/y.log', False)
+    assert rules.match('node_modules', False) is None
+
+
+def test_path_matcher_precedence():
+    '''
+    The rules of a directory are relative to it, and take precedence over
+    those of its ancestors.
+    '''
+    root = PathMatcher(IgnoreRules(['*.log', 'tmp/']))
+    sub = PathMatcher(IgnoreRules(['!keep.log', '/data']), 'sub', root)
+    assert not root.is_empty and not sub.is_empty
+    assert sub.is_excluded('sub/a.log', False)
+    assert not sub.is_excluded('sub/keep.log', False)
+    assert root.is_excluded('keep.log', False)
+    assert sub.is_excluded('sub/tmp', True)
+    assert sub.is_excluded('sub/data', False)
+    assert not sub.is_excluded('sub/x/data', False)
+    assert not sub.is_excluded('sub/a.txt', False)
+
+
+def test_path_matcher_is_empty():
+    root = PathMatcher(IgnoreRules([]))
+    assert root.is_empty
+    assert PathMatcher(IgnoreRules([]), 'sub', root).is_empty
+    assert not PathMatcher(IgnoreRules(['a']), 'sub', root).is_empty
+    assert not root.is_excluded('a', False)
+
+
+def make_ignore_trees(tmp_path):
+    src = tmp_path / 'src'
+    dst = tmp_path / 'dst'
+    make_tree(src, {
+        '.directsyncignore': b'*.log\nnode_modules/\n',
+        'keep.txt': b'keep',
+        'a.log': b'log',
+        'node_modules/x.js': b'x',
+        'sub/.directsyncignore': b'!keep.log\n',
+        'sub/keep.log': b'keep',
+        'sub/other.log': b'log',
+        'sub/deep/node_modules/y.js': b'y',
+        'sub/deep/z.txt': b'z',
+    })
+    dst.mkdir()
+    return src, dst
+
+
+EXPECTED_FILES = [
+    '.directsyncignore', 'keep.txt', 'sub/.directsyncignore',
+    'sub/deep/z.txt', 'sub/keep.log']
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_sync_ignore_files(tmp_path, jobs):
+    '''
+    The ignored items are neither reported nor copied, even inside the
+    directories copied as a whole.
+    '''
+    src, dst = make_ignore_trees(tmp_path)
+    direct_sync = DirectSync(src, dst, jobs=jobs)
+    direct_sync.check_differences()
+    assert sorted(x.name for x in direct_sync.dirs_data.data_src.diff) == [
+        '.directsyncignore', 'keep.txt', 'sub']
+    # Only counted in the directories compared, not in those extra.
+    assert direct_sync.dirs_data.data_src.excluded_count == 2
+    direct_sync.sync_dirs(add_missing=True)
+    assert not direct_sync.sync_failures
+    assert list_tree(dst) == EXPECTED_FILES
+
+
+def test_sync_ignore_rules(tmp_path):
+    src, dst = make_ignore_trees(tmp_path)
+    direct_sync = DirectSync(src, dst, ignore_rules=['*.txt'],
+                             ignore_file_name=None)
+    direct_sync.check_differences()
+    direct_sync.sync_dirs(add_missing=True)
+    assert list_tree(dst) == [
+        '.directsyncignore', 'a.log', 'node_modules/x.js',
+        'sub/.directsyncignore', 'sub/deep/node_modules/y.js',
+        'sub/keep.log', 'sub/other.log']
+
+
+def test_ignored_names_without_walk(tmp_path):
+    '''
+    The rules of the ancestors of a directory are found even if the trees
+    were not walked, e.g. with differences loaded from the cache.
+    '''
+    src, dst = make_ignore_trees(tmp_path)
+    direct_sync = DirectSync(src, dst)
+    names = ['node_modules', 'keep.log', 'other.log', 'z.txt']
+    assert direct_sync._get_ignored_names(
+        str(src / 'sub' / 'deep'), names) == {'node_modules', 'other.log'}
+    assert direct_sync._get_ignored_names(str(src), names) == {
+        'node_modules', 'keep.log', 'other.log'}
@@ -0,0 +1,132 @@
+import struct
+
+import pytest
+
+from directsync.core import DirectSync, DirsData
+from directsync.events import CONTENT, EXTRA_SRC, EXTRA_DST
+from directsync.result_store import MAGIC, VERSION, ResultStore,\
+                                    ResultStoreError, write_result_store
+from directsync.serialization import get_serialization_filepath,\
+                                     load_cached_differences,\
+                                     serialize_directsync
+
+
+def make_dirs_data(src_root, dst_root):
+    dirs_data = DirsData(src_root, dst_root)
+    src = dirs_data.data_src.path
+    dst = dirs_data.data_dst.path
+    dirs_data.content_diff = [(src / 'a' / 'b.txt', dst / 'a' / 'b.txt'),
+                              (src / 'top.txt', dst / 'top.txt')]
+    dirs_data.data_src.diff = [src / 'a' / 'new', src / 'a' / 'c' / 'ü.bin']
+    dirs_data.data_dst.diff = [dst / 'old']
+    dirs_data.data_src.excluded_count = 3
+    dirs_data.data_dst.excluded_count = 5
+    return dirs_data
+
+
+@pytest.mark.parametrize('src_root, dst_root', [
+    ('{}/src', '{}/dst'),
+    ('/', '{}/dst'),
+    ('{}/src/', '{}//dst//'),
+])
+def test_round_trip(tmp_path, src_root, dst_root):
+    dirs_data = make_dirs_data(src_root.format(tmp_path),
+                               dst_root.format(tmp_path))
+    file_path = tmp_path / 'store.results'
+    write_result_store(file_path, dirs_data)
+    store = ResultStore(file_path)
+    assert store.src_root == dirs_data.data_src.path
+    assert store.dst_root == dirs_data.data_dst.path
+    assert list(store.get_items(CONTENT)) == dirs_data.content_diff
+    assert list(store.get_items(EXTRA_SRC)) == dirs_data.data_src.diff
+    assert list(store.get_items(EXTRA_DST)) == dirs_data.data_dst.diff
+    assert store.excluded_counts == [3, 5]
+    items = store.get_items(EXTRA_SRC)
+    assert len(items) == 2
+    assert items[-1] == dirs_data.data_src.diff[-1]
+    assert items[:1] == dirs_data.data_src.diff[:1]
+    with pytest.raises(IndexError):
+        items[2]
+    # Written aside and renamed.
+    assert [x.name for x in tmp_path.iterdir() if x.is_file()] == [
+        'store.results']
+
+
+def test_round_trip_empty(tmp_path):
+    dirs_data = DirsData(tmp_path, tmp_path)
+    file_path = tmp_path / 'store.results'
+    write_result_store(file_path, dirs_data)
+    store = ResultStore(file_path)
+    for kind in (CONTENT, EXTRA_SRC, EXTRA_DST):
+        assert list(store.get_items(kind)) == []
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: b'',
+    lambda data: data[:3],
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:-1],
+    lambda data: data + b'\0',
+    lambda data: b'XXXX' + data[4:],
+    lambda data: data[:4] + struct.pack('=H', VERSION - 1) + data[6:],
+])
+def test_corrupt(tmp_path, corrupt):
+    file_path = tmp_path / 'store.results'
+    write_result_store(file_path, make_dirs_data(tmp_path / 'src',
+                                                 tmp_path / 'dst'))
+    data = file_path.read_bytes()
+    assert data.startswith(MAGIC)
+    file_path.write_bytes(corrupt(data))
+    with pytest.raises(ResultStoreError):
+        ResultStore(file_path)
+
+
+def make_direct_syncs(tmp_path):
+    direct_syncs = []
+    for dst_name in ('dst1', 'dst2'):
+        src = tmp_path / 'src'
+        dst = tmp_path / dst_name
+        (src / 'a').mkdir(parents=True, exist_ok=True)
+        (src / 'a' / 'x.txt').write_bytes(b'x')
+        dst.mkdir()
+        direct_sync = DirectSync(src, dst)
+        direct_sync.check_differences()
+        direct_syncs.append(direct_sync)
+    return direct_syncs
+
+
+def test_load_cached_differences(tmp_path):
+    direct_syncs = make_direct_syncs(tmp_path)
+    for direct_sync in direct_syncs:
+        serialize_directsync(direct_sync)
+    loaded_syncs = [DirectSync(x.dirs_data.data_src.path,
+                               x.dirs_data.data_dst.path)
+                    for x in direct_syncs]
+    assert load_cached_differences(loaded_syncs)
+    for direct_sync, loaded_sync in zip(direct_syncs, loaded_syncs):
+        assert list(loaded_sync.dirs_data.data_src.diff) ==\
+            direct_sync.dirs_data.data_src.diff
+        assert loaded_sync.get_report() == direct_sync.get_report()
+
+
+@pytest.mark.parametrize('content', [None, b'', b'DSRS\1\0', b'garbage'])
+def test_load_cached_differences_miss(tmp_path, content):
+    '''
+    The differences are loaded into all of the `DirectSync`s or into none.
+    '''
+    direct_syncs = make_direct_syncs(tmp_path)
+    serialize_directsync(direct_syncs[0])
+    if content is not None:
+        get_serialization_filepath(direct_syncs[1]).write_bytes(content)
+    loaded_syncs = [DirectSync(x.dirs_data.data_src.path,
+                               x.dirs_data.data_dst.path)
+                    for x in direct_syncs]
+    assert not load_cached_differences(loaded_syncs)
+    for loaded_sync in loaded_syncs:
+        assert loaded_sync.dirs_data.data_src.diff == []
+
+
+def test_cache_file_path(tmp_path, cache_dir):
+    direct_sync = make_direct_syncs(tmp_path)[0]
+    assert get_serialization_filepath(direct_sync).parent == cache_dir
+    assert cache_dir.is_dir()